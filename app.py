@@ -1,17 +1,26 @@
 import os
 import streamlit as st
-import tempfile
 from dotenv import load_dotenv
 import json
 import re
-from PIL import Image
 import base64
-import fitz # PyMuPDF
+from typing import List
 
-from langchain_ollama import ChatOllama
-from langchain_google_genai.chat_models import ChatGoogleGenerativeAI
-from google.api_core.exceptions import ResourceExhausted
-from langchain_core.messages import HumanMessage
+from backends import lazy
+from concurrent_pipeline import with_script_ctx
+from gemini_scheduler import chat_model, get_scheduler, retryable_errors
+from json_stream import stream_reply
+from llm_batch import BatchDocument, BatchExtractor, numeric_fields
+from llm_cache import StandInModel, get_llm_cache, make_key, use_standin
+from local_pipeline import (OCR_BACKEND_ERRORS, format_timings, get_ollama_model, image_text_tiered, pdf_text_tiered,
+                            tesseract_text, timed)
+from pdf_text import extract_text
+from split_policy import get_policies
+from tiered_extract import get_escalation_stats, triage
+from uploads import Upload, get_upload_store
+
+# LangChain and the Google clients are imported on first use, not before the page is drawn
+langchain_messages = lazy('langchain_messages')
 
 # ==============================================================================
 # 1. CORE LOGIC - We now have TWO distinct analysis pipelines.
@@ -19,9 +28,12 @@ from langchain_core.messages import HumanMessage
 
 def get_llm(provider, ollama_model, gemini_model, api_key):
     """Initializes and returns the selected conversational language model."""
+    if use_standin():
+        return StandInModel(gemini_model if provider == "Gemini (Google)" else ollama_model)
     if provider == "Ollama (Local)":
         try:
-            return ChatOllama(model=ollama_model, temperature=0)
+            # Pooled and kept loaded on the Ollama server between reruns
+            return get_ollama_model(ollama_model)
         except Exception as e:
             st.error(f"Ollama initialization failed: {e}")
             st.stop()
@@ -30,77 +42,157 @@ def get_llm(provider, ollama_model, gemini_model, api_key):
             st.warning("נדרש מפתח API של Google Gemini.")
             st.stop()
         try:
-            return ChatGoogleGenerativeAI(model=gemini_model, google_api_key=api_key, temperature=0)
+            # One client per model and key for the whole process, not one per file and rerun
+            return chat_model(gemini_model, api_key)
         except Exception as e:
             st.error(f"Gemini initialization failed: {e}")
             st.stop()
 
-def analyze_document_with_gemini(file_path: str, llm: ChatGoogleGenerativeAI) -> dict:
+def live_fields():
+    """A placeholder showing a streamed reply's fields as they arrive, and the on_field callback filling it"""
+    live = st.empty()
+    fields = {}
+    def show(key, value):
+        fields[key] = value
+        live.caption(" · ".join(f"{k}: {v}" for k, v in fields.items()))
+    return live, show
+
+def analyze_document_with_gemini(upload: Upload, llm: 'ChatGoogleGenerativeAI') -> dict:
     """Uses Gemini 1.5 Pro's multimodal capabilities for analysis."""
-    st.write(f"🕵️‍♂️ מנתח את הקובץ עם Gemini Vision: `{os.path.basename(file_path)}`...")
-    with open(file_path, "rb") as f:
-        file_bytes = f.read()
-    mime_type = "application/pdf" if file_path.endswith(".pdf") else f"image/{os.path.splitext(file_path)[1].lstrip('.')}"
+    st.write(f"🕵️‍♂️ מנתח את הקובץ עם Gemini Vision: `{upload.name}`...")
     prompt = """
     Analyze the provided file (image or PDF) and return a structured JSON object.
     First, determine the document_type: "arnona_bill", "utility_bill", "meter_reading", or "unknown".
     Then, extract the relevant numerical values for that type: 'total_amount', 'total_consumption', 'fixed_charges', 'meter_reading'.
+    For a utility_bill also give 'bill_type': "electricity" or "water".
     Use 0 for missing values. Respond with ONLY a single, valid JSON object.
     """
-    message = HumanMessage(content=[{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{base64.b64encode(file_bytes).decode()}"}}])
-    response = llm.invoke([message])
-    json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
-    if not json_match: raise ValueError(f"Gemini did not return valid JSON. Raw response: {response.content}")
+    message = langchain_messages.HumanMessage(content=[{"type": "text", "text": prompt}, {"type": "image_url", "image_url": {"url": f"data:{upload.mime_type};base64,{base64.b64encode(upload.view).decode()}"}}])
+    # The same file analyzed again (rerun, retry) is answered from the cache
+    model_name = getattr(llm, "model", type(llm).__name__)
+    # Rate limited and retried on quota errors; the same file analyzed concurrently is one request.
+    # Streamed: the fields show up as they arrive and the reply is cut after its JSON object
+    live, show = live_fields()
+    ask_gemini = lambda: get_scheduler().call(make_key(model_name, prompt, upload.view),
+                                              with_script_ctx(lambda: stream_reply(llm, [message], show)))
+    result = get_llm_cache().get_or_compute(model_name, prompt, upload.view, ask_gemini,
+                                            parse=parse_gemini_reply)
+    live.empty()
+    return result
+
+def parse_gemini_reply(content: str) -> dict:
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not json_match: raise ValueError(f"Gemini did not return valid JSON. Raw response: {content}")
     try: return json.loads(json_match.group(0))
     except json.JSONDecodeError: raise ValueError(f"Gemini returned malformed JSON: {json_match.group(0)}")
 
-def analyze_document_locally_with_ollama(file_path: str, structure_llm: ChatOllama) -> dict:
-    """
-    A completely local pipeline. Uses Llava for OCR and another Ollama model for structuring.
-    """
-    st.write(f"🕵️‍♂️ מנתח את הקובץ מקומית עם Ollama: `{os.path.basename(file_path)}`...")
-    extracted_text = ""
-    # --- Step 1: Use Llava for OCR on the image or PDF pages ---
-    vision_model = ChatOllama(model="llava", temperature=0)
-    if file_path.endswith('.pdf'):
-        doc = fitz.open(file_path)
-        for i, page in enumerate(doc):
-            st.write(f"  - מעבד עמוד {i+1} עם llava...")
-            pix = page.get_pixmap(dpi=200)
-            img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            with tempfile.NamedTemporaryFile(suffix=".jpeg", delete=False) as tmp:
-                img.convert("RGB").save(tmp, format="jpeg")
-                tmp_path = tmp.name
-            with open(tmp_path, "rb") as f:
-                base64_image = base64.b64encode(f.read()).decode('utf-8')
-            os.remove(tmp_path)
-            msg = HumanMessage(content=[{"type": "text", "text": "Extract all text from this image."}, {"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"}])
-            res = vision_model.invoke([msg])
-            extracted_text += res.content + "\n"
-        doc.close()
-    else: # It's an image
-        with open(file_path, "rb") as f:
-            base64_image = base64.b64encode(f.read()).decode('utf-8')
-        msg = HumanMessage(content=[{"type": "text", "text": "Extract all text from this image."}, {"type": "image_url", "image_url": f"data:image/jpeg;base64,{base64_image}"}])
-        res = vision_model.invoke([msg])
-        extracted_text = res.content
-    
-    if not extracted_text.strip(): raise ValueError("Llava (vision model) failed to extract any text.")
-    
-    # --- Step 2: Use the main Ollama model (e.g., codellama) to structure the text ---
-    st.write("🧠 מבין את הטקסט שחולץ...")
-    prompt = f"""
+STRUCTURE_PROMPT = """
     Analyze the text below. Determine the document_type ("arnona_bill", "utility_bill", "meter_reading", or "unknown")
     and extract the relevant values: 'total_amount', 'total_consumption', 'fixed_charges', 'meter_reading'.
+    For a utility_bill also give 'bill_type': "electricity" or "water".
     Use 0 for missing values. Respond with ONLY a single, valid JSON object.
+    """
+DOCUMENT_TYPES = ("arnona_bill", "utility_bill", "meter_reading", "unknown")
+BILL_DOCUMENT_TYPES = ("arnona_bill", "utility_bill")
+UTILITY_BILL_TYPES = ("electricity", "water")
+FALLBACK_UTILITY_POLICY = "electricity"  # for a utility bill whose type neither the model nor the keywords tell
+is_numeric_document = numeric_fields('total_amount', 'total_consumption', 'fixed_charges', 'meter_reading')
+
+def is_structured_document(data) -> bool:
+    """A batched answer is only accepted if it has every field the calculation reads"""
+    return is_numeric_document(data) and data.get("document_type") in DOCUMENT_TYPES
+
+def bill_document(fields: dict) -> dict:
+    """Reconciled regex fields (tiered_extract.triage) as the structured document execute_calculation reads"""
+    return {"document_type": "arnona_bill" if fields["bill_type"] == "tax" else "utility_bill",
+            "total_amount": fields["total_amount"], "total_consumption": fields["consumption"] or 0.0,
+            "fixed_charges": fields["fixed_charges"], "meter_reading": 0, "bill_type": fields["bill_type"]}
+
+def with_bill_type(document: dict, detected) -> dict:
+    """The model's document, with the bill type keyword detection (triage) found when the model gave no utility type"""
+    if isinstance(document, dict) and document.get("bill_type") not in UTILITY_BILL_TYPES and detected in UTILITY_BILL_TYPES:
+        return {**document, "bill_type": detected}
+    return document
+
+def show_tier(reason) -> None:
+    st.caption("⚡ חולץ ללא LLM: הסכומים מתאזנים" if reason is None else f"🧠 נשלח למודל: {reason}")
+
+def record_tier(document: dict, reason) -> None:
+    """Count the outcome for bills only; meter photos always go to a model and would skew the escalation share"""
+    if document.get("document_type") in BILL_DOCUMENT_TYPES:
+        get_escalation_stats().record(reason)
+
+def analyze_document_tiered(upload: Upload, llm: 'ChatGoogleGenerativeAI') -> dict:
+    """Regex on the file's own text first (PDF text layer, tesseract for scans and photos); Gemini only if it does not reconcile"""
+    try:
+        text = extract_text(upload.view)[0] if upload.is_pdf else tesseract_text(upload.view, {})
+    except OCR_BACKEND_ERRORS as e:
+        # Gemini reads the file itself; a missing tesseract binary or an unreadable PDF must not stop it
+        st.caption(f"⚠️ קריאת טקסט מקומית נכשלה: {e}")
+        text = ""
+    fields, reason = triage(text)
+    show_tier(reason)
+    document = bill_document(fields) if reason is None else with_bill_type(analyze_document_with_gemini(upload, llm), fields.get("bill_type"))
+    record_tier(document, reason)
+    return document
+
+def extract_text_locally(upload: Upload, timings: dict) -> str:
+    """Step 1 of the local pipeline: text layer, then tesseract, and llava only for what is still unreadable."""
+    st.write(f"🕵️‍♂️ מנתח את הקובץ מקומית עם Ollama: `{upload.name}`...")
+    if upload.is_pdf:
+        extracted_text, pages = pdf_text_tiered(upload.view, timings, on_llava_page=lambda page_no: st.write(f"  - מעבד עמוד {page_no} עם llava..."))
+        st.caption(" | ".join(f"עמוד {p['page']}: {p['source']}" for p in pages))
+    else: # It's an image
+        extracted_text, source = image_text_tiered(upload.view, upload.mime_type, timings)
+        st.caption(f"מקור הטקסט: {source}")
+    
+    if not extracted_text.strip(): raise ValueError(f"No text could be extracted from {upload.name}, not even by llava.")
+    return extracted_text
+
+def structure_text_with_ollama(extracted_text: str, structure_llm: 'ChatOllama') -> dict:
+    """Step 2 of the local pipeline: the main Ollama model (e.g., codellama) structures one document's text."""
+    prompt = f"""{STRUCTURE_PROMPT}
     Text: --- {extracted_text} ---
     """
-    response = structure_llm.invoke(prompt)
-    json_match = re.search(r'\{.*\}', response.content, re.DOTALL)
-    if not json_match: raise ValueError(f"The structuring model did not return valid JSON. Raw response: {response.content}")
+    live, show = live_fields()
+    content = stream_reply(structure_llm, prompt, show)
+    live.empty()
+    json_match = re.search(r'\{.*\}', content, re.DOTALL)
+    if not json_match: raise ValueError(f"The structuring model did not return valid JSON. Raw response: {content}")
     try: return json.loads(json_match.group(0))
     except json.JSONDecodeError: raise ValueError(f"The structuring model returned malformed JSON: {json_match.group(0)}")
 
+def analyze_documents_locally_with_ollama(uploads: List[Upload], structure_llm: 'ChatOllama') -> List[dict]:
+    """
+    A completely local pipeline. Reads each file's text the cheapest way that works, then structures all the documents' texts in as few
+    requests as possible; a document whose batched answer is invalid is structured again on its own.
+    """
+    texts, results, reasons, detected = [], {}, {}, {}
+    for i, upload in enumerate(uploads):
+        timings = {}
+        texts.append(extract_text_locally(upload, timings))
+        st.caption(f"⏱️ {format_timings(timings)}")
+        # Documents whose regex fields reconcile skip the structuring model
+        fields, reason = triage(texts[-1])
+        show_tier(reason)
+        detected[i] = fields.get("bill_type")
+        if reason is None:
+            results[i] = bill_document(fields)
+        reasons[i] = reason or ("text read by llava" if 'llava' in timings else None)
+    docs = [BatchDocument(i, STRUCTURE_PROMPT, text, is_structured_document) for i, text in enumerate(texts) if i not in results]
+    if docs:
+        st.write("🧠 מבין את הטקסט שחולץ...")
+        extractor = BatchExtractor(lambda batch_prompt: stream_reply(structure_llm, batch_prompt),
+                                   single=lambda doc: structure_text_with_ollama(doc.text, structure_llm))
+        timings = {}
+        with timed(timings, 'structure'):
+            results.update(extractor.run(docs))
+        st.caption(f"⏱️ {format_timings(timings)}")
+    for i, reason in reasons.items():
+        results[i] = with_bill_type(results[i], detected[i])
+        record_tier(results[i] or {}, reason)
+    return [results[i] for i in range(len(uploads))]
+
 def execute_calculation(data: dict, apt1_consumption: float = None) -> str:
     """Calls the correct Python function based on the structured data."""
     doc_type = data.get("document_type")
@@ -108,8 +200,8 @@ def execute_calculation(data: dict, apt1_consumption: float = None) -> str:
     if doc_type == "arnona_bill":
         total = data.get("total_amount", 0.0)
         if total == 0: return "שגיאה: לא נמצא סכום כולל בחשבון הארנונה."
-        split = total / 2
-        return f"--- חלוקת ארנונה ---\nסך הכל: {total:.2f}\nדירה 1: {split:.2f}\nדירה 2: {split:.2f}"
+        split = get_policies().policy('arnona').split(total)['total']
+        return f"--- חלוקת ארנונה ---\nסך הכל: {total:.2f}\nדירה 1: {split[0]:.2f}\nדירה 2: {split[1]:.2f}"
         
     elif doc_type == "utility_bill":
         total_bill = data.get("total_amount", 0.0)
@@ -122,16 +214,13 @@ def execute_calculation(data: dict, apt1_consumption: float = None) -> str:
 
         fixed_charges = data.get("fixed_charges", 0.0)
         total_consumption = data.get("total_consumption", 0.0)
-        consumption_cost = total_bill - fixed_charges
-        cost_per_unit = consumption_cost / total_consumption if total_consumption > 0 else 0
-        apt1_fixed = fixed_charges / 2
-        apt1_consumption_cost = apt1_consumption * cost_per_unit
-        apt1_total = apt1_fixed + apt1_consumption_cost
         apt2_consumption = total_consumption - apt1_consumption
-        apt2_fixed = fixed_charges / 2
-        apt2_consumption_cost = apt2_consumption * cost_per_unit
-        apt2_total = apt2_fixed + apt2_consumption_cost
-        return f"--- סיכום חשבון ---\nדירה 1 ({apt1_consumption} יח'): {apt1_total:.2f}\nדירה 2 ({apt2_consumption} יח'): {apt2_total:.2f}"
+        # Fixed by the bill type's config.json shares, the rest by consumption
+        bill_type = data.get("bill_type")
+        policy = bill_type if bill_type in UTILITY_BILL_TYPES else FALLBACK_UTILITY_POLICY
+        apt1_total, apt2_total = get_policies().policy(policy).split(total_bill, fixed_charges, [apt1_consumption, apt2_consumption])['total']
+        fallback = "" if policy == bill_type else f"\n(סוג החשבון לא זוהה, חולק לפי כללי {policy})"
+        return f"--- סיכום חשבון ---\nדירה 1 ({apt1_consumption} יח'): {apt1_total:.2f}\nדירה 2 ({apt2_consumption} יח'): {apt2_total:.2f}{fallback}"
 
     elif doc_type == "meter_reading":
         return f"קריאת המונה שזוהתה היא: {data.get('meter_reading', 'לא ידוע')}"
@@ -163,24 +252,27 @@ else: # Gemini
 
 llm = get_llm(model_provider, ollama_model_name, gemini_model_name, google_api_key)
 
+escalation = get_escalation_stats().stats()
+if escalation['documents']:
+    # Bills answered by the regex tier vs. sent to a model, since this server started
+    st.sidebar.caption(f"⚡ {escalation['regex_only']}/{escalation['documents']} חשבונות ({escalation['regex_fraction']:.0%}) ללא קריאה למודל")
+    if escalation['reasons']: st.sidebar.caption("נשלחו למודל: " + ", ".join(f"{reason} ({count})" for reason, count in escalation['reasons'].items()))
+
 st.title("📄🤖 מפצל החשבונות")
 st.caption("העלו קבצים וכתבו לי מה לעשות.")
 
 if "messages" not in st.session_state: st.session_state.messages = []
-if "uploaded_file_paths" not in st.session_state: st.session_state.uploaded_file_paths = []
+if "uploads" not in st.session_state: st.session_state.uploads = []
 
 for msg in st.session_state.messages:
     with st.chat_message(msg["role"]): st.markdown(msg["content"])
 
 uploaded_files = st.file_uploader("העלאת קבצים:", accept_multiple_files=True, key="file_uploader")
 if uploaded_files:
-    temp_dir = tempfile.mkdtemp()
-    st.session_state.uploaded_file_paths = []
-    for f in uploaded_files:
-        path = os.path.join(temp_dir, f.name)
-        with open(path, "wb") as out_file: out_file.write(f.getvalue())
-        st.session_state.uploaded_file_paths.append(path)
-    st.info(f"הועלו {len(st.session_state.uploaded_file_paths)} קבצים.")
+    # Streamlit's own buffers, deduplicated by content; nothing is written to disk on reruns
+    store = get_upload_store()
+    st.session_state.uploads = [store.add(f) for f in uploaded_files]
+    st.info(f"הועלו {len(st.session_state.uploads)} קבצים.")
 
 if prompt := st.chat_input("מה נרצה לעשות?"):
     st.session_state.messages.append({"role": "user", "content": prompt})
@@ -189,24 +281,23 @@ if prompt := st.chat_input("מה נרצה לעשות?"):
     with st.chat_message("assistant"):
         with st.spinner("...חושב ומעבד"):
             try:
-                if st.session_state.uploaded_file_paths:
+                if st.session_state.uploads:
                     all_results = []
-                    for file_path in st.session_state.uploaded_file_paths:
-                        if model_provider == "Gemini (Google)":
-                            if not google_api_key: st.error("נדרש מפתח API של Google Gemini."); st.stop()
-                            analysis_llm = get_llm("Gemini (Google)", "", "gemini-1.5-pro-latest", google_api_key)
-                            structured_data = analyze_document_with_gemini(file_path, analysis_llm)
-                        else: # Ollama
-                            structured_data = analyze_document_locally_with_ollama(file_path, llm)
-                        
-                        st.write(f"**תוצאות עבור `{os.path.basename(file_path)}`:**"); st.json(structured_data)
+                    if model_provider == "Gemini (Google)":
+                        if not google_api_key: st.error("נדרש מפתח API של Google Gemini."); st.stop()
+                        analysis_llm = get_llm("Gemini (Google)", "", "gemini-1.5-pro-latest", google_api_key)
+                        all_structured = [analyze_document_tiered(upload, analysis_llm) for upload in st.session_state.uploads]
+                    else: # Ollama: one structuring request for several files
+                        all_structured = analyze_documents_locally_with_ollama(st.session_state.uploads, llm)
+                    for upload, structured_data in zip(st.session_state.uploads, all_structured):
+                        st.write(f"**תוצאות עבור `{upload.name}`:**"); st.json(structured_data)
                         result = execute_calculation(structured_data)
                         all_results.append(result)
                     
                     final_output = "\n\n---\n\n".join(all_results)
                     st.markdown(final_output)
                     st.session_state.messages.append({"role": "assistant", "content": final_output})
-                    st.session_state.uploaded_file_paths = []
+                    st.session_state.uploads = []
 
                 elif st.session_state.get("needs_apt1_consumption"):
                     apt1_consumption_float = float(prompt)
@@ -222,12 +313,12 @@ if prompt := st.chat_input("מה נרצה לעשות?"):
                     st.markdown(response.content)
                     st.session_state.messages.append({"role": "assistant", "content": response.content})
 
-            except (ValueError, ResourceExhausted) as e:
+            except (ValueError, *retryable_errors()) as e:
                 st.error(f"שגיאה: {e}")
             except Exception as e:
                 st.error(f"אירעה שגיאה בלתי צפויה: {e}")
 
-if not uploaded_files and st.session_state.get("uploaded_file_paths"):
-    st.session_state.uploaded_file_paths = []
+if not uploaded_files and st.session_state.get("uploads"):
+    st.session_state.uploads = []
     st.rerun()
 
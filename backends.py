@@ -0,0 +1,91 @@
+"""Lazy-loading registry of the heavy OCR / LLM / PDF libraries.
+
+Every entry point imported Google Vision, google.generativeai, LangChain,
+pytesseract and PyMuPDF at the top, so each fresh Streamlit process (and
+each ``streamlit run``) paid for all of them before drawing the first
+widget, even when the user only typed numbers. Modules now take a handle
+from here instead:
+
+    genai = lazy('genai')          # nothing imported yet
+    genai.GenerativeModel(...)     # imported here, on first use
+
+``available(name)`` answers the ``HAVE_*`` questions without importing the
+library, and ``import_seconds`` records what each first use cost (shown by
+``bench_startup.py``).
+"""
+import importlib
+import importlib.util
+import threading
+import time
+from typing import Dict
+
+# Registry name -> module to import
+BACKENDS = {
+    'pandas': 'pandas',
+    'fitz': 'fitz',
+    'PIL': 'PIL.Image',
+    'PIL_ops': 'PIL.ImageOps',
+    'pytesseract': 'pytesseract',
+    'easyocr': 'easyocr',
+    'vision': 'google.cloud.vision',
+    'genai': 'google.generativeai',
+    'google_exceptions': 'google.api_core.exceptions',
+    'langchain_ollama': 'langchain_ollama',
+    'langchain_google_genai': 'langchain_google_genai.chat_models',
+    'langchain_messages': 'langchain_core.messages',
+}
+
+import_seconds: Dict[str, float] = {}
+_modules: Dict[str, object] = {}
+_lock = threading.RLock()
+
+
+def load(name: str):
+    """The backend's module, imported on the first call (raises ImportError if not installed)"""
+    module = _modules.get(name)
+    if module is not None:
+        return module
+    with _lock:
+        if name not in _modules:
+            started = time.perf_counter()
+            _modules[name] = importlib.import_module(BACKENDS.get(name, name))
+            import_seconds[name] = time.perf_counter() - started
+        return _modules[name]
+
+
+def available(name: str) -> bool:
+    """Whether the backend is installed, without importing it"""
+    if name in _modules:
+        return True
+    try:
+        return importlib.util.find_spec(BACKENDS.get(name, name)) is not None
+    except (ImportError, ValueError):
+        # find_spec imports parent packages (e.g. 'google.cloud'), which may be missing
+        return False
+
+
+class LazyBackend:
+    """Stands in for a module; the import happens on the first attribute access"""
+
+    def __init__(self, name: str):
+        self.__dict__['_name'] = name
+
+    def __getattr__(self, attr: str):
+        return getattr(load(self._name), attr)
+
+    def __setattr__(self, attr: str, value) -> None:
+        setattr(load(self._name), attr, value)
+
+    def __repr__(self) -> str:
+        state = 'loaded' if self._name in _modules else 'not loaded'
+        return f"<lazy backend {self._name!r} ({BACKENDS.get(self._name, self._name)}, {state})>"
+
+
+def lazy(name: str) -> LazyBackend:
+    return LazyBackend(name)
+
+
+def loaded() -> Dict[str, float]:
+    """{backend: import seconds} for the backends imported so far"""
+    with _lock:
+        return dict(import_seconds)
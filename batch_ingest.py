@@ -0,0 +1,212 @@
+"""Headless batch ingestion of bills and meter photos.
+
+Walks a directory tree where every directory holding files is one unit pair
+(e.g. ``2025-03/building-7/unit-12``): bill PDFs (electricity, water, arnona)
+and photos of apartment 1's sub-meters. Meter photos are matched to a bill
+by their file name (``elec``/``חשמל``/``kwh`` or ``water``/``מים``/``m3``).
+Previous readings can be given in a ``readings.json`` next to the files::
+
+    {"electricity": 12345.6, "water": 789.0}
+
+Files are extracted in a process pool. Every finished file is appended to a
+checkpoint (``<output>.progress.jsonl``), so a crashed run picks up where it
+stopped. The splits of all unit pairs are written to one CSV or Parquet file.
+
+Usage:
+    python batch_ingest.py bills/2025-03 -o splits_2025-03.csv --workers 8
+"""
+import argparse
+import hashlib
+import io
+import json
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterator, List, Optional
+
+import pandas as pd
+
+from bill_calculator import BillCalculator
+from bill_parser import parse_bill_text, parse_meter_reading
+
+PDF_EXTENSIONS = ('.pdf',)
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+READINGS_FILE = 'readings.json'
+
+METER_NAME_HINTS = {
+    'electricity': ['elec', 'חשמל', 'kwh'],
+    'water': ['water', 'מים', 'm3'],
+}
+
+
+def iter_input_files(root: str) -> Iterator[str]:
+    for dirpath, dirnames, filenames in os.walk(root):
+        dirnames.sort()
+        for name in sorted(filenames):
+            if name.lower().endswith(PDF_EXTENSIONS + IMAGE_EXTENSIONS):
+                yield os.path.join(dirpath, name)
+
+
+def file_fingerprint(path: str) -> str:
+    """Identity used by the checkpoint: a file that changed is processed again"""
+    stat = os.stat(path)
+    return f"{os.path.abspath(path)}:{stat.st_size}:{int(stat.st_mtime)}"
+
+
+def meter_type_from_name(path: str) -> Optional[str]:
+    name = os.path.basename(path).lower()
+    for meter_type, hints in METER_NAME_HINTS.items():
+        if any(hint in name for hint in hints):
+            return meter_type
+    return None
+
+
+def process_file(path: str) -> Dict:
+    """Extract one file; runs in a worker process"""
+    record = {'path': path, 'group': os.path.dirname(path), 'error': None}
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+        if path.lower().endswith(PDF_EXTENSIONS):
+            from pdf_text import extract_text
+            # One process per file already; don't nest the page OCR pool
+            text, pages = extract_text(data, ocr_workers=1)
+            record['kind'] = 'bill'
+            record['page_sources'] = [p['source'] for p in pages]
+            record.update(parse_bill_text(text))
+        else:
+            import pytesseract
+            from PIL import Image
+            from ocr_cache import get_cache
+            text = get_cache().get_or_compute(
+                data, 'tesseract', 'heb+eng', None,
+                lambda: pytesseract.image_to_string(Image.open(io.BytesIO(data)), lang='heb+eng')
+            )
+            record['kind'] = 'meter'
+            record['meter_type'] = meter_type_from_name(path)
+            record['reading'] = parse_meter_reading(text)
+        record['sha256'] = hashlib.sha256(data).hexdigest()
+    except Exception as e:
+        record['error'] = f"{type(e).__name__}: {e}"
+    return record
+
+
+def load_checkpoint(path: str) -> Dict[str, Dict]:
+    done = {}
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # Torn last line from a crash, that file is simply redone
+                continue
+            done[entry['fingerprint']] = entry['record']
+    return done
+
+
+def load_previous_readings(group: str) -> Dict:
+    path = os.path.join(group, READINGS_FILE)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def split_group(root: str, group: str, records: List[Dict]) -> List[Dict]:
+    """Run BillCalculator.calculate_split for every bill of one unit pair"""
+    previous = load_previous_readings(group)
+    readings = {r['meter_type']: r['reading'] for r in records
+                if r.get('kind') == 'meter' and r.get('meter_type') and r.get('reading')}
+    rows = []
+    for record in records:
+        if record.get('kind') != 'bill' or record['error']:
+            continue
+        bill_type = record.get('bill_type')
+        total = record.get('total_amount')
+        if not bill_type or not total:
+            rows.append({'group': os.path.relpath(group, root), 'file': os.path.basename(record['path']),
+                         'bill_type': bill_type, 'status': 'incomplete'})
+            continue
+        apt1_consumption = None
+        if readings.get(bill_type) and previous.get(bill_type):
+            apt1_consumption = readings[bill_type] - previous[bill_type]
+        split = BillCalculator.calculate_split(
+            bill_type, total, record.get('consumption'), record.get('fixed_charges'), apt1_consumption
+        )
+        rows.append({
+            'group': os.path.relpath(group, root),
+            'file': os.path.basename(record['path']),
+            'bill_type': bill_type,
+            'status': 'ok',
+            'total': split['total'],
+            'consumption': record.get('consumption'),
+            'fixed_charges': record.get('fixed_charges'),
+            'apt1_consumption': apt1_consumption,
+            'apt1_fixed': split['apt1']['fixed'],
+            'apt1_usage': split['apt1']['consumption'],
+            'apt1_total': split['apt1']['total'],
+            'apt2_fixed': split['apt2']['fixed'],
+            'apt2_usage': split['apt2']['consumption'],
+            'apt2_total': split['apt2']['total'],
+            'page_sources': ','.join(record.get('page_sources', [])),
+        })
+    return rows
+
+
+def run(root: str, output: str, workers: Optional[int] = None, restart: bool = False) -> pd.DataFrame:
+    checkpoint_path = output + '.progress.jsonl'
+    if restart and os.path.exists(checkpoint_path):
+        os.remove(checkpoint_path)
+    done = load_checkpoint(checkpoint_path)
+
+    fingerprints = {path: file_fingerprint(path) for path in iter_input_files(root)}
+    # Files that failed last time (e.g. tesseract missing) are retried
+    pending = [path for path, fp in fingerprints.items() if fp not in done or done[fp]['error']]
+    print(f"{len(fingerprints)} files, {len(fingerprints) - len(pending)} already done, {len(pending)} to process",
+          file=sys.stderr)
+
+    with open(checkpoint_path, 'a', encoding='utf-8') as checkpoint, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(process_file, path): path for path in pending}
+        for i, future in enumerate(as_completed(futures), 1):
+            path = futures[future]
+            record = future.result()
+            done[fingerprints[path]] = record
+            checkpoint.write(json.dumps({'fingerprint': fingerprints[path], 'record': record},
+                                        ensure_ascii=False) + '\n')
+            checkpoint.flush()
+            os.fsync(checkpoint.fileno())
+            if record['error']:
+                print(f"[{i}/{len(pending)}] {path}: {record['error']}", file=sys.stderr)
+
+    groups = {}
+    for path, fp in fingerprints.items():
+        groups.setdefault(os.path.dirname(path), []).append(done[fp])
+    rows = []
+    for group in sorted(groups):
+        rows.extend(split_group(root, group, groups[group]))
+
+    df = pd.DataFrame(rows)
+    if output.endswith('.parquet'):
+        df.to_parquet(output, index=False)
+    else:
+        df.to_csv(output, index=False, encoding='utf-8-sig')
+    return df
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Split a whole folder of bills and meter photos")
+    parser.add_argument('root', help="directory tree; each directory with files is one unit pair")
+    parser.add_argument('-o', '--output', default='bill_splits.csv', help="output .csv or .parquet")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument('--restart', action='store_true', help="ignore the checkpoint and process everything")
+    args = parser.parse_args(argv)
+
+    df = run(args.root, args.output, args.workers, args.restart)
+    print(f"wrote {len(df)} rows to {args.output}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
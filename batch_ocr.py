@@ -0,0 +1,120 @@
+"""Batched EasyOCR over many images (bills and meter photos).
+
+``reader.readtext`` runs the detector and the recognizer once per image.
+``readtext_batch`` sends a whole list through ``reader.readtext_batched``
+instead. EasyOCR needs images of one size per batch, so they are sorted by
+size, grouped ``batch_size`` at a time and padded with white to the largest
+image of their group. Padding only extends the right and bottom edges, so
+bounding boxes stay in the original image's coordinates. Results come back
+in input order.
+
+Monthly bulk run over a folder of images:
+    python batch_ocr.py scans/2025-03 -o scans_2025-03.jsonl --batch-size 8
+"""
+import argparse
+import io
+import json
+import os
+import sys
+from typing import List, Sequence
+
+import numpy as np
+
+from backends import lazy
+
+Image = lazy('PIL')
+
+DEFAULT_BATCH_SIZE = int(os.environ.get("OCR_BATCH_SIZE", 8))
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+PAD_VALUE = 255
+
+
+def to_array(image) -> np.ndarray:
+    """Image bytes, PIL image or array -> HxWx3 uint8 RGB array"""
+    if isinstance(image, np.ndarray):
+        array = image
+    else:
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            image = Image.open(io.BytesIO(image))
+        array = np.asarray(image.convert('RGB'))
+    if array.ndim == 2:
+        array = np.stack([array] * 3, axis=-1)
+    return array
+
+
+def pad_group(arrays: Sequence[np.ndarray]) -> List[np.ndarray]:
+    """Pad every array on the right/bottom to the largest height and width of the group"""
+    height = max(a.shape[0] for a in arrays)
+    width = max(a.shape[1] for a in arrays)
+    padded = []
+    for a in arrays:
+        if a.shape[0] == height and a.shape[1] == width:
+            padded.append(a)
+            continue
+        canvas = np.full((height, width, 3), PAD_VALUE, dtype=a.dtype)
+        canvas[:a.shape[0], :a.shape[1]] = a
+        padded.append(canvas)
+    return padded
+
+
+def readtext_batch(reader, images: Sequence, batch_size: int = DEFAULT_BATCH_SIZE) -> List[List]:
+    """readtext for a list of images, batched; [[(bbox, text, confidence), ...] per image] in input order"""
+    if not images:
+        return []
+    if hasattr(reader, 'readtext_batch'):
+        # OCRClient: the model server batches on its side
+        return reader.readtext_batch(list(images), batch_size=batch_size)
+    arrays = [to_array(image) for image in images]
+    # Similar sizes together, so padding adds little
+    order = sorted(range(len(arrays)), key=lambda i: (arrays[i].shape[0], arrays[i].shape[1]))
+    results = [None] * len(arrays)
+    for start in range(0, len(order), batch_size):
+        group = order[start:start + batch_size]
+        padded = pad_group([arrays[i] for i in group])
+        batch_results = reader.readtext_batched(padded, batch_size=batch_size)
+        for i, result in zip(group, batch_results):
+            results[i] = result
+    return results
+
+
+def results_to_text(results: List) -> str:
+    return "\n".join(result[1] for result in results)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Batched EasyOCR over a folder of images")
+    parser.add_argument('root', help="folder with bill scans and meter photos")
+    parser.add_argument('-o', '--output', default='ocr_results.jsonl', help="one JSON line per image")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--langs', default='he,en')
+    args = parser.parse_args(argv)
+
+    paths = []
+    for dirpath, dirnames, filenames in os.walk(args.root):
+        dirnames.sort()
+        paths.extend(os.path.join(dirpath, name) for name in sorted(filenames)
+                     if name.lower().endswith(IMAGE_EXTENSIONS))
+
+    from ocr_server import OCRClient, server_available
+    if server_available():
+        reader = OCRClient()
+    else:
+        import easyocr
+        reader = easyocr.Reader(args.langs.split(','), gpu=False)
+
+    with open(args.output, 'w', encoding='utf-8') as out:
+        # A few batches of images in memory at a time
+        chunk = args.batch_size * 4
+        for start in range(0, len(paths), chunk):
+            chunk_paths = paths[start:start + chunk]
+            images = []
+            for path in chunk_paths:
+                with open(path, 'rb') as f:
+                    images.append(f.read())
+            for path, results in zip(chunk_paths, readtext_batch(reader, images, args.batch_size)):
+                out.write(json.dumps({'path': path, 'text': results_to_text(results)}, ensure_ascii=False) + '\n')
+            print(f"{min(start + chunk, len(paths))}/{len(paths)}", file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,110 @@
+"""Benchmark: int64-agorot split engine vs. the same allocation in decimal.Decimal.
+
+Generates random bills (totals, fixed charges, VAT, per-unit consumption and
+fixed-share weights, including zero-consumption bills and negative fixed
+charges), splits them with split_engine.split_bills and with a scalar
+Decimal implementation of the same largest-remainder rule, and times both.
+
+Before timing, it checks on every bill what the engine guarantees:
+- each component's shares add up exactly to the bill's component in agorot;
+- every share is within one agora of its exact proportional share;
+- the engine agrees with the Decimal reference, agora for agora. Near-ties
+  in the fractional parts may be broken differently, and those are counted
+  separately.
+
+The properties themselves are tested in tests/test_split_engine.py.
+
+Usage:
+    python bench_split_engine.py [--bills 20000] [--units 2] [--repeat 3] [--seed 1]
+"""
+import argparse
+import random
+import timeit
+from decimal import ROUND_FLOOR, ROUND_HALF_UP, Decimal
+
+import numpy as np
+
+from split_engine import allocate_cents, split_bills, to_cents
+
+AGORA = Decimal('0.01')
+
+
+def random_bills(count: int, units: int, seed: int):
+    rng = random.Random(seed)
+    bills = []
+    for _ in range(count):
+        total = round(rng.uniform(20, 5000), 2)
+        fixed = round(rng.uniform(-50, total / 3), 2)
+        vat = round(total * 0.17, 2)
+        usage = [0.0] * units if rng.random() < 0.05 else [round(rng.uniform(0, 900), 1) for _ in range(units)]
+        weights = [rng.choice((1, 1, 2, 3)) for _ in range(units)]
+        bills.append((total, fixed, vat, usage, weights))
+    return bills
+
+
+# --- Reference: the same rule, bill by bill, in Decimal ---
+
+def decimal_allocate(amount: int, weights):
+    """Largest remainder in exact Decimal arithmetic; amount in agorot"""
+    weights = [Decimal(repr(w)) for w in weights]
+    total = sum(weights)
+    shares = [w / total for w in weights] if total != 0 else [Decimal(1) / len(weights)] * len(weights)
+    exact = [amount * share for share in shares]
+    cents = [int(e.to_integral_value(rounding=ROUND_FLOOR)) for e in exact]
+    order = sorted(range(len(exact)), key=lambda i: -(exact[i] - cents[i]))
+    for i in order[:amount - sum(cents)]:
+        cents[i] += 1
+    return cents
+
+
+def decimal_split(bill):
+    total, fixed, vat, usage, weights = bill
+    to_agorot = lambda x: int((Decimal(repr(x)) / AGORA).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+    fixed_share = decimal_allocate(to_agorot(fixed), weights)
+    usage_share = decimal_allocate(to_agorot(total) - to_agorot(fixed), usage)
+    subtotal = [f + u for f, u in zip(fixed_share, usage_share)]
+    vat_share = decimal_allocate(to_agorot(vat), subtotal)
+    return [s + v for s, v in zip(subtotal, vat_share)]
+
+
+def engine_split(arrays):
+    totals, fixed, vat, usage, weights = arrays
+    return split_bills(totals, fixed, usage, weights, vat)
+
+
+def check(bills, arrays, result):
+    totals, fixed, vat, usage, weights = arrays
+    assert (result['total'].sum(axis=1) == to_cents(totals) + to_cents(vat)).all(), "totals do not reconcile"
+    assert (result['fixed'].sum(axis=1) == to_cents(fixed)).all(), "fixed shares do not reconcile"
+    assert (result['usage'].sum(axis=1) == to_cents(totals) - to_cents(fixed)).all(), "usage shares do not reconcile"
+    assert (result['vat'].sum(axis=1) == to_cents(vat)).all(), "VAT shares do not reconcile"
+    exact_fixed = to_cents(fixed)[:, None] * weights / weights.sum(axis=1, keepdims=True)
+    assert (np.abs(result['fixed'] - exact_fixed) < 1).all(), "a fixed share is off by an agora or more"
+    assert (result['fixed'] == allocate_cents(to_cents(fixed), weights)).all()
+    return sum(decimal_split(bill) != list(row) for bill, row in zip(bills, result['total']))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--bills', type=int, default=20000)
+    parser.add_argument('--units', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    bills = random_bills(args.bills, args.units, args.seed)
+    arrays = (np.array([b[0] for b in bills]), np.array([b[1] for b in bills]), np.array([b[2] for b in bills]),
+              np.array([b[3] for b in bills]), np.array([b[4] for b in bills], dtype=np.float64))
+    result = engine_split(arrays)
+    mismatches = check(bills, arrays, result)
+    print(f"{args.bills} bills x {args.units} units: every component reconciles to the agora; "
+          f"{mismatches} bills differ from the Decimal reference (near-ties broken differently)")
+
+    engine = min(timeit.repeat(lambda: engine_split(arrays), number=1, repeat=args.repeat))
+    reference = min(timeit.repeat(lambda: [decimal_split(b) for b in bills], number=1, repeat=args.repeat))
+    print(f"int64 engine: {engine * 1000:8.1f} ms")
+    print(f"Decimal:      {reference * 1000:8.1f} ms  ({reference / engine:.0f}x slower)")
+
+
+if __name__ == '__main__':
+    main()
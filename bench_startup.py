@@ -0,0 +1,122 @@
+"""Benchmark: cold-start import time of every app entry point.
+
+For each entry point, the imports at the top of the script (including those
+inside top-level try blocks) are run in a fresh Python process, as a new
+Streamlit process would run them before drawing the first widget. Prints the
+median wall time over ``--repeat`` processes, which heavy backends
+(``backends.BACKENDS``) were already imported by then, the imports that are
+not installed here (or failed), and, with ``--slowest``, the slowest
+top-level imports as reported by ``python -X importtime``. ``--record``
+appends the results as one JSON line, to track cold start across changes.
+
+Usage:
+    python bench_startup.py [--repeat 5] [--slowest 5] [--record startup.jsonl]
+"""
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+from backends import BACKENDS
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+ENTRY_POINTS = ['app.py', 'smart_bill_splitter.py', 'universal.bill.splitter.py', 'claude/app.py',
+                'claude.app.py', 'main_agent_bill_splitter.py', 'bill.split.py']
+
+PROBE = """
+import json, sys, time
+sys.path[:0] = {paths!r}
+missing, errors = [], []
+started = time.perf_counter()
+for statement in {statements!r}:
+    try:
+        exec(statement, {{}})
+    except ImportError as e:
+        missing.append(getattr(e, 'name', None) or str(e))
+    except Exception as e:
+        errors.append(f'{{statement}}: {{type(e).__name__}}: {{e}}')
+seconds = time.perf_counter() - started
+heavy = sorted(name for name, module in {backends!r}.items() if module in sys.modules)
+print(json.dumps({{'seconds': seconds, 'heavy': heavy, 'missing': missing, 'errors': errors}}))
+"""
+
+
+def top_level_imports(path: str):
+    """Source of the import statements at the top level of a script, in order"""
+    with open(path, encoding='utf-8') as f:
+        source = f.read()
+    statements = []
+    try:
+        tree = ast.parse(source)
+    except SyntaxError:
+        # Newer syntax than this interpreter parses (e.g. PEP 701 f-strings before 3.12)
+        return [line for line in source.splitlines() if line.startswith(('import ', 'from '))]
+
+    def collect(body):
+        for node in body:
+            if isinstance(node, (ast.Import, ast.ImportFrom)):
+                statements.append(ast.get_source_segment(source, node))
+            elif isinstance(node, ast.Try):
+                collect(node.body)
+    collect(tree.body)
+    return statements
+
+
+def probe(entry: str, importtime: bool = False):
+    """(result dict, -X importtime stderr) of one fresh process importing the entry point's imports"""
+    path = os.path.join(ROOT, entry)
+    code = PROBE.format(paths=[os.path.dirname(path), ROOT], statements=top_level_imports(path), backends=BACKENDS)
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else []) + ['-c', code]
+    done = subprocess.run(command, cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(done.stdout.strip().splitlines()[-1]), done.stderr
+
+
+def slowest_imports(stderr: str, count: int):
+    """[(module, cumulative ms)] of the slowest top-level imports in -X importtime output"""
+    imports = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        if not name[1:].startswith(' '):
+            # Nested imports are indented under their importer
+            imports.append((name.strip(), int(cumulative) / 1000.0))
+    return sorted(imports, key=lambda item: -item[1])[:count]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5, help="fresh processes per entry point")
+    parser.add_argument('--slowest', type=int, default=0, help="show the N slowest top-level imports")
+    parser.add_argument('--record', help="append the results as a JSON line to this file")
+    args = parser.parse_args()
+
+    results = {}
+    print(f"{'entry point':<30}{'ms':>9}  heavy backends imported at startup")
+    for entry in ENTRY_POINTS:
+        runs = [probe(entry)[0] for _ in range(args.repeat)]
+        result = runs[-1]
+        result['ms'] = statistics.median(run['seconds'] for run in runs) * 1000.0
+        del result['seconds']
+        results[entry] = result
+        print(f"{entry:<30}{result['ms']:>9.1f}  {', '.join(result['heavy']) or '-'}")
+        if result['missing']:
+            print(f"{'':<41}not installed: {', '.join(sorted(set(result['missing'])))}")
+        for error in result['errors']:
+            print(f"{'':<41}failed: {error}")
+        if args.slowest:
+            for name, ms in slowest_imports(probe(entry, importtime=True)[1], args.slowest):
+                print(f"{'':<41}{name:<40}{ms:>9.1f} ms")
+
+    if args.record:
+        with open(args.record, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': sys.version.split()[0],
+                                'entry_points': results}, ensure_ascii=False) + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,10 @@
 import streamlit as st
-import pandas as pd
+
+from backends import lazy
+from meter_store import MeterReadingError, get_meter_store, meter_id
+from split_core import APARTMENTS, GRAND_TOTAL_ROW, TABLE_COLUMNS, compute_split
+
+pd = lazy('pandas')  # only the results table needs it; typing numbers shouldn't wait for it
 
 # --- Page Configuration ---
 st.set_page_config(
@@ -11,144 +16,54 @@ st.set_page_config(
 
 # --- Functions ---
 
-def calculate_split(bill_data):
-    """
-    Calculates the final bill split based on the input data.
-    """
-    results = {}
-
-    # --- Arnona Calculation ---
-    arnona_total = bill_data.get('arnona_total', 0)
-    if arnona_total > 0:
-        apt1_arnona = arnona_total / 2
-        apt2_arnona = arnona_total / 2
-        results['arnona'] = {
-            'דירה 1': apt1_arnona,
-            'דירה 2': apt2_arnona,
-            'סה"כ לחשבון': arnona_total
-        }
-
-    # --- Electricity Calculation ---
-    elec_total = bill_data.get('elec_total', 0)
-    if elec_total > 0:
-        elec_fixed = bill_data.get('elec_fixed', 0)
-        total_kwh = bill_data.get('elec_total_kwh', 0)
-        apt1_kwh = bill_data.get('elec_apt1_kwh', 0)
-
-        # Ensure consumption for Apt 1 doesn't exceed total
-        if apt1_kwh > total_kwh:
-            st.error("שגיאה בחשמל: צריכת דירה 1 (קוט\"ש) גבוהה מסך הצריכה הכולל.")
-            apt1_kwh = total_kwh # Cap it to avoid negative results
-
-        consumption_cost = elec_total - elec_fixed
-        apt2_kwh = total_kwh - apt1_kwh
-
-        if total_kwh > 0:
-            cost_per_kwh = consumption_cost / total_kwh
-            apt1_consumption_cost = apt1_kwh * cost_per_kwh
-            apt2_consumption_cost = apt2_kwh * cost_per_kwh
-        else: # Handle case with no consumption
-             cost_per_kwh = 0
-             apt1_consumption_cost = 0
-             apt2_consumption_cost = 0
-
-
-        apt1_elec_total = (elec_fixed / 2) + apt1_consumption_cost
-        apt2_elec_total = (elec_fixed / 2) + apt2_consumption_cost
-
-        results['electricity'] = {
-            'דירה 1': apt1_elec_total,
-            'דירה 2': apt2_elec_total,
-            'סה"כ לחשבון': elec_total
-        }
-
-    # --- Water Calculation ---
-    water_total = bill_data.get('water_total', 0)
-    if water_total > 0:
-        water_fixed = bill_data.get('water_fixed', 0)
-        total_m3 = bill_data.get('water_total_m3', 0)
-        apt1_m3 = bill_data.get('water_apt1_m3', 0)
-
-        # Ensure consumption for Apt 1 doesn't exceed total
-        if apt1_m3 > total_m3:
-            st.error("שגיאה במים: צריכת דירה 1 (מ\"ק) גבוהה מסך הצריכה הכולל.")
-            apt1_m3 = total_m3 # Cap it to avoid negative results
-
-        consumption_cost = water_total - water_fixed
-        apt2_m3 = total_m3 - apt1_m3
-
-        if total_m3 > 0:
-            cost_per_m3 = consumption_cost / total_m3
-            apt1_consumption_cost = apt1_m3 * cost_per_m3
-            apt2_consumption_cost = apt2_m3 * cost_per_m3
-        else: # Handle case with no consumption
-            cost_per_m3 = 0
-            apt1_consumption_cost = 0
-            apt2_consumption_cost = 0
-
-        apt1_water_total = (water_fixed / 2) + apt1_consumption_cost
-        apt2_water_total = (water_fixed / 2) + apt2_consumption_cost
-
-        results['water'] = {
-            'דירה 1': apt1_water_total,
-            'דירה 2': apt2_water_total,
-            'סה"כ לחשבון': water_total
-        }
-
-    return results
-
-
-def display_calculation_transparency(bill_data):
+def display_utility_breakdown(b, unit_label):
+    """One utility's steps; every amount is the apartment's share from the split in the summary table"""
+    shares = " / ".join(f"{weight:.0%}" for weight in b['fixed_weights'])
+    st.markdown(f"**עלות קבועה ({shares}):** `{b['fixed']:.2f} ₪`")
+    st.markdown(f"**עלות צריכה כוללת:** `{b['consumption_cost']:.2f} ₪` (`{b['total']:.2f}` - `{b['fixed']:.2f}`)")
+    if b['by_meter']:
+        st.markdown(f"**מחיר ל{unit_label}:** `{b['unit_price']:.4f} ₪` (`{b['consumption_cost']:.2f} ₪` / `{b['total_units']}` {unit_label})")
+    else:
+        st.markdown(f"**עלות הצריכה מחולקת לפי אותם אחוזים ({shares})**")
+    st.markdown("---")
+    for i, apartment in enumerate(APARTMENTS):
+        if b['by_meter']:
+            usage = f"(`{b['units'][i]}` {unit_label} * `{b['unit_price']:.4f} ₪`) `{b['usage_share'][i]:.2f} ₪`"
+        else:
+            usage = f"`{b['usage_share'][i]:.2f} ₪`"
+        st.markdown(f"**{apartment}:** `{b['fixed_share'][i]:.2f} ₪` (קבוע) + {usage} = **`{b['cost'][i]:.2f} ₪`**")
+
+def display_calculation_transparency(breakdown):
     """
-    Displays the detailed calculation steps.
+    Displays the detailed calculation steps (numbers from split_core.compute_split).
     """
     st.markdown("---")
     st.subheader("Transparent Calculation Breakdown")
 
     # --- Electricity Transparency ---
-    if bill_data.get('elec_total', 0) > 0:
+    if 'electricity' in breakdown:
         with st.expander("פירוט חישוב חשמל"):
-            elec_fixed = bill_data.get('elec_fixed', 0)
-            elec_total = bill_data.get('elec_total', 0)
-            total_kwh = bill_data.get('elec_total_kwh', 0)
-            apt1_kwh = bill_data.get('elec_apt1_kwh', 0)
-            apt2_kwh = total_kwh - apt1_kwh
-            consumption_cost = elec_total - elec_fixed
-            cost_per_kwh = consumption_cost / total_kwh if total_kwh > 0 else 0
-
-            st.markdown(f"**עלות קבועה (50/50):** `{elec_fixed / 2:.2f} ₪` לכל דירה")
-            st.markdown(f"**עלות צריכה כוללת:** `{consumption_cost:.2f} ₪` (`{elec_total:.2f}` - `{elec_fixed:.2f}`)")
-            st.markdown(f"**מחיר לקוט\"ש:** `{cost_per_kwh:.4f} ₪` (`{consumption_cost:.2f} ₪` / `{total_kwh}` קוט\"ש)")
-            st.markdown("---")
-            st.markdown(f"**דירה 1:** `{elec_fixed / 2:.2f} ₪` (קבוע) + (`{apt1_kwh}` קוט\"ש * `{cost_per_kwh:.4f} ₪`) = **`{(elec_fixed / 2) + (apt1_kwh * cost_per_kwh):.2f} ₪`**")
-            st.markdown(f"**דירה 2:** `{elec_fixed / 2:.2f} ₪` (קבוע) + (`{apt2_kwh}` קוט\"ש * `{cost_per_kwh:.4f} ₪`) = **`{(elec_fixed / 2) + (apt2_kwh * cost_per_kwh):.2f} ₪`**")
+            display_utility_breakdown(breakdown['electricity'], 'קוט"ש')
 
     # --- Water Transparency ---
-    if bill_data.get('water_total', 0) > 0:
+    if 'water' in breakdown:
         with st.expander("פירוט חישוב מים"):
-            water_fixed = bill_data.get('water_fixed', 0)
-            water_total = bill_data.get('water_total', 0)
-            total_m3 = bill_data.get('water_total_m3', 0)
-            apt1_m3 = bill_data.get('water_apt1_m3', 0)
-            apt2_m3 = total_m3 - apt1_m3
-            consumption_cost = water_total - water_fixed
-            cost_per_m3 = consumption_cost / total_m3 if total_m3 > 0 else 0
-
-            st.markdown(f"**עלות קבועה (50/50):** `{water_fixed / 2:.2f} ₪` לכל דירה")
-            st.markdown(f"**עלות צריכה כוללת:** `{consumption_cost:.2f} ₪` (`{water_total:.2f}` - `{water_fixed:.2f}`)")
-            st.markdown(f"**מחיר למ\"ק:** `{cost_per_m3:.4f} ₪` (`{consumption_cost:.2f} ₪` / `{total_m3}` מ\"ק)")
-            st.markdown("---")
-            st.markdown(f"**דירה 1:** `{water_fixed / 2:.2f} ₪` (קבוע) + (`{apt1_m3}` מ\"ק * `{cost_per_m3:.4f} ₪`) = **`{(water_fixed / 2) + (apt1_m3 * cost_per_m3):.2f} ₪`**")
-            st.markdown(f"**דירה 2:** `{water_fixed / 2:.2f} ₪` (קבוע) + (`{apt2_m3}` מ\"ק * `{cost_per_m3:.4f} ₪`) = **`{(water_fixed / 2) + (apt2_m3 * cost_per_m3):.2f} ₪`**")
+            display_utility_breakdown(breakdown['water'], 'מ"ק')
 
 # --- Main App Interface ---
 
 st.title("GeminiGem 💎 - מחשבון חלוקת חשבונות")
 st.markdown("הזן את הנתונים מהחשבונות וקריאות המונים כדי לחשב את החלוקה בין שתי הדירות.")
 
-# Use session state to remember previous readings
+# Previous readings: the last ones recorded for apartment 1 (meter_store.py), fixed for the session
+meters = get_meter_store()
+APT1_METERS = {'electricity': meter_id('apt1', 'electricity'), 'water': meter_id('apt1', 'water')}
+# The current-reading fields start this far above the previous reading, as an example
+DEMO_ELEC_KWH = 750.0
+DEMO_WATER_M3 = 2.0
 if 'previous_readings' not in st.session_state:
-    st.session_state.previous_readings = {'electricity': 0.0, 'water': 0.0}
+    st.session_state.previous_readings = {bill_type: meters.latest_reading(meter) or 0.0
+                                          for bill_type, meter in APT1_METERS.items()}
 
 # --- Sidebar for Previous Readings ---
 with st.sidebar:
@@ -190,7 +105,7 @@ with col2:
     bill_inputs['elec_total_kwh'] = st.number_input("סך צריכה כוללת (קוט\"ש)", key='elec_total_kwh', min_value=0.0, step=5.0, value=2000.0)
 
     st.subheader("מונה דירה 1 (חשמל)")
-    current_elec_reading = st.number_input("קריאת מונה נוכחית", key='elec_current', min_value=prev_elec, step=0.1, format="%.1f", value=prev_elec + 750.0)
+    current_elec_reading = st.number_input("קריאת מונה נוכחית", key='elec_current', min_value=prev_elec, step=0.1, format="%.1f", value=prev_elec + DEMO_ELEC_KWH)
     bill_inputs['elec_apt1_kwh'] = current_elec_reading - prev_elec
     st.metric(label="צריכת דירה 1 בתקופה זו", value=f"{bill_inputs['elec_apt1_kwh']:.1f} קוט\"ש")
 
@@ -202,67 +117,56 @@ with col1:
     bill_inputs['water_total_m3'] = st.number_input("סך צריכה כוללת (מ\"ק)", key='water_total_m3', min_value=0.0, step=1.0, value=45.0)
 
     st.subheader("מונה דירה 1 (מים)")
-    current_water_reading = st.number_input("קריאת מונה נוכחית", key='water_current', min_value=prev_water, step=0.1, format="%.1f", value=prev_water + 2.0)
+    current_water_reading = st.number_input("קריאת מונה נוכחית", key='water_current', min_value=prev_water, step=0.1, format="%.1f", value=prev_water + DEMO_WATER_M3)
     bill_inputs['water_apt1_m3'] = current_water_reading - prev_water
     st.metric(label="צריכת דירה 1 בתקופה זו", value=f"{bill_inputs['water_apt1_m3']:.1f} מ\"ק")
 
 
+# --- Saving Readings ---
+# Only on request: calculating (or trying what-ifs) never writes to the meter history
+if st.button("💾 שמור קריאות נוכחיות", use_container_width=True):
+    # The untouched example value and the previous reading again are not new readings
+    readings = {APT1_METERS[bill_type]: reading for bill_type, reading, previous, demo in (
+        ('electricity', current_elec_reading, prev_elec, prev_elec + DEMO_ELEC_KWH),
+        ('water', current_water_reading, prev_water, prev_water + DEMO_WATER_M3),
+    ) if reading not in (previous, demo)}
+    if not readings:
+        st.warning("אין קריאות חדשות לשמירה: הקריאות זהות לקודמות או לערכי הדוגמה.")
+    else:
+        try:
+            meters.record_many(readings)
+            st.success("הקריאות נשמרו ויהיו הקריאות הקודמות בחישוב הבא.")
+        except MeterReadingError as e:
+            st.error(f"קריאה לא תקינה: {e}")
+
+
 # --- Calculation and Display ---
 if st.button("חשב חלוקה", type="primary", use_container_width=True):
-    results = calculate_split(bill_inputs)
+    # Pure and memoized (split_core.py): the same inputs are not split again on the next click
+    split = compute_split(bill_inputs)
+    for warning in split.warnings:
+        st.error(warning)
 
-    if results:
+    if split.results:
         st.markdown("---")
         st.header("📊 טבלת סיכום וחלוקה")
 
-        # Prepare data for DataFrame
-        data_for_df = {
-            'חשמל': [
-                f"{results.get('electricity', {}).get('דירה 1', 0):.2f}",
-                f"{results.get('electricity', {}).get('דירה 2', 0):.2f}",
-                f"{results.get('electricity', {}).get('סה\"כ לחשבון', 0):.2f}"
-            ],
-            'ארנונה': [
-                f"{results.get('arnona', {}).get('דירה 1', 0):.2f}",
-                f"{results.get('arnona', {}).get('דירה 2', 0):.2f}",
-                f"{results.get('arnona', {}).get('סה\"כ לחשבון', 0):.2f}"
-            ],
-            'מים': [
-                f"{results.get('water', {}).get('דירה 1', 0):.2f}",
-                f"{results.get('water', {}).get('דירה 2', 0):.2f}",
-                f"{results.get('water', {}).get('סה\"כ לחשבון', 0):.2f}"
-            ]
-        }
-
-        index_labels = ['דירה 1 (₪)', 'דירה 2 (₪)', 'סה"כ לחשבון (₪)']
-        df = pd.DataFrame(data_for_df, index=index_labels).T # Transpose for correct layout
-
-        # Calculate totals
-        total_apt1 = sum(res.get('דירה 1', 0) for res in results.values())
-        total_apt2 = sum(res.get('דירה 2', 0) for res in results.values())
-        grand_total = sum(res.get('סה"כ לחשבון', 0) for res in results.values())
-
-        # Add total row
-        df.loc['סה"כ לתשלום כולל'] = [f"{total_apt1:.2f}", f"{total_apt2:.2f}", f"{grand_total:.2f}"]
+        index_labels = list(TABLE_COLUMNS)
+        df = pd.DataFrame({label: values for label, values in split.rows}, index=index_labels).T # Transpose for correct layout
 
         # Display the styled table
         st.dataframe(df.style.apply(lambda x: ['background-color: #f0f2f6' if i == len(x)-1 else '' for i, v in enumerate(x)], axis=0)
-                       .apply(lambda x: ['font-weight: bold' if x.name == 'סה"כ לתשלום כולל' else '' for i in x], axis=1),
+                       .apply(lambda x: ['font-weight: bold' if x.name == GRAND_TOTAL_ROW else '' for i in x], axis=1),
                        use_container_width=True)
 
-        # Export to CSV (compatible with Sheets)
-        @st.cache_data
-        def convert_df_to_csv(df_to_convert):
-            return df_to_convert.to_csv(index=True).encode('utf-8-sig')
-
-        csv = convert_df_to_csv(df)
+        # Export to CSV (compatible with Sheets), built with the split
         st.download_button(
            label="📥 Export to CSV (for Sheets)",
-           data=csv,
+           data=split.csv,
            file_name='bill_split_summary.csv',
            mime='text/csv',
            use_container_width=True
         )
 
         # Display transparency section
-        display_calculation_transparency(bill_inputs)
\ No newline at end of file
+        display_calculation_transparency(split.breakdown)
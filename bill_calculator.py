@@ -0,0 +1,42 @@
+"""Bill split calculation shared by the Streamlit app and the batch CLI."""
+from typing import Dict, Optional
+
+from split_policy import get_policies
+
+
+class BillCalculator:
+    """Calculate bill splits between apartments"""
+
+    @staticmethod
+    def calculate_split(bill_type: str, total_amount: float,
+                        consumption: Optional[float] = None,
+                        fixed_charges: Optional[float] = None,
+                        apt1_consumption: Optional[float] = None) -> Dict:
+        """Calculate the split between apartments based on bill type"""
+
+        result = {
+            'apt1': {'fixed': 0, 'consumption': 0, 'total': 0},
+            'apt2': {'fixed': 0, 'consumption': 0, 'total': 0},
+            'total': total_amount
+        }
+
+        if bill_type == 'tax':
+            # City tax - fixed shares from config.json (50/50)
+            split = get_policies().policy('tax').split(total_amount)
+            result['apt1']['total'] = float(split['total'][0])
+            result['apt2']['total'] = float(split['total'][1])
+
+        elif bill_type in ['electricity', 'water']:
+            # Fixed charges by the config.json shares; consumption charges by
+            # apartment 1's meter reading, apartment 2 pays the rest (by the
+            # fixed shares without a reading)
+            usage = None
+            if apt1_consumption and consumption:
+                usage = [apt1_consumption, consumption - apt1_consumption]
+            split = get_policies().policy(bill_type).split(total_amount, fixed_charges or 0, usage)
+            for i, apt in enumerate(['apt1', 'apt2']):
+                result[apt]['fixed'] = float(split['fixed'][i])
+                result[apt]['consumption'] = float(split['usage'][i])
+                result[apt]['total'] = float(split['total'][i])
+
+        return result
@@ -0,0 +1,98 @@
+"""Bill text parsing shared by the Streamlit app and the batch CLI.
+
+Bill type detection and field regexes, operating on already extracted text
+(no Streamlit, no OCR), so they can run in worker processes.
+"""
+import re
+from typing import Dict, List, Optional
+
+from field_extractor import to_float
+from meter_ranker import best_reading
+
+BILL_TYPE_KEYWORDS = {
+    'electricity': ['חשמל', 'קוט"ש', 'קילוואט'],
+    'water': ['מים', 'מ"ק', 'קוב'],
+    'tax': ['ארנונה', 'עירייה', 'מועצה'],
+}
+
+AMOUNT_PATTERNS = [
+    r'סה"כ לתשלום[:\s]*([0-9,]+\.?[0-9]*)',
+    r'לתשלום[:\s]*([0-9,]+\.?[0-9]*)',
+    r'סכום כולל[:\s]*([0-9,]+\.?[0-9]*)',
+    r'סה"כ[:\s]*([0-9,]+\.?[0-9]*)'
+]
+
+CONSUMPTION_PATTERNS = {
+    'electricity': r'צריכה[:\s]*([0-9,]+\.?[0-9]*)\s*קוט"ש',
+    'water': r'צריכה[:\s]*([0-9,]+\.?[0-9]*)\s*מ"ק',
+}
+
+FIXED_PATTERNS = [
+    r'דמי שירות[:\s]*([0-9,]+\.?[0-9]*)',
+    r'תשלום קבוע[:\s]*([0-9,]+\.?[0-9]*)',
+    r'עלות מונה[:\s]*([0-9,]+\.?[0-9]*)'
+]
+
+# Every pattern starts with its label, so re's literal-prefix search already finds it
+# fast; field_extractor.FieldExtractor measured no faster on these (bench_field_extractor.py)
+RE_AMOUNT = [re.compile(pattern) for pattern in AMOUNT_PATTERNS]
+RE_CONSUMPTION = {bill_type: re.compile(pattern) for bill_type, pattern in CONSUMPTION_PATTERNS.items()}
+RE_FIXED = [re.compile(pattern) for pattern in FIXED_PATTERNS]
+
+
+def first_match(patterns: List[re.Pattern], text: str) -> Optional[float]:
+    """The number captured by the first pattern, in order, that matches (None if none does)"""
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            return to_float(match.group(1))
+    return None
+
+
+def sum_matches(patterns: List[re.Pattern], text: str) -> float:
+    """Every number captured by every pattern, added up"""
+    total = 0.0
+    for pattern in patterns:
+        for raw in pattern.findall(text):
+            value = to_float(raw)
+            if value is not None:
+                total += value
+    return total
+
+
+def detect_bill_type(text: str) -> Optional[str]:
+    """Detect bill type from Hebrew keywords ('electricity', 'water', 'tax' or None)"""
+    for bill_type, words in BILL_TYPE_KEYWORDS.items():
+        if any(word in text for word in words):
+            return bill_type
+    return None
+
+
+def parse_bill_text(full_text: str) -> Dict:
+    """Extract total, consumption and fixed charges from bill text"""
+    extracted_data = {
+        'total_amount': None,
+        'consumption': None,
+        'fixed_charges': None,
+        'billing_period': None,
+        'bill_type': detect_bill_type(full_text)
+    }
+
+    # Total amount: first pattern in AMOUNT_PATTERNS order that matches
+    extracted_data['total_amount'] = first_match(RE_AMOUNT, full_text)
+
+    # Consumption (for electricity and water)
+    if extracted_data['bill_type'] in RE_CONSUMPTION:
+        extracted_data['consumption'] = first_match([RE_CONSUMPTION[extracted_data['bill_type']]], full_text)
+
+    # Fixed charges: every occurrence of every fixed pattern, summed
+    fixed_total = sum_matches(RE_FIXED, full_text)
+    if fixed_total > 0:
+        extracted_data['fixed_charges'] = fixed_total
+
+    return extracted_data
+
+
+def parse_meter_reading(text: str, expected: Optional[Dict[str, float]] = None) -> Optional[float]:
+    """The most plausible meter reading in OCR text (tesseract TSV or plain), see meter_ranker.py"""
+    return best_reading(text, expected)
@@ -1,10 +1,10 @@
 import streamlit as st
 import pandas as pd
-import pytesseract
-from pdf2image import convert_from_bytes
-from PIL import Image
-import io
 from datetime import datetime
+from pdf_text import extract_pages
+from meter_ocr import read_meter_cached
+from meter_store import meter_id
+from uploads import get_upload_store
 
 st.set_page_config(page_title="Bill Splitter", layout="wide")
 
@@ -14,7 +14,10 @@ st.set_page_config(page_title="Bill Splitter", layout="wide")
 class BillProcessor:
     """Process and extract data from bills and meter readings"""
     
-    def __init__(self):
+    def __init__(self, ocr_workers=None):
+        # None uses OCR_WORKERS from the environment; >1 OCRs PDF pages in a process pool
+        self.ocr_workers = ocr_workers
+        self.last_page_sources = []
         self.extracted_data = {
             "electricity": {},
             "water": {},
@@ -24,12 +27,10 @@ class BillProcessor:
         }
 
     def extract_text_from_pdf(self, pdf_bytes):
-        images = convert_from_bytes(pdf_bytes)
-        full_text = ""
-        for img in images:
-            text = pytesseract.image_to_string(img, lang='heb+eng')
-            full_text += text + "\n"
-        return full_text
+        # Text layer first; only scanned pages are OCR'd (and cached per page)
+        pages = extract_pages(pdf_bytes, lang='heb+eng', dpi=200, ocr_workers=self.ocr_workers)
+        self.last_page_sources = [p['source'] for p in pages]
+        return "".join(p['text'] + "\n" for p in pages)
 
     def extract_meter_reading(self, text, keywords):
         # Search for numbers near keywords
@@ -46,7 +47,8 @@ class BillProcessor:
         self.extracted_data['electricity'] = {
             "total": self.extract_meter_reading(text, ['חשמל', 'קוט"ש', 'קילוואט']),
             "consumption": self.extract_meter_reading(text, ['צריכה']),
-            "fixed": self.extract_meter_reading(text, ['חיובים קבועים'])
+            "fixed": self.extract_meter_reading(text, ['חיובים קבועים']),
+            "page_sources": self.last_page_sources
         }
 
     def process_water(self, pdf_bytes):
@@ -54,20 +56,22 @@ class BillProcessor:
         self.extracted_data['water'] = {
             "total": self.extract_meter_reading(text, ['מים']),
             "consumption": self.extract_meter_reading(text, ['מ"ק']),
-            "fixed": self.extract_meter_reading(text, ['חיובים קבועים'])
+            "fixed": self.extract_meter_reading(text, ['חיובים קבועים']),
+            "page_sources": self.last_page_sources
         }
 
     def process_tax(self, pdf_bytes):
         text = self.extract_text_from_pdf(pdf_bytes)
         self.extracted_data['tax'] = {
-            "total": self.extract_meter_reading(text, ['ארנונה'])
+            "total": self.extract_meter_reading(text, ['ארנונה']),
+            "page_sources": self.last_page_sources
         }
 
     def process_meter_image(self, image_bytes, meter_type):
-        img = Image.open(io.BytesIO(image_bytes))
-        text = pytesseract.image_to_string(img, lang='heb+eng')
-        value = self.extract_meter_reading(text, ['קריאה', 'מטר'])
-        self.extracted_data[f"{meter_type}_meter"] = {"reading": value}
+        # Digit window only, digits-only OCR; photos seen before come from the OCR cache.
+        # Candidates are ranked against apartment 1's recorded readings of this meter.
+        value = read_meter_cached(image_bytes, meter_id('apt1', 'electricity' if meter_type == 'elec' else 'water'))
+        self.extracted_data[f"{meter_type}_meter"] = {"reading": value or 0.0}
 
 
 # =========================
@@ -95,11 +99,13 @@ def main():
         water_meter_img = st.file_uploader("Upload Water Meter Image", type=["png", "jpg", "jpeg"], key="water_img")
 
         if st.button("Process Files"):
-            if elec_bill: processor.process_electricity(elec_bill.read())
-            if water_bill: processor.process_water(water_bill.read())
-            if tax_bill: processor.process_tax(tax_bill.read())
-            if elec_meter_img: processor.process_meter_image(elec_meter_img.read(), "elec")
-            if water_meter_img: processor.process_meter_image(water_meter_img.read(), "water")
+            # Views of Streamlit's upload buffers, no copies
+            uploads = get_upload_store()
+            if elec_bill: processor.process_electricity(uploads.add(elec_bill).view)
+            if water_bill: processor.process_water(uploads.add(water_bill).view)
+            if tax_bill: processor.process_tax(uploads.add(tax_bill).view)
+            if elec_meter_img: processor.process_meter_image(uploads.add(elec_meter_img).view, "elec")
+            if water_meter_img: processor.process_meter_image(uploads.add(water_meter_img).view, "water")
 
             st.session_state['extracted_data'] = processor.extracted_data
             st.success("Files processed successfully!")
@@ -1,13 +1,21 @@
 import streamlit as st
 import pandas as pd
-from PIL import Image
-import pytesseract
-import pdfplumber
 import re
 from datetime import datetime
 from typing import Dict, Tuple, Optional
 import json
 import os
+import sys
+
+# Shared engines (OCR cache, ...) live at the repository root
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from pdf_text import extract_text
+from bill_parser import parse_bill_text
+from meter_ocr import read_meter_cached
+from uploads import get_upload_store
+from bill_calculator import BillCalculator
+from history_store import current_period, get_history_store, year_range
+from meter_store import MeterReadingError, get_meter_store, meter_id
 
 # Configure Streamlit page
 st.set_page_config(
@@ -16,15 +24,53 @@ st.set_page_config(
     layout="wide"
 )
 
-# Initialize session state
-if 'previous_readings' not in st.session_state:
-    st.session_state.previous_readings = {
-        'electricity': None,
-        'water': None
-    }
+# Apartment 1's sub-meters; readings persist across sessions (meter_store.py)
+meters = get_meter_store()
+APT1_METERS = {'electricity': meter_id('apt1', 'electricity'), 'water': meter_id('apt1', 'water')}
+
+HISTORY_PAGE_SIZE = 10
+
+
+def valid_period(period: str) -> bool:
+    """A YYYY-MM billing period with a real month (2025-13 and 2025-00 are not)"""
+    if not re.fullmatch(r'\d{4}-\d{2}', period):
+        return False
+    try:
+        datetime.strptime(period, '%Y-%m')
+    except ValueError:
+        return False
+    return True
+
+
+def apt1_consumption(bill_type: str, reading: float) -> Optional[float]:
+    """Apartment 1's consumption up to this reading (None without a previous one); stops the page on a misread"""
+    try:
+        return meters.consumption(APT1_METERS[bill_type], reading)
+    except MeterReadingError as e:
+        st.error(f"קריאת מונה לא תקינה ({BILL_NAMES[bill_type]}): {e}")
+        st.stop()
 
-if 'calculation_history' not in st.session_state:
-    st.session_state.calculation_history = []
+
+def save_apt1_readings(readings: Dict[str, float], extracted: Dict[str, Optional[float]]) -> None:
+    """Append the current readings, so they are the next bill's previous readings; only on the user's request"""
+    # 0 is an empty field, not a reading
+    readings = {bill_type: reading for bill_type, reading in readings.items() if reading}
+    if not readings:
+        st.warning("אין קריאות לשמירה: הזינו קריאת מונה גדולה מ-0.")
+        return
+    source = 'ocr' if all(reading == extracted.get(bill_type) for bill_type, reading in readings.items()) else 'manual'
+    try:
+        # Both readings are validated (including against an implausible jump) before either is written
+        meters.record_many({APT1_METERS[bill_type]: reading for bill_type, reading in readings.items()}, source=source)
+        st.success("הקריאות נשמרו ויהיו הקריאות הקודמות בחישוב הבא.")
+    except MeterReadingError as e:
+        st.error(f"קריאה לא תקינה: {e}")
+
+BILL_NAMES = {
+    'electricity': 'חשמל',
+    'water': 'מים',
+    'tax': 'ארנונה'
+}
 
 class BillProcessor:
     """Process and extract data from bills and meter readings"""
@@ -33,70 +79,11 @@ class BillProcessor:
     def extract_from_pdf(pdf_file) -> Dict:
         """Extract relevant data from PDF bills"""
         try:
-            extracted_data = {
-                'total_amount': None,
-                'consumption': None,
-                'fixed_charges': None,
-                'billing_period': None,
-                'bill_type': None
-            }
+            # Native text layer first, OCR only for scanned/garbled pages
+            full_text, pages = extract_text(get_upload_store().add(pdf_file).view)
+            extracted_data = parse_bill_text(full_text)
+            extracted_data['page_sources'] = [p['source'] for p in pages]
             
-            with pdfplumber.open(pdf_file) as pdf:
-                full_text = ""
-                for page in pdf.pages:
-                    full_text += page.extract_text() or ""
-                
-                # Detect bill type
-                if any(word in full_text for word in ['חשמל', 'קוט"ש', 'קילוואט']):
-                    extracted_data['bill_type'] = 'electricity'
-                elif any(word in full_text for word in ['מים', 'מ"ק', 'קוב']):
-                    extracted_data['bill_type'] = 'water'
-                elif any(word in full_text for word in ['ארנונה', 'עירייה', 'מועצה']):
-                    extracted_data['bill_type'] = 'tax'
-                
-                # Extract total amount
-                amount_patterns = [
-                    r'סה"כ לתשלום[:\s]*([0-9,]+\.?[0-9]*)',
-                    r'לתשלום[:\s]*([0-9,]+\.?[0-9]*)',
-                    r'סכום כולל[:\s]*([0-9,]+\.?[0-9]*)',
-                    r'סה"כ[:\s]*([0-9,]+\.?[0-9]*)'
-                ]
-                
-                for pattern in amount_patterns:
-                    match = re.search(pattern, full_text)
-                    if match:
-                        amount_str = match.group(1).replace(',', '')
-                        extracted_data['total_amount'] = float(amount_str)
-                        break
-                
-                # Extract consumption (for electricity and water)
-                if extracted_data['bill_type'] == 'electricity':
-                    consumption_pattern = r'צריכה[:\s]*([0-9,]+\.?[0-9]*)\s*קוט"ש'
-                    match = re.search(consumption_pattern, full_text)
-                    if match:
-                        extracted_data['consumption'] = float(match.group(1).replace(',', ''))
-                elif extracted_data['bill_type'] == 'water':
-                    consumption_pattern = r'צריכה[:\s]*([0-9,]+\.?[0-9]*)\s*מ"ק'
-                    match = re.search(consumption_pattern, full_text)
-                    if match:
-                        extracted_data['consumption'] = float(match.group(1).replace(',', ''))
-                
-                # Extract fixed charges
-                fixed_patterns = [
-                    r'דמי שירות[:\s]*([0-9,]+\.?[0-9]*)',
-                    r'תשלום קבוע[:\s]*([0-9,]+\.?[0-9]*)',
-                    r'עלות מונה[:\s]*([0-9,]+\.?[0-9]*)'
-                ]
-                
-                fixed_total = 0
-                for pattern in fixed_patterns:
-                    matches = re.findall(pattern, full_text)
-                    for match in matches:
-                        fixed_total += float(match.replace(',', ''))
-                
-                if fixed_total > 0:
-                    extracted_data['fixed_charges'] = fixed_total
-                
             return extracted_data
             
         except Exception as e:
@@ -104,82 +91,17 @@ class BillProcessor:
             return {}
     
     @staticmethod
-    def extract_meter_reading(image_file) -> Optional[float]:
+    def extract_meter_reading(image_file, bill_type: Optional[str] = None) -> Optional[float]:
         """Extract meter reading from image using OCR"""
         try:
-            image = Image.open(image_file)
-            
-            # Use OCR to extract text
-            text = pytesseract.image_to_string(image, lang='heb+eng')
-            
-            # Look for number patterns (meter readings)
-            number_patterns = [
-                r'\b([0-9]{4,6}\.?[0-9]{0,2})\b',
-                r'\b([0-9]+\.[0-9]+)\b',
-                r'\b([0-9]{4,})\b'
-            ]
-            
-            for pattern in number_patterns:
-                matches = re.findall(pattern, text)
-                if matches:
-                    # Return the first valid number found
-                    for match in matches:
-                        reading = float(match)
-                        if 1000 < reading < 999999:  # Reasonable meter reading range
-                            return reading
-            
-            return None
+            # Digit window only, digits-only OCR (cached by content, Streamlit reruns hit the cache);
+            # the numbers read are ranked against apartment 1's history for this meter
+            return read_meter_cached(get_upload_store().add(image_file).view, APT1_METERS.get(bill_type))
             
         except Exception as e:
             st.error(f"שגיאה בקריאת תמונת מונה: {str(e)}")
             return None
 
-class BillCalculator:
-    """Calculate bill splits between apartments"""
-    
-    @staticmethod
-    def calculate_split(bill_type: str, total_amount: float, 
-                        consumption: Optional[float] = None,
-                        fixed_charges: Optional[float] = None,
-                        apt1_consumption: Optional[float] = None) -> Dict:
-        """Calculate the split between apartments based on bill type"""
-        
-        result = {
-            'apt1': {'fixed': 0, 'consumption': 0, 'total': 0},
-            'apt2': {'fixed': 0, 'consumption': 0, 'total': 0},
-            'total': total_amount
-        }
-        
-        if bill_type == 'tax':
-            # City tax - 50/50 split
-            result['apt1']['total'] = total_amount / 2
-            result['apt2']['total'] = total_amount / 2
-            
-        elif bill_type in ['electricity', 'water']:
-            # Fixed charges - 50/50 split
-            if fixed_charges:
-                result['apt1']['fixed'] = fixed_charges / 2
-                result['apt2']['fixed'] = fixed_charges / 2
-            
-            # Consumption charges
-            consumption_charges = total_amount - (fixed_charges or 0)
-            
-            if apt1_consumption and consumption:
-                # Apartment 1 pays based on its meter reading
-                apt1_ratio = apt1_consumption / consumption
-                result['apt1']['consumption'] = consumption_charges * apt1_ratio
-                result['apt2']['consumption'] = consumption_charges * (1 - apt1_ratio)
-            else:
-                # If no meter reading, split 50/50
-                result['apt1']['consumption'] = consumption_charges / 2
-                result['apt2']['consumption'] = consumption_charges / 2
-            
-            # Calculate totals
-            result['apt1']['total'] = result['apt1']['fixed'] + result['apt1']['consumption']
-            result['apt2']['total'] = result['apt2']['fixed'] + result['apt2']['consumption']
-        
-        return result
-
 def main():
     st.title("🏠 מערכת חלוקת חשבונות דירות")
     st.markdown("---")
@@ -191,21 +113,31 @@ def main():
         st.subheader("קריאות מונה קודמות")
         prev_elec = st.number_input(
             "חשמל (קוט״ש)", 
-            value=st.session_state.previous_readings['electricity'] or 0.0,
+            value=meters.latest_reading(APT1_METERS['electricity']) or 0.0,
             min_value=0.0,
             step=0.1
         )
         prev_water = st.number_input(
             "מים (מ״ק)", 
-            value=st.session_state.previous_readings['water'] or 0.0,
+            value=meters.latest_reading(APT1_METERS['water']) or 0.0,
             min_value=0.0,
             step=0.1
         )
+        replaced = st.checkbox("המונה הוחלף (הקריאה מתחילה מחדש)")
         
         if st.button("שמור קריאות קודמות"):
-            st.session_state.previous_readings['electricity'] = prev_elec
-            st.session_state.previous_readings['water'] = prev_water
-            st.success("נשמר בהצלחה!")
+            # 0 is the empty field of a meter with no history, not a reading
+            readings = {APT1_METERS[bill_type]: reading
+                        for bill_type, reading in (('electricity', prev_elec), ('water', prev_water)) if reading}
+            if not readings:
+                st.warning("אין קריאות לשמירה: הזינו קריאת מונה גדולה מ-0.")
+            else:
+                try:
+                    # Both readings are validated before either is written
+                    meters.record_many(readings, replacement=replaced)
+                    st.success("נשמר בהצלחה!")
+                except MeterReadingError as e:
+                    st.error(f"קריאה לא תקינה: {e}. אם המונה הוחלף, סמנו זאת ושמרו שוב.")
     
     # Main content area
     tab1, tab2, tab3 = st.tabs(["📄 העלאת חשבונות", "🧮 חישוב וחלוקה", "📊 היסטוריה"])
@@ -275,16 +207,22 @@ def main():
                 
                 # Process meter images
                 if elec_meter_img:
-                    reading = processor.extract_meter_reading(elec_meter_img)
+                    reading = processor.extract_meter_reading(elec_meter_img, 'electricity')
                     if reading:
                         st.session_state.extracted_data['elec_meter'] = reading
                 
                 if water_meter_img:
-                    reading = processor.extract_meter_reading(water_meter_img)
+                    reading = processor.extract_meter_reading(water_meter_img, 'water')
                     if reading:
                         st.session_state.extracted_data['water_meter'] = reading
             
             st.success("הקבצים עובדו בהצלחה!")
+            
+            # Which pages were read from the text layer and which needed OCR
+            for bill_key in ['electricity', 'water', 'tax']:
+                sources = st.session_state.extracted_data.get(bill_key, {}).get('page_sources')
+                if sources:
+                    st.caption(f"{bill_key}: " + ", ".join(f"עמוד {i + 1}: {src}" for i, src in enumerate(sources)))
     
     with tab2:
         st.header("חישוב וחלוקה")
@@ -353,16 +291,23 @@ def main():
             
             st.markdown("---")
             
+            billing_period = st.text_input("תקופת חיוב (YYYY-MM)", value=current_period(), key="billing_period_input")
+            
             # Calculate button
             if st.button("חשב חלוקה", type="primary"):
+                if not valid_period(billing_period):
+                    st.error("תקופת חיוב לא תקינה, יש להזין בפורמט YYYY-MM עם חודש 01-12")
+                    st.stop()
+                
                 calculator = BillCalculator()
                 results = {}
                 
                 # Calculate electricity
                 if elec_total > 0:
                     apt1_cons = None
-                    if elec_apt1_reading and st.session_state.previous_readings['electricity']:
-                        apt1_cons = elec_apt1_reading - st.session_state.previous_readings['electricity']
+                    if elec_apt1_reading:
+                        # Since the last recorded reading, across an odometer rollover
+                        apt1_cons = apt1_consumption('electricity', elec_apt1_reading)
                     
                     results['electricity'] = calculator.calculate_split(
                         'electricity', elec_total, elec_consumption, 
@@ -372,8 +317,9 @@ def main():
                 # Calculate water
                 if water_total > 0:
                     apt1_cons = None
-                    if water_apt1_reading and st.session_state.previous_readings['water']:
-                        apt1_cons = water_apt1_reading - st.session_state.previous_readings['water']
+                    if water_apt1_reading:
+                        # Since the last recorded reading, across an odometer rollover
+                        apt1_cons = apt1_consumption('water', water_apt1_reading)
                     
                     results['water'] = calculator.calculate_split(
                         'water', water_total, water_consumption, 
@@ -390,13 +336,7 @@ def main():
                 # Create summary table
                 summary_data = []
                 
-                bill_names = {
-                    'electricity': 'חשמל',
-                    'water': 'מים', 
-                    'tax': 'ארנונה'
-                }
-                
-                for bill_type, bill_name in bill_names.items():
+                for bill_type, bill_name in BILL_NAMES.items():
                     if bill_type in results:
                         summary_data.append({
                             'חשבון': bill_name,
@@ -437,15 +377,13 @@ def main():
                     mime="text/csv"
                 )
                 
-                # Save to history
-                st.session_state.calculation_history.append({
-                    'timestamp': datetime.now().strftime('%Y-%m-%d %H:%M'),
-                    'data': df.to_dict('records')
-                })
+                # Save to history (persistent, survives restarts)
+                if results:
+                    get_history_store().append_calculation(results, period=billing_period, source='claude')
                 
                 # Show detailed breakdown
                 with st.expander("פירוט מלא"):
-                    for bill_type, bill_name in bill_names.items():
+                    for bill_type, bill_name in BILL_NAMES.items():
                         if bill_type in results:
                             st.markdown(f"**{bill_name}:**")
                             col1, col2 = st.columns(2)
@@ -463,15 +401,54 @@ def main():
                                 st.write(f"- **סה״כ: ₪{results[bill_type]['apt2']['total']:.2f}**")
                             
                             st.markdown("---")
+            
+            # Only on request: calculating (again, or with what-if numbers) never writes to the meter history
+            if st.button("💾 שמור קריאות נוכחיות"):
+                save_apt1_readings({'electricity': elec_apt1_reading, 'water': water_apt1_reading},
+                                   {'electricity': st.session_state.extracted_data.get('elec_meter'),
+                                    'water': st.session_state.extracted_data.get('water_meter')})
     
     with tab3:
         st.header("היסטוריית חישובים")
         
-        if st.session_state.calculation_history:
-            for calc in reversed(st.session_state.calculation_history):
-                with st.expander(f"חישוב מתאריך: {calc['timestamp']}"):
-                    df = pd.DataFrame(calc['data'])
-                    st.dataframe(df, use_container_width=True, hide_index=True)
+        col1, col2 = st.columns(2)
+        with col1:
+            history_year = st.number_input("שנה", min_value=2000, max_value=2100, value=datetime.now().year, step=1)
+        with col2:
+            history_bill_type = st.selectbox(
+                "סוג חשבון", ['all'] + list(BILL_NAMES),
+                format_func=lambda t: 'הכל' if t == 'all' else BILL_NAMES[t]
+            )
+        
+        period_from, period_to = year_range(int(history_year))
+        bill_type_filter = None if history_bill_type == 'all' else history_bill_type
+        store = get_history_store()
+        
+        # Per-period totals come from the precomputed summary index
+        summary = store.period_summary(period_from, period_to, bill_type_filter)
+        if summary:
+            st.subheader("סיכום לפי תקופה")
+            summary_df = pd.DataFrame(summary).pivot_table(
+                index='period', columns='apartment', values='amount', aggfunc='sum'
+            ).round(2).sort_index(ascending=False).rename(columns={'apt1': 'דירה 1 (₪)', 'apt2': 'דירה 2 (₪)'})
+            summary_df.index.name = 'תקופה'
+            st.dataframe(summary_df, use_container_width=True)
+        
+        # Only the visible page of calculations is loaded and rendered
+        total_calcs = store.count_calculations(bill_type_filter, period_from, period_to)
+        if total_calcs:
+            page_count = (total_calcs + HISTORY_PAGE_SIZE - 1) // HISTORY_PAGE_SIZE
+            page_no = st.number_input(
+                f"עמוד (מתוך {page_count})", min_value=1, max_value=page_count, value=1, step=1, key="history_page"
+            )
+            for calc in store.page(int(page_no) - 1, HISTORY_PAGE_SIZE, bill_type_filter, period_from, period_to):
+                created = datetime.fromtimestamp(calc['created_at']).strftime('%Y-%m-%d %H:%M')
+                with st.expander(f"חישוב מתאריך: {created} (תקופה {calc['period']})"):
+                    calc_df = pd.DataFrame(calc['lines']).pivot_table(
+                        index='bill_type', columns='apartment', values='amount', aggfunc='sum'
+                    ).round(2).rename(index=BILL_NAMES, columns={'apt1': 'דירה 1 (₪)', 'apt2': 'דירה 2 (₪)'})
+                    calc_df.index.name = 'חשבון'
+                    st.dataframe(calc_df, use_container_width=True)
         else:
             st.info("אין היסטוריית חישובים עדיין")
 
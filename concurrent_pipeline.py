@@ -0,0 +1,259 @@
+"""Run independent bill pipelines (OCR -> LLM) concurrently.
+
+Each pipeline spends its time waiting on OCR and on Gemini, so running the
+arnona, electricity, water and meter pipelines on a thread pool makes the wall
+time roughly that of the slowest one instead of the sum. Calls to an external
+provider go through ``provider_slot(name)``, a process-wide semaphore per
+provider, so quota-limited APIs (and EasyOCR, which should not run twice at
+once on one model) never see more than their limit in flight. Gemini calls go
+through ``gemini_scheduler`` instead, whose worker count is the 'gemini' limit.
+
+A run can be cancelled (explicitly, by timeout, or when the Streamlit script
+is stopped): queued pipelines never start and running ones stop at their next
+``provider_slot``.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+try:
+    from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+    HAVE_STREAMLIT_CTX = True
+except ImportError:
+    HAVE_STREAMLIT_CTX = False
+
+# Concurrent calls allowed per provider; override with e.g. PIPELINE_LIMITS="gemini=4,vision=8"
+DEFAULT_LIMITS = {'gemini': 2, 'vision': 4, 'easyocr': 1}
+SLOT_POLL_SECONDS = 0.1
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    limits = {}
+    for item in spec.split(','):
+        if '=' in item:
+            name, value = item.split('=', 1)
+            limits[name.strip()] = max(1, int(value))
+    return limits
+
+
+PROVIDER_LIMITS = {**DEFAULT_LIMITS, **parse_limits(os.environ.get("PIPELINE_LIMITS", ""))}
+_semaphores: Dict[str, threading.BoundedSemaphore] = {}
+_semaphores_lock = threading.Lock()
+_current = threading.local()
+
+
+class Cancelled(Exception):
+    """The pipeline run was cancelled before this step started"""
+
+
+def current_run() -> Optional['PipelineRun']:
+    """The pipeline run the calling thread works for, if any"""
+    return getattr(_current, 'run', None)
+
+
+def with_script_ctx(func: Callable[[], Any]) -> Callable[[], Any]:
+    """func, to be run on another thread (e.g. a scheduler worker) with the caller's Streamlit context,
+    so that placeholders it updates (st.empty()) reach the caller's page"""
+    ctx = get_script_run_ctx() if HAVE_STREAMLIT_CTX else None
+    if ctx is None:
+        return func
+
+    def call():
+        thread = threading.current_thread()
+        previous = get_script_run_ctx()
+        add_script_run_ctx(thread, ctx)
+        try:
+            return func()
+        finally:
+            # Worker threads are shared between sessions
+            add_script_run_ctx(thread, previous)
+    return call
+
+
+def _semaphore(provider: str) -> threading.BoundedSemaphore:
+    with _semaphores_lock:
+        if provider not in _semaphores:
+            _semaphores[provider] = threading.BoundedSemaphore(PROVIDER_LIMITS.get(provider, 1))
+        return _semaphores[provider]
+
+
+@contextmanager
+def provider_slot(provider: str):
+    """Hold one of the provider's slots for the duration of a call.
+
+    Outside of a pipeline run this is just the semaphore; inside one it gives
+    up (raising Cancelled) as soon as the run is cancelled.
+    """
+    run = current_run()
+    semaphore = _semaphore(provider)
+    while not semaphore.acquire(timeout=SLOT_POLL_SECONDS):
+        if run is not None and run.cancelled:
+            raise Cancelled(provider)
+    try:
+        if run is not None and run.cancelled:
+            raise Cancelled(provider)
+        yield
+    finally:
+        semaphore.release()
+
+
+class PipelineRun:
+    """One batch of concurrent pipelines, cancellable as a whole"""
+
+    def __init__(self, max_workers: Optional[int] = None, timeout: Optional[float] = None):
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self._cancel = threading.Event()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self) -> None:
+        self._cancel.set()
+
+    def _call(self, ctx, func: Callable[[], Any]) -> Any:
+        if ctx is not None:
+            # Lets st.spinner / st.error inside the pipeline reach the page
+            add_script_run_ctx(threading.current_thread(), ctx)
+        _current.run = self
+        try:
+            if self.cancelled:
+                raise Cancelled()
+            return func()
+        finally:
+            _current.run = None
+
+    def run(self, tasks: Dict[str, Callable[[], Any]]) -> Dict[str, Dict]:
+        """Run every task concurrently; {'name': {'result', 'error', 'seconds'}} in task order"""
+        ctx = get_script_run_ctx() if HAVE_STREAMLIT_CTX else None
+        results = {name: {'result': None, 'error': None, 'seconds': 0.0} for name in tasks}
+        started = {}
+
+        def timed(name, func):
+            started[name] = time.perf_counter()
+            try:
+                return self._call(ctx, func)
+            finally:
+                results[name]['seconds'] = time.perf_counter() - started[name]
+
+        pool = ThreadPoolExecutor(max_workers=self.max_workers or len(tasks) or 1,
+                                  thread_name_prefix='bill-pipeline')
+        futures = {pool.submit(timed, name, func): name for name, func in tasks.items()}
+        try:
+            done, not_done = wait(futures, timeout=self.timeout)
+            if not_done:
+                self.cancel()
+                for future in not_done:
+                    future.cancel()
+                    results[futures[future]]['error'] = Cancelled('timed out')
+            for future in done:
+                name = futures[future]
+                try:
+                    results[name]['result'] = future.result()
+                except Exception as e:
+                    results[name]['error'] = e
+        finally:
+            # Also reached when Streamlit stops the script: don't leave pipelines running
+            if not all(future.done() for future in futures):
+                self.cancel()
+            pool.shutdown(wait=False, cancel_futures=True)
+        return results
+
+
+def run_pipelines(tasks: Dict[str, Callable[[], Any]], timeout: Optional[float] = None) -> Dict[str, Dict]:
+    """Run the tasks concurrently and wait for all of them (or the timeout)"""
+    return PipelineRun(timeout=timeout).run(tasks)
+
+
+# --- "Process All" batch, shared by the multi-bill Streamlit apps ---
+# Streamlit, pandas and the stores are imported on use, so the pipeline runner
+# above stays importable (and testable) without them.
+PROCESS_ALL_TIMEOUT = 300  # seconds
+PROCESS_ALL_LABELS = {'tax': "City Tax bill", 'elec_bill': "Electricity bill", 'elec_meter': "Electricity meter photo",
+                      'water_bill': "Water bill", 'water_meter': "Water meter photo"}
+
+
+def add_tax_result(tax_data: Dict[str, float], file_name: str, source: str) -> None:
+    """Show the city tax breakdown and add the 50/50 split to the summary (and to the history, tagged source)"""
+    import pandas as pd
+    import streamlit as st
+    from history_store import get_history_store
+    from split_engine import split_bill
+
+    df = pd.DataFrame.from_dict(tax_data, orient='index', columns=['Total Amount (₪)'])
+    df.loc['**Total Payment**'] = df.sum()
+    df['Apartment 1 (₪)'] = df['Total Amount (₪)'] / 2; df['Apartment 2 (₪)'] = df['Total Amount (₪)'] / 2
+    # The payment itself in whole agorot: an odd agora goes to one apartment instead of half to each
+    total = float(df.loc['**Total Payment**', 'Total Amount (₪)'])
+    total1, total2 = map(float, split_bill(total, total, [0.0, 0.0])['total'])
+    df.loc['**Total Payment**', ['Apartment 1 (₪)', 'Apartment 2 (₪)']] = [total1, total2]
+    st.subheader("City Tax Bill Breakdown"); st.dataframe(df.style.format("{:.2f}"), use_container_width=True)
+    result = {'Bill Type': f'City Tax ({file_name})', 'Apartment 1 (₪)': total1, 'Apartment 2 (₪)': total2}
+    st.session_state.processed_bills.add(result); st.session_state.last_tax_result = result
+    get_history_store().append_split('tax', total1, total2, label=file_name, source=source)
+
+
+def start_split_workflow(prefix: str, bill_data: Dict, meter_data: Dict, bill_name: str) -> None:
+    """Move an electricity/water flow to step 2 with already extracted data"""
+    import streamlit as st
+    st.session_state[f'{prefix}_step'] = "processing"
+    st.session_state[f'{prefix}_bill_data'], st.session_state[f'{prefix}_meter_reading'] = bill_data, meter_data
+    st.session_state[f'{prefix}_bill_name'] = bill_name
+
+
+def process_all(files: Dict[str, Any], pipelines: Dict[str, Callable[[Any], Any]], source: str,
+                prefetch: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+    """Run every uploaded file's pipeline concurrently and hand the results to the per-bill flows.
+
+    files maps the PROCESS_ALL_LABELS names to uploads (or None); pipelines maps
+    the same names to the app's process_* function for that upload. prefetch,
+    if given, gets the uploaded files first (e.g. to batch their OCR).
+    """
+    import streamlit as st
+    files = {name: upload for name, upload in files.items() if upload}
+    tasks = {name: (lambda pipeline=pipelines[name], upload=upload: pipeline(upload)) for name, upload in files.items()}
+    started = time.perf_counter()
+    if prefetch is not None:
+        prefetch(files)
+    with st.spinner(f"Processing {len(tasks)} documents in parallel..."):
+        results = run_pipelines(tasks, timeout=PROCESS_ALL_TIMEOUT)
+    report = {'wall': time.perf_counter() - started, 'sequential': sum(r['seconds'] for r in results.values()), 'lines': []}
+    for name, outcome in results.items():
+        status = f"failed: {outcome['error']}" if outcome['error'] else ("ok" if outcome['result'] else "no data")
+        report['lines'].append(f"{PROCESS_ALL_LABELS[name]}: {status} ({outcome['seconds']:.1f}s)")
+    result = {name: outcome['result'] for name, outcome in results.items()}
+    if result.get('tax'):
+        add_tax_result(result['tax'], files['tax'].name, source)
+    if result.get('elec_bill') and result.get('elec_meter'):
+        start_split_workflow('elec', result['elec_bill'], {'current_reading_kwh': result['elec_meter']}, files['elec_bill'].name)
+    if result.get('water_bill') and result.get('water_meter'):
+        start_split_workflow('water', result['water_bill'], {'current_reading_m3': result['water_meter']}, files['water_bill'].name)
+    st.session_state.process_all_report = report
+
+
+def process_all_form(pipelines: Dict[str, Callable[[Any], Any]], source: str,
+                     prefetch: Optional[Callable[[Dict[str, Any]], None]] = None) -> None:
+    """The "Process All" upload form and the report of its last run"""
+    import streamlit as st
+    with st.form("process_all_form"):
+        st.caption("Upload any of the bills (each utility bill with a photo of its current meter). They are read and analyzed in parallel, then continue below.")
+        files = {'tax': st.file_uploader("City Tax bill", type=['pdf', 'png', 'jpg', 'jpeg'], key="all_tax_up")}
+        col1, col2 = st.columns(2)
+        files['elec_bill'] = col1.file_uploader("Electricity bill", key="all_elec_bill_up")
+        files['elec_meter'] = col1.file_uploader("Photo of **current** electricity meter", key="all_elec_meter_up")
+        files['water_bill'] = col2.file_uploader("Water bill", key="all_water_bill_up")
+        files['water_meter'] = col2.file_uploader("Photo of **current** water meter", key="all_water_meter_up")
+        if st.form_submit_button("Process All"):
+            if (files['elec_bill'] is None) != (files['elec_meter'] is None) or (files['water_bill'] is None) != (files['water_meter'] is None):
+                st.error("Upload each utility bill together with the photo of its current meter.")
+            elif not (files['tax'] or files['elec_bill'] or files['water_bill']): st.error("Please upload at least one bill.")
+            else:
+                process_all(files, pipelines, source, prefetch); st.rerun()
+    if st.session_state.get('process_all_report'):
+        report = st.session_state.process_all_report
+        st.caption(f"Last run: {report['wall']:.1f}s wall time for {report['sequential']:.1f}s of work")
+        for line in report['lines']: st.text(line)
@@ -0,0 +1,157 @@
+"""Precompiled multi-pattern field extraction.
+
+Rules are compiled once per process and each runs with the cheapest strategy
+for its shape:
+
+- a case-sensitive pattern that starts with its label runs as is, since
+  ``re`` already finds a literal prefix with a fast substring search;
+- a pattern that starts with an alternation or is case-insensitive (where
+  ``re`` falls back to trying the pattern at every character) is indexed by
+  its literal anchors. Those are found with ``str.find`` chunk by chunk, and
+  the regex only runs, anchored with ``match``, at those positions.
+
+Precedence is resolved the same way as the per-pattern code it replaces:
+
+- regular fields take the leftmost match of the highest-priority rule that
+  matches at all (``for pattern in patterns: re.search(...); break``), and
+  lower-priority rules are never evaluated once one hits; scanning stops at
+  the first hit;
+- sum fields add up every non-overlapping match of every rule, rule by rule
+  (``for pattern in patterns: re.findall(...)``).
+
+A single combined alternation over all rules was measured first: CPython's
+``re`` tries every branch at every character, which made one pass several
+times slower than separate literal-prefixed searches (see
+bench_field_extractor.py).
+
+Only rule sets with alternation or case-insensitive patterns gain from this
+(main_agent_bill_splitter's, about 2x). bill_parser's patterns all start with
+their label and measured slightly slower through the extractor, so they stay
+on plain ``re.search``.
+"""
+import re
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Characters that end the literal prefix of a pattern
+RE_LITERAL_PREFIX = re.compile(r'[^\\\[\](){}.*+?^$|]+')
+IGNORECASE_PREFIX = '(?i:'
+CHUNK_SIZE = 1 << 14
+
+
+def to_float(raw: str) -> Optional[float]:
+    try:
+        return float(raw.replace(',', ''))
+    except ValueError:
+        return None
+
+
+def literal_prefix(pattern: str) -> str:
+    """The literal text every match of pattern starts with ('' if there is none)"""
+    m = RE_LITERAL_PREFIX.match(pattern)
+    if not m:
+        return ''
+    prefix = m.group(0)
+    # A quantifier after the prefix applies to its last character only
+    if pattern[m.end():m.end() + 1] in ('?', '*', '{'):
+        prefix = prefix[:-1]
+    return prefix
+
+
+class FieldExtractor:
+    """Compiled extractor for (field, pattern[, anchors]) rules listed in priority order.
+
+    Each pattern must have exactly one capturing group, the number. Anchors are
+    the literals a match can start with; pass them for patterns that start with
+    an alternation. A pattern wrapped in ``(?i:...)`` is case-insensitive and
+    its anchors are looked up in the lower-cased text.
+    """
+
+    def __init__(self, rules: Sequence[Tuple], sum_fields: Sequence[str] = ()):
+        self.rules = []
+        for rule in rules:
+            field, pattern = rule[0], rule[1]
+            compiled = re.compile(pattern)
+            if compiled.groups != 1:
+                raise ValueError(f"rule for {field!r} must have exactly one capturing group: {pattern}")
+            ignorecase = pattern.startswith(IGNORECASE_PREFIX)
+            anchors = list(rule[2]) if len(rule) > 2 else None
+            if anchors is None and ignorecase:
+                prefix = literal_prefix(pattern[len(IGNORECASE_PREFIX):])
+                anchors = [prefix] if prefix else None
+            if anchors is not None:
+                if not all(anchors):
+                    raise ValueError(f"rule for {field!r} has an empty anchor: {anchors}")
+                if ignorecase:
+                    anchors = [anchor.lower() for anchor in anchors]
+            self.rules.append((field, compiled, anchors, ignorecase))
+        self.sum_fields = set(sum_fields)
+        self.fields = list(dict.fromkeys(field for field, *_ in self.rules))
+
+    def extract(self, text: str) -> Dict[str, Optional[float]]:
+        """Value per field (None if not found)"""
+        lowered = {}
+        result = {field: None for field in self.fields}
+        resolved = set()
+        for field, compiled, anchors, ignorecase in self.rules:
+            if field in self.sum_fields:
+                if anchors is None:
+                    hits = compiled.findall(text)
+                else:
+                    hits = list(_anchored_finditer(text, compiled, anchors, ignorecase, lowered))
+                for raw in hits:
+                    value = to_float(raw)
+                    if value is not None:
+                        result[field] = (result[field] or 0) + value
+            elif field not in resolved:
+                if anchors is None:
+                    m = compiled.search(text)
+                    raw = m.group(1) if m else None
+                else:
+                    raw = next(_anchored_finditer(text, compiled, anchors, ignorecase, lowered), None)
+                if raw is not None:
+                    result[field] = to_float(raw)
+                    resolved.add(field)
+        return result
+
+
+def _anchored_finditer(text: str, compiled, anchors: List[str], ignorecase: bool,
+                       lowered: Dict) -> Iterator[str]:
+    """Leftmost, non-overlapping matches in order -- what re.findall returns, lazily"""
+    next_allowed = 0
+    for pos in _candidates(text, anchors, ignorecase, lowered):
+        if pos < next_allowed:
+            continue
+        m = compiled.match(text, pos)
+        if m:
+            next_allowed = max(m.end(), pos + 1)
+            yield m.group(1)
+
+
+def _candidates(text: str, anchors: List[str], ignorecase: bool, lowered: Dict) -> Iterator[int]:
+    """Anchor positions in increasing order, chunk by chunk so a caller that stops early scans little"""
+    overlap = max(len(anchor) for anchor in anchors) - 1
+    for start in range(0, len(text), CHUNK_SIZE):
+        end = start + CHUNK_SIZE
+        haystack, offset = text, 0
+        if ignorecase:
+            key = (start, overlap)
+            if key not in lowered:
+                chunk = text[start:end + overlap]
+                low = chunk.lower()
+                # lower() changes the length of a few characters; positions must line up
+                lowered[key] = low if len(low) == len(chunk) else None
+            haystack, offset = lowered[key], start
+        found = []
+        for anchor in anchors:
+            # An anchor starting before `end` may run into the next chunk
+            hi = end + len(anchor) - 1
+            if haystack is None:
+                found.extend(m.start() for m in re.compile(re.escape(anchor), re.I).finditer(text, start, hi))
+                continue
+            pos = haystack.find(anchor, start - offset, hi - offset)
+            while pos != -1:
+                found.append(pos + offset)
+                pos = haystack.find(anchor, pos + 1, hi - offset)
+        if len(anchors) > 1:
+            found.sort()
+        yield from found
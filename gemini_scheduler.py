@@ -0,0 +1,253 @@
+"""Shared Gemini clients and a rate-aware request scheduler.
+
+The apps built a new Gemini client for every file and every call, fired
+requests as fast as the pipelines produced them, and surfaced the first
+``ResourceExhausted`` to the user. Here:
+
+- clients are pooled per model (and API key), created once per process;
+- every request goes through one ``GeminiScheduler``: a priority queue drained
+  by ``PROVIDER_LIMITS['gemini']`` worker threads, each call paid for from a
+  token bucket refilled at ``GEMINI_RPM`` requests per minute;
+- quota / overload errors are retried with exponential backoff and full
+  jitter, and pause the whole bucket so the other workers back off too;
+- identical requests (same key, e.g. the LLM cache key) in flight at the same
+  time share one future, so two sessions analyzing the same bill cost one call;
+- interactive requests jump ahead of batch ones. Requests made inside a
+  ``concurrent_pipeline`` run (Process All) default to ``BATCH``.
+
+Callers block in ``call()``, which gives up (``Cancelled``) when their
+pipeline run is cancelled; a queued request nobody waits for any more is
+dropped without spending quota.
+"""
+import itertools
+import os
+import queue
+import random
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeout
+from typing import Any, Callable, Dict, Optional
+
+from backends import available, load
+from concurrent_pipeline import PROVIDER_LIMITS, SLOT_POLL_SECONDS, Cancelled, current_run
+
+INTERACTIVE = 0
+BATCH = 1
+
+GEMINI_RPM = float(os.environ.get("GEMINI_RPM", 15))
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", PROVIDER_LIMITS['gemini']))
+MAX_RETRIES = 5
+BACKOFF_BASE = 1.0  # seconds before the first retry, doubled every attempt
+BACKOFF_MAX = 60.0
+
+
+_retryable_errors = None
+
+
+def retryable_errors() -> tuple:
+    """google.api_core's quota / overload exceptions, imported with the first failed call"""
+    global _retryable_errors
+    if _retryable_errors is None:
+        if available('google_exceptions'):
+            exceptions = load('google_exceptions')
+            _retryable_errors = (exceptions.ResourceExhausted, exceptions.ServiceUnavailable,
+                                 exceptions.TooManyRequests)
+        else:
+            _retryable_errors = ()
+    return _retryable_errors
+
+
+def is_retryable(error: Exception) -> bool:
+    """Quota / overload errors, also when a client library wraps them in its own type"""
+    if retryable_errors() and isinstance(error, retryable_errors()):
+        return True
+    text = str(error)
+    return '429' in text or 'ResourceExhausted' in type(error).__name__ or 'RESOURCE_EXHAUSTED' in text
+
+
+def backoff_delay(attempt: int, base: float = BACKOFF_BASE, cap: float = BACKOFF_MAX) -> float:
+    """Full jitter: uniform in [0, min(cap, base * 2**attempt)]"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class TokenBucket:
+    """Requests per second with bursts up to ``capacity``; ``pause`` stops all takers for a while"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Take one token, sleeping until there is one; returns the seconds waited"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, seconds: float) -> None:
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+
+
+class _Request:
+    __slots__ = ('key', 'call', 'future', 'priority', 'waiters', 'claimed')
+
+    def __init__(self, key: str, call: Callable[[], Any], priority: int):
+        self.key = key
+        self.call = call
+        self.future = Future()
+        self.priority = priority
+        self.waiters = 0
+        self.claimed = False
+
+
+class GeminiScheduler:
+    """Priority queue of Gemini calls, run by a fixed set of workers under a token bucket"""
+
+    def __init__(self, workers: int = PROVIDER_LIMITS['gemini'], rpm: float = GEMINI_RPM,
+                 burst: int = GEMINI_BURST, max_retries: int = MAX_RETRIES):
+        self.bucket = TokenBucket(rpm / 60.0, max(1, burst))
+        self.max_retries = max_retries
+        self.stats = {'requests': 0, 'coalesced': 0, 'calls': 0, 'retries': 0, 'dropped': 0,
+                      'errors': 0, 'rate_wait_seconds': 0.0}
+        self._queue = queue.PriorityQueue()
+        self._order = itertools.count()
+        self._inflight: Dict[str, _Request] = {}
+        self._lock = threading.Lock()
+        for i in range(max(1, workers)):
+            threading.Thread(target=self._worker, name=f'gemini-{i}', daemon=True).start()
+
+    def submit(self, key: str, call: Callable[[], Any], priority: Optional[int] = None) -> Future:
+        """Queue call() unless an identical request (same key) is already queued or running"""
+        return self._join(key, call, priority).future
+
+    def call(self, key: str, call: Callable[[], Any], priority: Optional[int] = None,
+             timeout: Optional[float] = None) -> Any:
+        """submit() and wait for the result; raises Cancelled if the caller's pipeline run is cancelled"""
+        request = self._join(key, call, priority)
+        run = current_run()
+        deadline = None if timeout is None else time.monotonic() + timeout
+        try:
+            while True:
+                try:
+                    return request.future.result(timeout=SLOT_POLL_SECONDS)
+                except FutureTimeout:
+                    if run is not None and run.cancelled:
+                        raise Cancelled('gemini')
+                    if deadline is not None and time.monotonic() > deadline:
+                        raise
+        finally:
+            self._leave(request)
+
+    def _join(self, key: str, call: Callable[[], Any], priority: Optional[int]) -> _Request:
+        if priority is None:
+            priority = BATCH if current_run() is not None else INTERACTIVE
+        with self._lock:
+            self.stats['requests'] += 1
+            request = self._inflight.get(key)
+            if request is not None:
+                self.stats['coalesced'] += 1
+                if priority < request.priority and not request.claimed:
+                    # An interactive caller now waits for it: queue it again at the front
+                    request.priority = priority
+                    self._queue.put((priority, next(self._order), request))
+            else:
+                request = _Request(key, call, priority)
+                self._inflight[key] = request
+                self._queue.put((priority, next(self._order), request))
+            request.waiters += 1
+            return request
+
+    def _leave(self, request: _Request) -> None:
+        with self._lock:
+            request.waiters -= 1
+            if request.waiters == 0 and not request.claimed and not request.future.done():
+                # Every caller gave up before it started: don't spend quota on it
+                request.claimed = True
+                request.future.cancel()
+                self._inflight.pop(request.key, None)
+                self.stats['dropped'] += 1
+
+    def _worker(self) -> None:
+        while True:
+            _, _, request = self._queue.get()
+            with self._lock:
+                if request.claimed:
+                    # Dropped, or a duplicate queue entry after a priority upgrade
+                    continue
+                request.claimed = True
+            try:
+                request.future.set_result(self._execute(request.call))
+            except Exception as e:
+                self.stats['errors'] += 1
+                request.future.set_exception(e)
+            finally:
+                with self._lock:
+                    if self._inflight.get(request.key) is request:
+                        del self._inflight[request.key]
+
+    def _execute(self, call: Callable[[], Any]) -> Any:
+        for attempt in range(self.max_retries + 1):
+            self.stats['rate_wait_seconds'] += self.bucket.acquire()
+            self.stats['calls'] += 1
+            try:
+                return call()
+            except Exception as e:
+                if attempt == self.max_retries or not is_retryable(e):
+                    raise
+                self.stats['retries'] += 1
+                delay = backoff_delay(attempt)
+                self.bucket.pause(delay)
+                time.sleep(delay)
+
+
+_clients: Dict = {}
+_clients_lock = threading.Lock()
+
+
+def generative_model(name: str, api_key: Optional[str] = None):
+    """Pooled google.generativeai model; google.generativeai is imported (and configured with
+    api_key, if given) when the first one is created, not when the app starts"""
+    with _clients_lock:
+        if ('genai', name) not in _clients:
+            genai = load('genai')
+            if api_key is not None:
+                genai.configure(api_key=api_key)
+            _clients[('genai', name)] = genai.GenerativeModel(name)
+        return _clients[('genai', name)]
+
+
+def chat_model(name: str, api_key: str):
+    """Pooled LangChain ChatGoogleGenerativeAI for app.py"""
+    with _clients_lock:
+        if ('langchain', name, api_key) not in _clients:
+            chat_models = load('langchain_google_genai')
+            _clients[('langchain', name, api_key)] = chat_models.ChatGoogleGenerativeAI(
+                model=name, google_api_key=api_key, temperature=0)
+        return _clients[('langchain', name, api_key)]
+
+
+_shared_scheduler = None
+_shared_lock = threading.Lock()
+
+
+def get_scheduler() -> GeminiScheduler:
+    """Process-wide scheduler (one quota, shared by every session and app thread)"""
+    global _shared_scheduler
+    with _shared_lock:
+        if _shared_scheduler is None:
+            _shared_scheduler = GeminiScheduler()
+        return _shared_scheduler
@@ -0,0 +1,240 @@
+"""Durable, indexed history of bill split calculations.
+
+Calculations used to live in ``st.session_state`` lists and vanished with the
+session. They are now appended to a SQLite file: one ``calculations`` row per
+saved calculation and one ``split_lines`` row per bill and apartment, indexed
+by billing period, bill type and apartment so that questions like "all
+electricity splits for 2025" are a range scan instead of a loop over every
+calculation. Rows are only ever inserted.
+
+Periods are ``YYYY-MM`` strings, so they sort and range-compare as text.
+
+``period_totals`` is a summary index (totals per period, bill type and
+apartment), updated in the same transaction as every append, so per-period
+summaries never scan the lines. Listings are paginated in SQL; only the
+requested page of calculations is ever loaded.
+"""
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_HISTORY_PATH = os.environ.get("HISTORY_DB_PATH", os.path.join("data", "history.sqlite3"))
+APARTMENTS = ('apt1', 'apt2')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS calculations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    period TEXT NOT NULL,
+    source TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS split_lines (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    calculation_id INTEGER NOT NULL REFERENCES calculations (id),
+    period TEXT NOT NULL,
+    bill_type TEXT NOT NULL,
+    label TEXT,
+    apartment TEXT NOT NULL,
+    fixed REAL NOT NULL DEFAULT 0,
+    consumption REAL NOT NULL DEFAULT 0,
+    amount REAL NOT NULL,
+    bill_total REAL
+);
+CREATE TABLE IF NOT EXISTS period_totals (
+    period TEXT NOT NULL,
+    bill_type TEXT NOT NULL,
+    apartment TEXT NOT NULL,
+    amount REAL NOT NULL,
+    lines INTEGER NOT NULL,
+    PRIMARY KEY (period, bill_type, apartment)
+);
+CREATE INDEX IF NOT EXISTS calculations_period ON calculations (period, id);
+CREATE INDEX IF NOT EXISTS split_lines_period ON split_lines (period, bill_type);
+CREATE INDEX IF NOT EXISTS split_lines_bill_type ON split_lines (bill_type, period);
+CREATE INDEX IF NOT EXISTS split_lines_apartment ON split_lines (apartment, period);
+CREATE INDEX IF NOT EXISTS split_lines_calculation ON split_lines (calculation_id);
+"""
+
+
+def current_period() -> str:
+    return datetime.now().strftime('%Y-%m')
+
+
+def year_range(year: int) -> Tuple[str, str]:
+    """(period_from, period_to) covering a calendar year"""
+    return f"{year:04d}-01", f"{year:04d}-12"
+
+
+class HistoryStore:
+    """Append-only SQLite store of split calculations"""
+
+    def __init__(self, path: str = DEFAULT_HISTORY_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._backfill_period_totals()
+        self._conn.commit()
+
+    def _backfill_period_totals(self) -> None:
+        """Build the summary index for a store created before it existed"""
+        has_totals = self._conn.execute("SELECT 1 FROM period_totals LIMIT 1").fetchone()
+        has_lines = self._conn.execute("SELECT 1 FROM split_lines LIMIT 1").fetchone()
+        if has_lines and not has_totals:
+            self._conn.execute(
+                "INSERT INTO period_totals (period, bill_type, apartment, amount, lines)"
+                " SELECT period, bill_type, apartment, SUM(amount), COUNT(*) FROM split_lines"
+                " GROUP BY period, bill_type, apartment"
+            )
+
+    def append_calculation(self, results: Dict[str, Dict], period: Optional[str] = None,
+                           source: str = 'app', labels: Optional[Dict[str, str]] = None) -> int:
+        """Store one calculation; results maps bill type to a BillCalculator.calculate_split result"""
+        period = period or current_period()
+        labels = labels or {}
+        lines = []
+        for bill_type, split in results.items():
+            for apartment in APARTMENTS:
+                part = split[apartment]
+                lines.append((period, bill_type, labels.get(bill_type), apartment,
+                              part.get('fixed') or 0, part.get('consumption') or 0, part['total'], split.get('total')))
+        with self._lock:
+            with self._conn:
+                cursor = self._conn.execute(
+                    "INSERT INTO calculations (created_at, period, source) VALUES (?, ?, ?)",
+                    (time.time(), period, source),
+                )
+                calculation_id = cursor.lastrowid
+                self._conn.executemany(
+                    "INSERT INTO split_lines (calculation_id, period, bill_type, label, apartment,"
+                    " fixed, consumption, amount, bill_total) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(calculation_id,) + line for line in lines],
+                )
+                self._conn.executemany(
+                    "INSERT INTO period_totals (period, bill_type, apartment, amount, lines) VALUES (?, ?, ?, ?, 1)"
+                    " ON CONFLICT (period, bill_type, apartment)"
+                    " DO UPDATE SET amount = amount + excluded.amount, lines = lines + 1",
+                    [(period, bill_type, apartment, amount) for period, bill_type, _, apartment, _, _, amount, _ in lines],
+                )
+        return calculation_id
+
+    def append_split(self, bill_type: str, apt1_total: float, apt2_total: float, label: Optional[str] = None,
+                     period: Optional[str] = None, source: str = 'app') -> int:
+        """Store a single bill split given only the per-apartment totals"""
+        split = {
+            'apt1': {'total': apt1_total},
+            'apt2': {'total': apt2_total},
+            'total': apt1_total + apt2_total,
+        }
+        return self.append_calculation({bill_type: split}, period, source, {bill_type: label})
+
+    def query(self, bill_type: Optional[str] = None, apartment: Optional[str] = None,
+              period_from: Optional[str] = None, period_to: Optional[str] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        """Split lines matching the filters, newest period first"""
+        clauses, params = [], []
+        if bill_type:
+            clauses.append("bill_type = ?"); params.append(bill_type)
+        if apartment:
+            clauses.append("apartment = ?"); params.append(apartment)
+        if period_from:
+            clauses.append("period >= ?"); params.append(period_from)
+        if period_to:
+            clauses.append("period <= ?"); params.append(period_to)
+        sql = ("SELECT calculation_id, period, bill_type, label, apartment, fixed, consumption, amount, bill_total"
+               " FROM split_lines")
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY period DESC, calculation_id DESC, id"
+        if limit:
+            sql += " LIMIT ?"; params.append(limit)
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    @staticmethod
+    def _calculation_filter(bill_type: Optional[str], period_from: Optional[str],
+                            period_to: Optional[str]) -> Tuple[str, List]:
+        clauses, params = [], []
+        if period_from:
+            clauses.append("period >= ?"); params.append(period_from)
+        if period_to:
+            clauses.append("period <= ?"); params.append(period_to)
+        if bill_type:
+            clauses.append("EXISTS (SELECT 1 FROM split_lines l WHERE l.calculation_id = calculations.id"
+                           " AND l.bill_type = ?)")
+            params.append(bill_type)
+        return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+    def count_calculations(self, bill_type: Optional[str] = None, period_from: Optional[str] = None,
+                           period_to: Optional[str] = None) -> int:
+        where, params = self._calculation_filter(bill_type, period_from, period_to)
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM calculations" + where, params).fetchone()[0]
+
+    def page(self, page_no: int = 0, page_size: int = 20, bill_type: Optional[str] = None,
+             period_from: Optional[str] = None, period_to: Optional[str] = None) -> List[Dict]:
+        """One page of calculations (newest period first) with their lines, fetched in two queries"""
+        where, params = self._calculation_filter(bill_type, period_from, period_to)
+        with self._lock:
+            calculations = [dict(row) for row in self._conn.execute(
+                "SELECT id, created_at, period, source FROM calculations" + where +
+                " ORDER BY period DESC, id DESC LIMIT ? OFFSET ?",
+                params + [page_size, page_no * page_size]
+            )]
+            if not calculations:
+                return []
+            ids = [c['id'] for c in calculations]
+            rows = self._conn.execute(
+                "SELECT calculation_id, bill_type, label, apartment, fixed, consumption, amount, bill_total"
+                f" FROM split_lines WHERE calculation_id IN ({','.join('?' * len(ids))}) ORDER BY id", ids
+            ).fetchall()
+        by_id = {c['id']: c for c in calculations}
+        for c in calculations:
+            c['lines'] = []
+        for row in rows:
+            by_id[row['calculation_id']]['lines'].append(dict(row))
+        return calculations
+
+    def recent_calculations(self, limit: int = 20) -> List[Dict]:
+        return self.page(0, limit)
+
+    def period_summary(self, period_from: Optional[str] = None, period_to: Optional[str] = None,
+                       bill_type: Optional[str] = None) -> List[Dict]:
+        """Precomputed totals per period, bill type and apartment (from the summary index)"""
+        clauses, params = [], []
+        if period_from:
+            clauses.append("period >= ?"); params.append(period_from)
+        if period_to:
+            clauses.append("period <= ?"); params.append(period_to)
+        if bill_type:
+            clauses.append("bill_type = ?"); params.append(bill_type)
+        sql = "SELECT period, bill_type, apartment, amount, lines FROM period_totals"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY period DESC, bill_type, apartment"
+        with self._lock:
+            return [dict(row) for row in self._conn.execute(sql, params)]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM calculations").fetchone()[0]
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_history_store() -> HistoryStore:
+    """Process-wide store shared by every Streamlit session"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = HistoryStore()
+        return _shared_store
@@ -0,0 +1,141 @@
+"""Incremental JSON parsing of streamed LLM replies.
+
+The extraction calls used to wait for the whole reply and then pick the JSON
+object out with ``re.search(r'\\{.*\\}', ..., re.DOTALL)``. With the reply
+streamed, ``JSONObjectParser`` reads it chunk by chunk: every top-level field
+of the first JSON object is reported as soon as its value is complete (so
+``total_amount`` can show up in the UI while the rest is still being
+generated), and the parser is done the moment the object's closing brace
+arrives, so ``stream_json`` stops reading there and the model's trailing
+chatter is never waited for.
+"""
+import json
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+
+class JSONObjectParser:
+    """Feed text chunks; collects the first top-level JSON object, field by field"""
+
+    def __init__(self):
+        self.result: Dict[str, Any] = {}
+        self.done = False
+        self.text = ''  # the object so far, from its opening brace
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._member_start = 1
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Consume a chunk; returns the fields completed by it, in order"""
+        fields = []
+        if self.done:
+            return fields
+        if not self._started:
+            start = chunk.find('{')
+            if start < 0:
+                return fields
+            self._started = True
+            chunk = chunk[start:]
+        offset = len(self.text)
+        self.text += chunk
+        for i in range(offset, len(self.text)):
+            char = self.text[i]
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == '\\':
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char in '{[':
+                self._depth += 1
+            elif char in '}]':
+                self._depth -= 1
+                if self._depth == 0:
+                    fields.extend(self._member(i))
+                    self.text = self.text[:i + 1]
+                    self.done = True
+                    break
+            elif char == ',' and self._depth == 1:
+                fields.extend(self._member(i))
+                self._member_start = i + 1
+        return fields
+
+    def _member(self, end: int) -> List[Tuple[str, Any]]:
+        member = self.text[self._member_start:end].strip()
+        if not member:
+            return []
+        try:
+            parsed = json.loads('{' + member + '}')
+        except json.JSONDecodeError:
+            # Not valid JSON on its own (e.g. a trailing comma); json.loads of the whole object decides
+            return []
+        self.result.update(parsed)
+        return list(parsed.items())
+
+    def value(self) -> Optional[Dict[str, Any]]:
+        """The complete object, or None if the stream ended before it closed"""
+        if not self.done:
+            return None
+        return json.loads(self.text)
+
+
+def stream_json(chunks: Iterable[str], on_field: Optional[Callable[[str, Any], None]] = None) -> Tuple[Optional[Dict], str]:
+    """(object, reply text up to its closing brace) from a stream of text chunks.
+
+    Stops consuming ``chunks`` as soon as the object is complete; closing a
+    generator there also closes the model's response stream.
+    """
+    parser = JSONObjectParser()
+    received = []
+    for chunk in chunks:
+        received.append(chunk)
+        for key, value in parser.feed(chunk):
+            if on_field is not None:
+                on_field(key, value)
+        if parser.done:
+            break
+    close = getattr(chunks, 'close', None)
+    if close is not None:
+        close()
+    reply = parser.text if parser.done else ''.join(received)
+    try:
+        return parser.value(), reply
+    except json.JSONDecodeError:
+        return None, reply
+
+
+def text_chunks(stream: Iterable) -> Iterable[str]:
+    """Text of each streamed chunk, for google.generativeai (``.text``) and LangChain (``.content``) streams"""
+    try:
+        for chunk in stream:
+            try:
+                text = getattr(chunk, 'text', None)
+            except ValueError:
+                # google.generativeai raises on chunks without text parts (e.g. the final one)
+                text = None
+            if text is None:
+                text = getattr(chunk, 'content', '')
+            yield text or ''
+    finally:
+        close = getattr(stream, 'close', None)
+        if close is not None:
+            close()
+
+
+def stream_reply(model, prompt, on_field: Optional[Callable[[str, Any], None]] = None) -> str:
+    """The model's reply, streamed and cut after its JSON object.
+
+    ``model`` is a google.generativeai model (``generate_content(stream=True)``)
+    or a LangChain chat model (``stream``); ``on_field`` sees each field as
+    soon as it is complete. The returned text parses as before, so callers
+    and the LLM cache keep working on replies they already understand.
+    """
+    if hasattr(model, 'generate_content'):
+        stream = model.generate_content(prompt, stream=True)
+    else:
+        stream = model.stream(prompt)
+    return stream_json(text_chunks(stream), on_field)[1]
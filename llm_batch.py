@@ -0,0 +1,141 @@
+"""Several documents' extraction in one LLM request.
+
+Each bill used to cost one request, so a monthly run of many households was
+dominated by per-request overhead. ``BatchExtractor`` packs up to
+``max_docs`` documents (and ``max_chars`` of text) into one prompt, each
+under its own id with its own instructions, and asks for one JSON object
+keyed by those ids.
+
+Every document's JSON is validated on its own. A document whose entry is
+missing or invalid is retried alone (``single``); a reply that cannot be
+parsed at all is split in half and each half retried, down to single
+documents, so one bad document never costs the others their answer.
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+DEFAULT_MAX_DOCS = 6
+DEFAULT_MAX_CHARS = 24000
+
+BATCH_INSTRUCTIONS = """You will receive {count} documents. Each one is between <document id="..."> and </document>
+and has its own instructions. Follow each document's instructions on that document's text only.
+Respond with ONLY one valid JSON object, with one entry per document id, in this form:
+{{"documents": [{{"id": "<document id>", "data": <the JSON object that document's instructions ask for>}}]}}"""
+
+DOCUMENT_TEMPLATE = """<document id="{id}">
+Instructions: {prompt}
+Text:
+---
+{text}
+---
+</document>"""
+
+
+class BatchDocument:
+    """One document to extract: caller's key, its own prompt, its text and a validator for its JSON"""
+
+    def __init__(self, key: Any, prompt: str, text: str, validate: Callable[[Any], bool]):
+        self.key = key
+        self.prompt = prompt.strip()
+        self.text = text
+        self.validate = validate
+        self.id = None
+
+
+def numeric_fields(*keys: str) -> Callable[[Any], bool]:
+    """Validator: a JSON object whose given keys (or, with no keys, all of its values) are numbers"""
+    def validate(data: Any) -> bool:
+        if not isinstance(data, dict) or not data:
+            return False
+        try:
+            for key in keys or data:
+                float(data[key])
+        except (KeyError, TypeError, ValueError):
+            return False
+        return True
+    return validate
+
+
+def build_batch_prompt(docs: Sequence[BatchDocument]) -> str:
+    parts = [BATCH_INSTRUCTIONS.format(count=len(docs))]
+    parts.extend(DOCUMENT_TEMPLATE.format(id=doc.id, prompt=doc.prompt, text=doc.text) for doc in docs)
+    return "\n\n".join(parts)
+
+
+def parse_batch_reply(reply: str) -> Dict[str, Any]:
+    """{id: data} from a batch reply; raises ValueError if there is no usable JSON in it"""
+    match = re.search(r'\{.*\}', reply, re.DOTALL)
+    if not match:
+        raise ValueError("no JSON object in the batch reply")
+    parsed = json.loads(match.group(0))
+    entries = parsed.get('documents') if isinstance(parsed, dict) else None
+    if isinstance(entries, list):
+        return {str(e['id']): e.get('data') for e in entries if isinstance(e, dict) and 'id' in e}
+    if isinstance(parsed, dict):
+        # Models sometimes answer {id: data} directly
+        return {str(k): v for k, v in parsed.items()}
+    raise ValueError("batch reply is not a JSON object")
+
+
+def pack(docs: Sequence[BatchDocument], max_docs: int, max_chars: int) -> List[List[BatchDocument]]:
+    """Consecutive groups of at most max_docs documents and about max_chars of text"""
+    groups, group, chars = [], [], 0
+    for doc in docs:
+        size = len(doc.text) + len(doc.prompt)
+        if group and (len(group) >= max_docs or chars + size > max_chars):
+            groups.append(group)
+            group, chars = [], 0
+        group.append(doc)
+        chars += size
+    if group:
+        groups.append(group)
+    return groups
+
+
+class BatchExtractor:
+    """Runs documents through ask() in batches; single() is the per-document fallback"""
+
+    def __init__(self, ask: Callable[[str], str], single: Optional[Callable[[BatchDocument], Any]] = None,
+                 max_docs: int = DEFAULT_MAX_DOCS, max_chars: int = DEFAULT_MAX_CHARS):
+        self.ask = ask
+        self.single = single
+        self.max_docs = max_docs
+        self.max_chars = max_chars
+        self.stats = {'documents': 0, 'batch_requests': 0, 'batched': 0, 'split': 0, 'alone': 0}
+
+    def run(self, docs: Sequence[BatchDocument]) -> Dict[Any, Any]:
+        """{doc.key: validated data, or single(doc), or None}"""
+        for i, doc in enumerate(docs):
+            doc.id = f"doc{i + 1}"
+        self.stats['documents'] += len(docs)
+        results = {}
+        for group in pack(docs, self.max_docs, self.max_chars):
+            self._run_group(group, results)
+        return results
+
+    def _run_group(self, group: List[BatchDocument], results: Dict) -> None:
+        if len(group) == 1:
+            self._alone(group[0], results)
+            return
+        self.stats['batch_requests'] += 1
+        try:
+            parsed = parse_batch_reply(self.ask(build_batch_prompt(group)))
+        except ValueError:
+            # json.JSONDecodeError is a ValueError too: nothing usable, halve and retry
+            self.stats['split'] += 1
+            middle = len(group) // 2
+            self._run_group(group[:middle], results)
+            self._run_group(group[middle:], results)
+            return
+        for doc in group:
+            data = parsed.get(doc.id)
+            if doc.validate(data):
+                self.stats['batched'] += 1
+                results[doc.key] = data
+            else:
+                self._alone(doc, results)
+
+    def _alone(self, doc: BatchDocument, results: Dict) -> None:
+        self.stats['alone'] += 1
+        results[doc.key] = self.single(doc) if self.single is not None else None
@@ -0,0 +1,226 @@
+"""Persistent cache for LLM extraction replies.
+
+The same OCR text goes to Gemini with the same prompt on every Streamlit rerun
+and every retry, and each call costs seconds and quota. Replies are stored in
+SQLite keyed by a hash of the model name, the prompt template version and the
+normalized document text, with a TTL and size-bounded LRU eviction.
+
+``StandInModel`` answers like a Gemini model without the network so the
+extraction code path, and the cache around it, can run offline
+(``LLM_STANDIN=1``).
+"""
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, Optional, Union
+
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", os.path.join("data", "llm_cache.sqlite3"))
+DEFAULT_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", 16 * 1024 * 1024))
+DEFAULT_TTL = float(os.environ.get("LLM_CACHE_TTL", 30 * 24 * 3600))
+
+RE_WHITESPACE = re.compile(r'\s+')
+RE_JSON_EXAMPLE = re.compile(r'\{[^{}]*\}')
+STANDIN_CHUNK_CHARS = 12
+
+
+def normalize_text(text: str) -> str:
+    """OCR output differs run to run only in whitespace; that must not miss the cache"""
+    return RE_WHITESPACE.sub(' ', text).strip()
+
+
+def prompt_version(prompt: str) -> str:
+    """Version of a prompt template: editing the prompt invalidates its entries"""
+    return hashlib.sha256(normalize_text(prompt).encode("utf-8")).hexdigest()[:16]
+
+
+def make_key(model: str, prompt: str, document: Union[str, bytes], version: Optional[str] = None) -> str:
+    """Build the cache key; document is OCR text, or the raw file for multimodal prompts"""
+    if isinstance(document, str):
+        document = normalize_text(document).encode("utf-8")
+    digest = hashlib.sha256(document).hexdigest()
+    return f"{model}:{version or prompt_version(prompt)}:{digest}"
+
+
+class LLMCache:
+    """Persistent LLM reply cache with TTL, LRU eviction and hit/miss counters"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES,
+                 ttl: float = DEFAULT_TTL):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_replies ("
+            " key TEXT PRIMARY KEY,"
+            " reply TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " created REAL NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_replies_lru ON llm_replies (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached reply for key, or None on a miss or an expired entry"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT reply, created FROM llm_replies WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[1] > self.ttl:
+                self._conn.execute("DELETE FROM llm_replies WHERE key = ?", (key,))
+                self._conn.commit()
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE llm_replies SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, reply: str) -> None:
+        """Store reply under key and evict least recently used entries over the size limit"""
+        size = len(reply.encode("utf-8"))
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO llm_replies (key, reply, size, created, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, reply, size, now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM llm_replies WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM llm_replies").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM llm_replies ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM llm_replies WHERE key = ?", victims)
+
+    def get_or_compute(self, model: str, prompt: str, document: Union[str, bytes],
+                       compute: Callable[[], str], parse: Callable[[str], Any] = None,
+                       version: Optional[str] = None) -> Any:
+        """Return parse(reply), calling the model with compute() only on a miss.
+
+        A fresh reply is stored only if parse accepts it (no exception, not None),
+        so a malformed answer is asked again next time instead of being served
+        from the cache.
+        """
+        parse = parse or (lambda reply: reply)
+        key = make_key(model, prompt, document, version)
+        reply = self.get(key)
+        if reply is not None:
+            result = parse(reply)
+            if result is not None:
+                return result
+        reply = compute()
+        result = parse(reply)
+        if result is not None:
+            self.put(key, reply)
+        return result
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus the current size of the cache"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_replies"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_replies")
+            self._conn.commit()
+
+
+class StandInReply:
+    def __init__(self, text: str):
+        self.text = text
+        self.content = text
+
+
+class StandInModel:
+    """Offline stand-in for a Gemini model.
+
+    Answers with the example JSON object of the prompt (every extraction prompt
+    carries one), through both the google.generativeai (``generate_content``)
+    and the LangChain (``invoke``, ``stream``) call styles, streamed or not, and
+    counts its calls.
+    """
+
+    def __init__(self, model: str = "standin"):
+        self.model = model
+        self.calls = 0
+
+    def generate_content(self, prompt, stream: bool = False):
+        self.calls += 1
+        examples = RE_JSON_EXAMPLE.findall(self._prompt_text(prompt).split('---')[0])
+        text = examples[-1] if examples else "{}"
+        if stream:
+            return self._chunks(text)
+        return StandInReply(text)
+
+    def invoke(self, messages) -> StandInReply:
+        return self.generate_content(messages)
+
+    def stream(self, messages) -> Iterator[StandInReply]:
+        """LangChain-style streaming: the reply in small chunks, then some chatter after the JSON"""
+        return self.generate_content(messages, stream=True)
+
+    @staticmethod
+    def _chunks(text: str) -> Iterator[StandInReply]:
+        for i in range(0, len(text), STANDIN_CHUNK_CHARS):
+            yield StandInReply(text[i:i + STANDIN_CHUNK_CHARS])
+        yield StandInReply("\nLet me know if you need anything else.")
+
+    @staticmethod
+    def _prompt_text(prompt) -> str:
+        if isinstance(prompt, str):
+            return prompt
+        parts = []
+        for message in prompt:
+            content = getattr(message, 'content', message)
+            if isinstance(content, str):
+                parts.append(content)
+            else:
+                parts.extend(part.get('text', '') for part in content if isinstance(part, dict))
+        return '\n'.join(parts)
+
+
+def use_standin() -> bool:
+    return os.environ.get("LLM_STANDIN", "") not in ("", "0")
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_llm_cache() -> LLMCache:
+    """Process-wide cache instance shared by every extractor"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = LLMCache()
+        return _shared_cache
@@ -0,0 +1,115 @@
+"""Tiered local text extraction for the Ollama pipeline.
+
+llava used to "OCR" every page of every PDF, even pages with a perfect text
+layer, through a new ChatOllama handle per document. Now each page takes the
+cheapest path that yields usable text (``pdf_text.is_usable_text``):
+
+1. the PDF's native text layer (PyMuPDF, milliseconds);
+2. tesseract, for pages (and images) without one, through the OCR cache;
+3. llava, only for what is still unreadable, also cached by content.
+
+Ollama handles are pooled per model and ask the server to keep the model
+loaded for ``OLLAMA_KEEP_ALIVE``, so the next document does not pay the model
+load again. The seconds spent in every stage are added up in a ``timings``
+dict ('text_layer', 'ocr', 'llava', ...) for the UI to show.
+"""
+import base64
+import io
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from backends import available, lazy
+from ocr_cache import get_cache
+from pdf_render import iter_page_jpegs
+from pdf_text import extract_pages, is_usable_text
+
+langchain_messages = lazy('langchain_messages')
+langchain_ollama = lazy('langchain_ollama')
+pytesseract = lazy('pytesseract')
+Image = lazy('PIL')
+HAVE_TESSERACT = available('pytesseract')
+
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+VISION_MODEL = os.environ.get("OLLAMA_VISION_MODEL", "llava")
+VISION_PROMPT = "Extract all text from this image."
+LANG = 'heb+eng'
+DPI = 200
+
+# What a missing or failing OCR backend raises: tesseract (TesseractNotFoundError is an OSError,
+# TesseractError a RuntimeError), PyMuPDF (RuntimeError subclasses) and PIL (OSError)
+OCR_BACKEND_ERRORS = (RuntimeError, OSError)
+
+SOURCE_LLAVA = 'llava'
+STAGE_LABELS = {'text_layer': "text layer", 'ocr': "tesseract", 'llava': "llava", 'structure': "structuring"}
+
+_models: Dict[str, 'langchain_ollama.ChatOllama'] = {}
+_models_lock = threading.Lock()
+
+
+def get_ollama_model(name: str) -> 'langchain_ollama.ChatOllama':
+    """Pooled ChatOllama for the model; the server keeps it loaded between calls"""
+    with _models_lock:
+        if name not in _models:
+            _models[name] = langchain_ollama.ChatOllama(model=name, temperature=0, keep_alive=OLLAMA_KEEP_ALIVE)
+        return _models[name]
+
+
+@contextmanager
+def timed(timings: Dict[str, float], stage: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+
+
+def format_timings(timings: Dict[str, float]) -> str:
+    return " · ".join(f"{STAGE_LABELS.get(stage, stage)} {seconds:.2f}s" for stage, seconds in timings.items())
+
+
+def llava_text(image_bytes, mime_type: str = "image/jpeg") -> str:
+    """llava's reading of one image (cached by content)"""
+    def ask_llava():
+        data_url = f"data:{mime_type};base64,{base64.b64encode(image_bytes).decode('utf-8')}"
+        message = langchain_messages.HumanMessage(content=[{"type": "text", "text": VISION_PROMPT},
+                                        {"type": "image_url", "image_url": data_url}])
+        return get_ollama_model(VISION_MODEL).invoke([message]).content
+    return get_cache().get_or_compute(image_bytes, 'ollama', VISION_MODEL, None, ask_llava)
+
+
+def pdf_text_tiered(pdf_bytes, timings: Dict[str, float],
+                    on_llava_page: Optional[Callable[[int], None]] = None) -> Tuple[str, List[Dict]]:
+    """(text, pages) with each page's 'source': 'text_layer', 'ocr', 'unreadable' or 'llava'"""
+    pages = extract_pages(pdf_bytes, lang=LANG, dpi=DPI, timings=timings)
+    unreadable = {p['page']: p for p in pages if not is_usable_text(p['text'])}
+    if unreadable:
+        with timed(timings, 'llava'):
+            for page_no, jpeg in iter_page_jpegs(pdf_bytes, DPI, sorted(unreadable)):
+                if on_llava_page is not None:
+                    on_llava_page(page_no)
+                unreadable[page_no]['text'] = llava_text(jpeg)
+                unreadable[page_no]['source'] = SOURCE_LLAVA
+    return "\n".join(p['text'] for p in pages), pages
+
+
+def tesseract_text(image_bytes, timings: Dict[str, float]) -> str:
+    """tesseract's reading of a photo or scan (cached by content); '' without tesseract"""
+    if not HAVE_TESSERACT:
+        return ""
+    with timed(timings, 'ocr'):
+        return get_cache().get_or_compute(
+            image_bytes, 'tesseract', LANG, None,
+            lambda: pytesseract.image_to_string(Image.open(io.BytesIO(image_bytes)), lang=LANG)
+        )
+
+
+def image_text_tiered(image_bytes, mime_type: str, timings: Dict[str, float]) -> Tuple[str, str]:
+    """(text, source) for a photo or scan: tesseract if it reads well, llava otherwise"""
+    text = tesseract_text(image_bytes, timings)
+    if is_usable_text(text):
+        return text, 'ocr'
+    with timed(timings, 'llava'):
+        return llava_text(image_bytes, mime_type), SOURCE_LLAVA
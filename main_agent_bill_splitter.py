@@ -1,99 +1,88 @@
 import streamlit as st
 import re
 import pandas as pd
-import io
-from PIL import Image
+from ocr_cache import get_cache
+from field_extractor import FieldExtractor
+from split_policy import get_policies
+from split_engine import from_cents, to_cents
+from meter_ocr import read_meter_cached
+from meter_store import meter_id
+from uploads import get_upload_store
+from backends import available, lazy
+from pdf_text import extract_text
 
-try:
-    import fitz  # PyMuPDF
-    HAVE_FITZ = True
-except ImportError:
-    HAVE_FITZ = False
-try:
-    from pdf2image import convert_from_bytes
-    HAVE_PDF2IMAGE = True
-except ImportError:
-    HAVE_PDF2IMAGE = False
-try:
-    import pytesseract
-    HAVE_PYTESSERACT = True
-except ImportError:
-    HAVE_PYTESSERACT = False
+# Checked without importing: PyMuPDF and tesseract load on the first PDF / photo
+HAVE_FITZ = available('fitz')
+HAVE_PAGE_OCR = HAVE_FITZ  # page_ocr renders pages with PyMuPDF
+HAVE_PYTESSERACT = available('pytesseract')
+pytesseract = lazy('pytesseract')
 
-RE_TOTAL = re.compile(r'(סה"?כ(?: לתשלום)?|סכום לתשלום|סה"כ|Amount Due|Total)\D{0,10}([\d,\.]+)', flags=re.I)
-RE_FIXED = re.compile(r'(חיוב קבוע|קבוע|Fixed[^:\d]*)\D{0,10}([\d,\.]+)', flags=re.I)
-RE_USAGE = re.compile(r'(קוט"ש|קוטש|kwh|מ"ק|מ״ק|m3)[^\d]{0,10}([\d,\.]+)', flags=re.I)
+# Total / fixed / usage, precompiled and anchored on their labels (see field_extractor.py)
+BILL_FIELDS = FieldExtractor([
+    ('total', r'(?i:(?:סה"?כ(?: לתשלום)?|סכום לתשלום|סה"כ|Amount Due|Total)\D{0,10}([\d,\.]+))',
+     ['סה', 'סכום לתשלום', 'Amount Due', 'Total']),
+    ('fixed', r'(?i:(?:חיוב קבוע|קבוע|Fixed[^:\d]*)\D{0,10}([\d,\.]+))',
+     ['חיוב קבוע', 'קבוע', 'Fixed']),
+    ('usage', r'(?i:(?:קוט"ש|קוטש|kwh|מ"ק|מ״ק|m3)[^\d]{0,10}([\d,\.]+))',
+     ['קוט"ש', 'קוטש', 'kwh', 'מ"ק', 'מ״ק', 'm3']),
+])
 
-def extract_from_pdf(pdf_bytes):
+def extract_from_pdf(pdf_bytes, ocr_workers=None):
+    """Returns (text, per-page provenance); pages without a usable text layer are OCR'd"""
     if HAVE_FITZ:
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            pages = [p.get_text("text") for p in doc]
-            text = "\n".join(pages)
+            text, pages = extract_text(pdf_bytes, lang="heb+eng", dpi=200, ocr_workers=ocr_workers)
             if len(text.strip()) > 10:
-                return text
+                return text, pages
         except Exception as e:
             pass
-    if HAVE_PDF2IMAGE and HAVE_PYTESSERACT:
+    if HAVE_PAGE_OCR and HAVE_PYTESSERACT:
         try:
-            images = convert_from_bytes(pdf_bytes)
-            return "\n".join([pytesseract.image_to_string(img, lang="heb+eng") for img in images])
+            from page_ocr import ocr_pdf_pages
+            text = get_cache().get_or_compute(
+                pdf_bytes, "tesseract", "heb+eng", 200,
+                lambda: "\n".join(ocr_pdf_pages(pdf_bytes, lang="heb+eng", dpi=200, workers=ocr_workers))
+            )
+            return text, []
         except Exception as e:
             pass
-    return ""
+    return "", []
 
-def extract_from_image(img_bytes):
+def extract_from_image(img_bytes, meter=None):
     if HAVE_PYTESSERACT:
-        img = Image.open(io.BytesIO(img_bytes)).convert("RGB")
-        result = pytesseract.image_to_string(img, lang="eng+heb")
-        matches = re.findall(r'\d+(?:\.\d+)?', result.replace(',', '.'))
-        if matches:
-            try:
-                return float(matches[0])
-            except:
-                return None
-        return None
+        # Cropped to the digit window and OCR'd as digits only (see meter_ocr.py); with a meter id,
+        # the numbers read are ranked against that meter's recorded readings
+        return read_meter_cached(img_bytes, meter)
     return None
 
 def extract_bill_data(text):
-    total = None
-    m = RE_TOTAL.search(text)
-    if m:
-        try: total = float(m.group(2).replace(',', ''))
-        except: total = None
-    fixed = 0.0
-    m = RE_FIXED.search(text)
-    if m:
-        try: fixed = float(m.group(2).replace(',', ''))
-        except: fixed = 0.0
-    usage = None
-    m = RE_USAGE.search(text)
-    if m:
-        try: usage = float(m.group(2).replace(',', ''))
-        except: usage = None
+    fields = BILL_FIELDS.extract(text)
+    total = fields['total']
+    fixed = fields['fixed'] if fields['fixed'] is not None else 0.0
+    usage = fields['usage']
     return total, fixed, usage
 
-def split_two_apts(total, fixed, total_usage, apt1_usage):
-    apt1_fixed = round(fixed / 2, 2)
-    apt2_fixed = fixed - apt1_fixed
-    apt2_usage = total_usage - apt1_usage
-    apt1_total = round(apt1_fixed + apt1_usage, 2)
-    apt2_total = round(total - apt1_total, 2)  # difference, not direct computation
+def split_two_apts(bill_type, total, fixed, total_usage, apt1_usage):
+    # Usage charge by consumption share, agorot allocated so both rows add up to the bill
+    split = get_policies().policy(bill_type).split(total, fixed or 0.0, [apt1_usage, (total_usage or 0) - apt1_usage])
     return pd.DataFrame([
-        {'דירה': 'דירה 1', 'קבוע': apt1_fixed, 'צריכה': apt1_usage, 'סה"כ': apt1_total},
-        {'דירה': 'דירה 2', 'קבוע': apt2_fixed, 'צריכה': apt2_usage, 'סה"כ': apt2_total},
+        {'דירה': 'דירה 1', 'קבוע': split['fixed'][0], 'צריכה': split['usage'][0], 'סה"כ': split['total'][0]},
+        {'דירה': 'דירה 2', 'קבוע': split['fixed'][1], 'צריכה': split['usage'][1], 'סה"כ': split['total'][1]},
     ])
 
 def split_arnona(total):
-    half = round(total / 2, 2)
+    split = get_policies().policy('arnona').split(total)
     return pd.DataFrame([
-        {'דירה': 'דירה 1', 'קבוע': half, 'צריכה': 0.0, 'סה"כ': half},
-        {'דירה': 'דירה 2', 'קבוע': half, 'צריכה': 0.0, 'סה"כ': half},
+        {'דירה': 'דירה 1', 'קבוע': split['fixed'][0], 'צריכה': 0.0, 'סה"כ': split['total'][0]},
+        {'דירה': 'דירה 2', 'קבוע': split['fixed'][1], 'צריכה': 0.0, 'סה"כ': split['total'][1]},
     ])
 
 st.set_page_config(page_title="Agent Bill Splitter", layout="wide")
 st.title("🤖 חשבונות דירות - מערכת אוטומטית")
 
+# Uploads as views of Streamlit's buffers, deduplicated by content across reruns
+uploads = get_upload_store()
+
 # ========== Step 1: Collect current meter readings ==========
 st.header("1. קריאות מונה פנימיות נוכחיות לדירה 1")
 curr_meter_elec = st.number_input("קריאת מונה חשמל נוכחית (דירה 1)", min_value=0.0, step=0.1)
@@ -101,14 +90,14 @@ curr_meter_water = st.number_input("קריאת מונה מים נוכחית (ד
 
 curr_img_elec = st.file_uploader("או העלה תמונה/צילום מונה חשמל נוכחי (דירה 1)", type=["jpg", "jpeg", "png"], key="elec_img")
 if curr_img_elec:
-    val = extract_from_image(curr_img_elec.read())
+    val = extract_from_image(uploads.add(curr_img_elec).view, meter_id('apt1', 'electricity'))
     if val is not None:
         curr_meter_elec = val
         st.success(f"זוהתה קריאת חשמל: {val}")
 
 curr_img_water = st.file_uploader("או העלה תמונה/צילום מונה מים נוכחי (דירה 1)", type=["jpg", "jpeg", "png"], key="water_img")
 if curr_img_water:
-    val = extract_from_image(curr_img_water.read())
+    val = extract_from_image(uploads.add(curr_img_water).view, meter_id('apt1', 'water'))
     if val is not None:
         curr_meter_water = val
         st.success(f"זוהתה קריאת מים: {val}")
@@ -122,11 +111,14 @@ tables, types = [], []
 for file in uploaded_bills or []:
     st.subheader(f"חשבונית: {file.name}")
     text = ""
+    pages = []
     if file.name.lower().endswith('.pdf'):
-        text = extract_from_pdf(file.read())
+        text, pages = extract_from_pdf(uploads.add(file).view)
     else:
-        text = pytesseract.image_to_string(Image.open(io.BytesIO(file.read())), lang="heb+eng") if HAVE_PYTESSERACT else ""
+        text = pytesseract.image_to_string(uploads.add(file).image(), lang="heb+eng") if HAVE_PYTESSERACT else ""
     st.expander("טקסט מזוהה").write(text)
+    if pages:
+        st.caption(" | ".join(f"עמוד {p['page']}: {p['source']}" for p in pages))
     total, fixed, usage = extract_bill_data(text)
     # Detect type
     lowtext = text.lower()
@@ -142,7 +134,7 @@ for file in uploaded_bills or []:
         prev_meter = st.number_input("הזן קריאת מונה חשמל קודמת (דירה 1) או העלה תמונה:", min_value=0.0, key=file.name+"elec_prev")
         img_meter = st.file_uploader("תמונה של מונה חשמל קודם (לא חובה)", type=["jpg", "jpeg", "png"], key=file.name+"elec_prev_img")
         if img_meter:
-            meter_prev_extr = extract_from_image(img_meter.read())
+            meter_prev_extr = extract_from_image(uploads.add(img_meter).view)
             if meter_prev_extr is not None:
                 prev_meter = meter_prev_extr
                 st.success(f"זוהתה קריאה קודמת: {meter_prev_extr}")
@@ -151,7 +143,7 @@ for file in uploaded_bills or []:
         if usage is None:
             usage = st.number_input("סך הצריכה (kWh) על פי החשבון הראשי", min_value=0.0, key=file.name+"usage")
         apt1_usage = round(curr_meter_elec - prev_meter, 2) if curr_meter_elec and prev_meter else usage / 2 if usage else 0
-        df = split_two_apts(total, fixed, usage, apt1_usage)
+        df = split_two_apts('electricity', total, fixed, usage, apt1_usage)
         st.write(df)
         tables.append(df)
     elif "מים" in lowtext or "m3" in lowtext or 'מ"ק' in lowtext or 'מ״ק' in lowtext:
@@ -159,7 +151,7 @@ for file in uploaded_bills or []:
         prev_meter = st.number_input("הזן קריאת מונה מים קודמת (דירה 1) או העלה תמונה:", min_value=0.0, key=file.name+"water_prev")
         img_meter = st.file_uploader("תמונה של מונה מים קודם (לא חובה)", type=["jpg", "jpeg", "png"], key=file.name+"water_prev_img")
         if img_meter:
-            meter_prev_extr = extract_from_image(img_meter.read())
+            meter_prev_extr = extract_from_image(uploads.add(img_meter).view)
             if meter_prev_extr is not None:
                 prev_meter = meter_prev_extr
                 st.success(f"זוהתה קריאה קודמת: {meter_prev_extr}")
@@ -168,7 +160,7 @@ for file in uploaded_bills or []:
         if usage is None:
             usage = st.number_input("סך הצריכה (m3) על פי החשבון", min_value=0.0, key=file.name+"water_usage")
         apt1_usage = round(curr_meter_water - prev_meter, 2) if curr_meter_water and prev_meter else usage / 2 if usage else 0
-        df = split_two_apts(total, fixed, usage, apt1_usage)
+        df = split_two_apts('water', total, fixed, usage, apt1_usage)
         st.write(df)
         tables.append(df)
     else:
@@ -177,9 +169,10 @@ for file in uploaded_bills or []:
 # ========== Step 4: Grand Total ==========
 if tables:
     st.header("סיכום כולל:")
-    sum1 = sum(float(t.loc[t["דירה"] == "דירה 1", 'סה"כ'].iloc[0]) for t in tables)
-    sum2 = sum(float(t.loc[t["דירה"] == "דירה 2", 'סה"כ'].iloc[0]) for t in tables)
+    # Summed in agorot, so the grand total is exactly the sum of the bills
+    sum1 = from_cents(to_cents([t.loc[t["דירה"] == "דירה 1", 'סה"כ'].iloc[0] for t in tables]).sum())
+    sum2 = from_cents(to_cents([t.loc[t["דירה"] == "דירה 2", 'סה"כ'].iloc[0] for t in tables]).sum())
     st.table(pd.DataFrame([
-        {"דירה": "דירה 1", "סה\"כ לתשלום כולל": round(sum1, 2)},
-        {"דירה": "דירה 2", "סה\"כ לתשלום כולל": round(sum2, 2)}
+        {"דירה": "דירה 1", "סה\"כ לתשלום כולל": sum1},
+        {"דירה": "דירה 2", "סה\"כ לתשלום כולל": sum2}
     ]))
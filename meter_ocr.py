@@ -0,0 +1,176 @@
+"""Meter photo preprocessing and digits-only OCR.
+
+Phone photos of meters are ~12MP and were OCR'd whole with ``heb+eng``,
+which is slow and buries the reading in noise. Here a photo is:
+
+1. downsampled while decoding (JPEG draft mode), to ``MAX_SIDE`` pixels;
+2. searched for the digit wheel / LCD: the horizontal band with the densest
+   strong edges, narrowed to its busiest column run;
+3. cropped to that region, upscaled a little and binarized (Otsu), dark
+   digits on a light background;
+4. OCR'd as a single line of digits (``--psm 7`` with a numeric whitelist).
+
+OCR output is tesseract's TSV (``image_to_data``), so every word keeps its
+confidence. Stages run in order: the cropped ROI, then the whole downsampled
+photo as digits, then the old full ``heb+eng`` pass. Each stage's numbers are
+ranked (``meter_ranker``: confidence, digit count, distance from the reading
+the meter's history predicts), and the stages stop at the first one whose
+best candidate scores ``CONFIDENT_SCORE``; otherwise the best candidate of
+all of them wins, with no retry by the user. Only PIL and NumPy are used.
+"""
+import io
+from typing import Callable, Dict, Optional, Tuple
+
+import numpy as np
+
+from backends import lazy
+from meter_ranker import expected_reading, rank
+
+# PIL and tesseract load with the first photo, not with the app
+Image = lazy('PIL')
+ImageOps = lazy('PIL_ops')
+pytesseract = lazy('pytesseract')
+
+MAX_SIDE = 1200
+ROI_OCR_HEIGHT = 96  # digits are OCR'd best around 30-60px tall
+ROI_MARGIN = 0.15
+EDGE_PERCENTILE = 90
+STRONG_EDGE_FRACTION = 0.25  # of the 99.9th percentile edge; keeps sensor noise and paper texture out
+MIN_BAND_CONTRAST = 1.5  # band edge density vs. the photo's average; below that there is no ROI
+DIGITS_CONFIG = '--psm 7 -c tessedit_char_whitelist=0123456789.'
+PAGE_DIGITS_CONFIG = '--psm 6 -c tessedit_char_whitelist=0123456789.'
+CONFIDENT_SCORE = 0.6  # e.g. a 5-digit read at 75% confidence, where history expects it
+
+
+def load_downsampled(image_bytes: bytes, max_side: int = MAX_SIDE) -> 'Image.Image':
+    """Decode at reduced size (JPEG scales in the DCT, so a 12MP photo never decodes fully)"""
+    image = Image.open(io.BytesIO(image_bytes))
+    image.draft('L', (max_side, max_side))
+    image = ImageOps.exif_transpose(image).convert('L')
+    image.thumbnail((max_side, max_side))
+    return image
+
+
+def _longest_run(mask: np.ndarray) -> Tuple[int, int]:
+    """(start, end) of the longest run of True values"""
+    best, start = (0, 0), None
+    for i, value in enumerate(np.append(mask, False)):
+        if value and start is None:
+            start = i
+        elif not value and start is not None:
+            if i - start > best[1] - best[0]:
+                best = (start, i)
+            start = None
+    return best
+
+
+def find_digit_roi(gray: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """(left, top, right, bottom) of the digit window, or None if nothing stands out"""
+    g = gray.astype(np.float32)
+    edges = np.zeros_like(g)
+    edges[:, 1:] += np.abs(np.diff(g, axis=1))
+    edges[1:, :] += np.abs(np.diff(g, axis=0))
+    threshold = max(np.percentile(edges, EDGE_PERCENTILE), STRONG_EDGE_FRACTION * np.percentile(edges, 99.9))
+    strong = edges > threshold
+    height, width = strong.shape
+
+    # Densest horizontal band about one digit row high
+    band = max(8, height // 10)
+    rows = strong.mean(axis=1)
+    window = np.convolve(rows, np.ones(band) / band, mode='valid')
+    top = int(window.argmax())
+    if window[top] < MIN_BAND_CONTRAST * rows.mean():
+        return None
+    bottom = top + band
+
+    # Within the band, the longest run of busy columns
+    cols = strong[top:bottom].mean(axis=0)
+    smooth = np.convolve(cols, np.ones(max(3, width // 50)) / max(3, width // 50), mode='same')
+    left, right = _longest_run(smooth > smooth.mean())
+    if right - left < width // 10:
+        return None
+
+    dy, dx = int(band * ROI_MARGIN), int((right - left) * ROI_MARGIN)
+    return max(0, left - dx), max(0, top - dy), min(width, right + dx), min(height, bottom + dy)
+
+
+def binarize(image: 'Image.Image') -> 'Image.Image':
+    """Otsu threshold; dark digits on white regardless of how the meter displays them"""
+    gray = np.asarray(image, dtype=np.uint8)
+    hist = np.bincount(gray.ravel(), minlength=256).astype(np.float64)
+    total = hist.sum()
+    cum = np.cumsum(hist)
+    cum_mean = np.cumsum(hist * np.arange(256))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        between = (cum_mean[-1] * cum / total - cum_mean) ** 2 / (cum * (total - cum))
+    threshold = int(np.nanargmax(between))
+    binary = gray > threshold
+    # Most of a digit window is background; make the background white
+    if binary.mean() < 0.5:
+        binary = ~binary
+    return Image.fromarray((binary * 255).astype(np.uint8))
+
+
+def roi_image(image: 'Image.Image') -> Optional['Image.Image']:
+    """Cropped, rescaled and binarized digit window, or None"""
+    box = find_digit_roi(np.asarray(image))
+    if box is None:
+        return None
+    crop = image.crop(box)
+    scale = ROI_OCR_HEIGHT / max(1, crop.height)
+    crop = crop.resize((max(1, int(crop.width * scale)), ROI_OCR_HEIGHT), Image.LANCZOS)
+    return binarize(crop)
+
+
+def read_meter(image_bytes: bytes, ocr: Optional[Callable] = None, expected: Optional[Dict[str, float]] = None,
+               stage_text: Optional[Callable[[str, Callable[[], str]], str]] = None) -> Tuple[Optional[float], str, str]:
+    """(reading, ocr text of the stages run, stage) for a meter photo; stage is 'roi', 'digits', 'full' or 'none'
+
+    stage_text(stage, compute) returns a stage's OCR text; read_meter_cached passes one that caches it.
+    """
+    if ocr is None:
+        ocr = pytesseract.image_to_data
+    if stage_text is None:
+        stage_text = lambda stage, compute: compute()
+    decoded = []
+
+    def image():
+        # Decoded only when a stage actually has to run OCR
+        if not decoded:
+            decoded.append(load_downsampled(image_bytes))
+        return decoded[0]
+
+    stages = (
+        ('roi', lambda: roi_image(image()), {'lang': 'eng', 'config': DIGITS_CONFIG}),
+        ('digits', lambda: binarize(image()), {'lang': 'eng', 'config': PAGE_DIGITS_CONFIG}),
+        ('full', image, {'lang': 'heb+eng'}),
+    )
+    texts, best, best_stage = [], None, 'none'
+    for stage, stage_image, kwargs in stages:
+        def run(stage_image=stage_image, kwargs=kwargs):
+            stage_image = stage_image()
+            return '' if stage_image is None else ocr(stage_image, **kwargs)
+        text = stage_text(stage, run)
+        if not text:
+            continue
+        texts.append(text)
+        ranked = rank(text, expected)
+        if ranked and (best is None or ranked[0].score > best.score):
+            best, best_stage = ranked[0], stage
+        if best is not None and best.score >= CONFIDENT_SCORE:
+            break
+    return (best.value if best else None), '\n'.join(texts), best_stage
+
+
+def read_meter_cached(image_bytes: bytes, meter: Optional[str] = None) -> Optional[float]:
+    """read_meter through the OCR cache: a photo seen before costs no OCR at all.
+
+    With a meter id (meter_store.meter_id), candidates are ranked against that meter's history. Each
+    stage's text is cached on its own: which stages run depends on that history, so a later lookup
+    that needs a stage the first one skipped runs just that stage.
+    """
+    from ocr_cache import get_cache
+    cache = get_cache()
+    stage_text = lambda stage, compute: cache.get_or_compute(image_bytes, 'tesseract-meter', f'{stage}-tsv',
+                                                             MAX_SIDE, compute)
+    return read_meter(image_bytes, expected=expected_reading(meter), stage_text=stage_text)[0]
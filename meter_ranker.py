@@ -0,0 +1,161 @@
+"""Ranking of the numbers in a meter photo's OCR output.
+
+Each app used to take one number from the meter's OCR text and hope:
+``parse_meter_reading`` took the first one between 1000 and 999999, the
+universal splitter the largest, main_agent ``matches[0]``. A serial number,
+a date or a split digit group meant a wrong reading, noticed (if at all)
+after the LLM had split the bill.
+
+Here every numeric token is a candidate. A candidate's score is the
+product of:
+
+- its OCR confidence (tesseract's per-word ``conf`` from ``image_to_data``
+  TSV; plain text, e.g. EasyOCR's joined output, gets
+  ``DEFAULT_CONFIDENCE``);
+- a prior on its digit count (meter dials show 4-6 integer digits);
+- how close it is to the reading expected from the meter's history
+  (``meter_store``): the latest reading plus the average daily consumption
+  times the days since. A reading that cannot follow the latest one (below
+  it, and not a plausible rollover) is kept but scored ``IMPOSSIBLE``.
+
+Adjacent digit groups on one line ("12 345") are also tried joined, at the
+lower of their confidences.
+"""
+import math
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from meter_store import MeterSeries, REPLACEMENT, get_meter_store, plausible_delta
+
+DEFAULT_CONFIDENCE = 0.5
+DIGIT_PRIOR = {3: 0.1, 4: 0.5, 5: 1.0, 6: 0.8}  # integer digits; other lengths are not readings
+JOIN_PENALTY = 0.8  # "12 345" read as 12345
+HISTORY_READINGS = 6  # recent intervals the consumption rate is estimated from
+SPREAD_FRACTION = 0.5  # of the expected consumption, as one standard deviation
+MIN_SPREAD = 5.0  # units; keeps a short gap since the last reading from being too strict
+PLAUSIBILITY_FLOOR = 0.05  # history can outvote the OCR, but not silence a confident read
+IMPOSSIBLE = 0.01
+
+NUMBER = re.compile(r'\d+(?:\.\d+)?')
+TSV_HEADER = 'level\tpage_num'
+
+
+class Candidate:
+    """One possible reading and why it scored as it did"""
+
+    __slots__ = ('value', 'text', 'confidence', 'digits', 'plausibility', 'score')
+
+    def __init__(self, value: float, text: str, confidence: float, digits: int, plausibility: float):
+        self.value = value
+        self.text = text
+        self.confidence = confidence
+        self.digits = digits
+        self.plausibility = plausibility
+        self.score = confidence * DIGIT_PRIOR[digits] * plausibility
+
+    def __repr__(self) -> str:
+        return (f"Candidate({self.value:g}, text={self.text!r}, confidence={self.confidence:.2f}, "
+                f"plausibility={self.plausibility:.2f}, score={self.score:.3f})")
+
+
+def tokens(text: str) -> List[List[Tuple[str, float]]]:
+    """[(word, confidence 0-1), ...] per line, from tesseract TSV or plain text"""
+    if not text:
+        return []
+    if TSV_HEADER not in text:
+        return [[(word, DEFAULT_CONFIDENCE) for word in line.split()] for line in text.splitlines()]
+    lines: Dict[Tuple, List[Tuple[str, float]]] = {}
+    output = 0  # several TSV outputs may be concatenated (meter_ocr's stages); each starts with its header
+    for row in text.splitlines():
+        fields = row.split('\t')
+        if fields[0] == 'level':
+            output += 1
+            continue
+        if len(fields) < 12 or not fields[11].strip():
+            continue
+        try:
+            confidence = max(0.0, float(fields[10])) / 100.0
+        except ValueError:
+            continue
+        # (output, page, block, paragraph, line): lines of different outputs are never joined
+        lines.setdefault((output,) + tuple(fields[1:5]), []).append((fields[11].strip(), confidence))
+    return list(lines.values())
+
+
+def _numbers(line: List[Tuple[str, float]]) -> List[Tuple[str, float]]:
+    """The numeric tokens of a line, with adjacent digit groups also joined"""
+    numbers = []
+    previous = None  # the previous word, if it was a whole integer
+    for word, confidence in line:
+        word = word.replace(',', '')
+        found = NUMBER.findall(word)
+        numbers.extend((number, confidence) for number in found)
+        if found != [word]:
+            previous = None
+            continue
+        if previous is not None:
+            numbers.append((previous[0] + word, min(previous[1], confidence) * JOIN_PENALTY))
+        previous = (word, confidence) if '.' not in word else None
+    return numbers
+
+
+def expectation(series: Optional[MeterSeries], at: Optional[float] = None) -> Optional[Dict[str, float]]:
+    """{'latest', 'usage', 'spread'} for a reading taken at ``at`` (now); None without history.
+
+    ``usage`` is None when the series has a single reading (no rate to extrapolate).
+    """
+    if series is None or not len(series):
+        return None
+    at = time.time() if at is None else at
+    latest = series.latest_reading()
+    usage = spread = None
+    consumed = seconds = 0.0
+    first = max(1, len(series) - HISTORY_READINGS)
+    for i in range(first, len(series)):
+        if series.kinds[i] != REPLACEMENT:
+            consumed += series.deltas[i]
+            seconds += series.taken_at[i] - series.taken_at[i - 1]
+    if seconds > 0:
+        usage = consumed / seconds * max(0.0, at - series.taken_at[-1])
+        spread = max(usage * SPREAD_FRACTION, MIN_SPREAD)
+    return {'latest': latest, 'usage': usage, 'spread': spread}
+
+
+def expected_reading(meter: Optional[str]) -> Optional[Dict[str, float]]:
+    """expectation() of a meter in the shared store (None for an unknown meter)"""
+    return expectation(get_meter_store().series(meter)) if meter else None
+
+
+def plausibility(value: float, expected: Optional[Dict[str, float]]) -> float:
+    """1 for the expected reading, falling off with distance; IMPOSSIBLE if it cannot follow the latest"""
+    if expected is None:
+        return 1.0
+    delta = plausible_delta(expected['latest'], value)
+    if delta is None:
+        return IMPOSSIBLE
+    if expected['usage'] is None:
+        return 1.0
+    z = (delta - expected['usage']) / expected['spread']
+    return max(PLAUSIBILITY_FLOOR, math.exp(-0.5 * z * z))
+
+
+def rank(text: str, expected: Optional[Dict[str, float]] = None) -> List[Candidate]:
+    """Every candidate reading in the OCR text, best first"""
+    best: Dict[float, Candidate] = {}
+    for line in tokens(text):
+        for number, confidence in _numbers(line):
+            digits = len(number.split('.')[0])  # as displayed: a dial shows its leading zeros
+            if digits not in DIGIT_PRIOR:
+                continue
+            value = float(number)
+            candidate = Candidate(value, number, confidence, digits, plausibility(value, expected))
+            if value not in best or candidate.score > best[value].score:
+                best[value] = candidate
+    return sorted(best.values(), key=lambda candidate: -candidate.score)
+
+
+def best_reading(text: str, expected: Optional[Dict[str, float]] = None) -> Optional[float]:
+    """The best-scoring reading in the OCR text, or None if it has no candidate"""
+    ranked = rank(text, expected)
+    return ranked[0].value if ranked else None
@@ -0,0 +1,284 @@
+"""Per-meter time series of readings, with consumption deltas.
+
+Previous readings lived in ``st.session_state`` (claude/app.py,
+bill.split.py) or had to be typed again for every bill (the universal
+splitters), and ``bill_splitter_state.json`` held a single number. Every
+reading is now appended to a SQLite table and mirrored in memory as one
+``MeterSeries`` per meter. The series keeps compact parallel ``array``
+columns (timestamp, reading, delta, source and kind), so the latest reading
+is the last element and a period's consumption is a bisect plus a sum.
+
+Deltas are computed when a reading is recorded:
+
+- a reading below the previous one on a 5- or 6-digit dial (the range
+  ``bill_parser.parse_meter_reading`` accepts) is an odometer rollover if
+  the wrapped delta is plausible (at most ``MAX_DELTA_FRACTION`` of the
+  dial), otherwise it is rejected as a misread;
+- a reading above the previous one by more than that share of the dial is
+  rejected as a misread too (50000 read for 5000), rather than stored and
+  making every later reading look impossible;
+- ``replace_meter`` records the old meter's final reading and the new
+  meter's starting reading; consumption never spans the swap.
+
+Other processes' appends are picked up at most ``SYNC_SECONDS`` later.
+"""
+import os
+import sqlite3
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+DEFAULT_METER_PATH = os.environ.get("METER_DB_PATH", os.path.join("data", "meters.sqlite3"))
+SYNC_SECONDS = 1.0
+ROLLOVER_DIGITS = (5, 6)  # dials wrap after 99999 / 999999
+MAX_DELTA_FRACTION = 0.1  # consumption of more than this share of the dial between two readings is a misread
+
+SOURCES = ('manual', 'ocr', 'llm', 'import')
+READING = 0
+REPLACEMENT = 1  # the new meter's first reading
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meter_readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    meter TEXT NOT NULL,
+    taken_at REAL NOT NULL,
+    reading REAL NOT NULL,
+    source TEXT NOT NULL,
+    kind INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS meter_readings_meter ON meter_readings (meter, id);
+"""
+
+
+class MeterReadingError(ValueError):
+    """A reading that cannot follow the meter's previous one"""
+
+
+def meter_id(apartment: str, bill_type: str) -> str:
+    """'apt1', 'electricity' -> 'apt1:electricity'"""
+    return f"{apartment}:{bill_type}"
+
+
+def rollover_modulus(previous: float) -> Optional[int]:
+    """10**digits of the smallest dial that can show the previous reading"""
+    for digits in ROLLOVER_DIGITS:
+        if previous < 10 ** digits:
+            return 10 ** digits
+    return None
+
+
+def reading_delta(previous: float, current: float) -> float:
+    """Consumption from previous to current on the same meter, across an odometer rollover"""
+    modulus = rollover_modulus(previous)
+    limit = None if modulus is None else modulus * MAX_DELTA_FRACTION
+    if current >= previous:
+        if limit is not None and current - previous > limit:
+            raise MeterReadingError(f"reading {current:g} is {current - previous:g} above the previous reading "
+                                    f"{previous:g}, more than a period's consumption can be")
+        return current - previous
+    if modulus is not None:
+        wrapped = modulus - previous + current
+        if wrapped <= limit:
+            return wrapped
+    raise MeterReadingError(f"reading {current:g} is below the previous reading {previous:g}")
+
+
+def plausible_delta(previous: float, current: float) -> Optional[float]:
+    """reading_delta, or None when current cannot follow previous"""
+    try:
+        return reading_delta(previous, current)
+    except MeterReadingError:
+        return None
+
+
+class MeterSeries:
+    """One meter's readings, oldest first, as parallel compact arrays"""
+
+    def __init__(self, meter: str):
+        self.meter = meter
+        self.ids = array('q')
+        self.taken_at = array('d')
+        self.readings = array('d')
+        self.deltas = array('d')  # consumption since the previous reading (0 for the first and for replacements)
+        self.sources = array('b')
+        self.kinds = array('b')
+
+    def _append(self, row_id: int, taken_at: float, reading: float, source: str, kind: int) -> float:
+        delta = 0.0
+        if self.readings and kind == READING:
+            delta = reading_delta(self.readings[-1], reading)
+        self.ids.append(row_id)
+        self.taken_at.append(taken_at)
+        self.readings.append(reading)
+        self.deltas.append(delta)
+        self.sources.append(SOURCES.index(source))
+        self.kinds.append(kind)
+        return delta
+
+    def __len__(self) -> int:
+        return len(self.readings)
+
+    def entry(self, i: int) -> Dict:
+        return {'taken_at': self.taken_at[i], 'reading': self.readings[i], 'delta': self.deltas[i],
+                'source': SOURCES[self.sources[i]], 'replacement': self.kinds[i] == REPLACEMENT}
+
+    def latest(self) -> Optional[Dict]:
+        return self.entry(-1) if self.readings else None
+
+    def latest_reading(self) -> Optional[float]:
+        return self.readings[-1] if self.readings else None
+
+    def consumption_between(self, start: float, end: float) -> float:
+        """Consumption of the readings taken in (start, end]"""
+        first = bisect_right(self.taken_at, start)
+        last = bisect_right(self.taken_at, end)
+        return sum(self.deltas[first:last])
+
+    def entries(self, limit: Optional[int] = None) -> List[Dict]:
+        """Newest first"""
+        count = len(self) if limit is None else min(limit, len(self))
+        return [self.entry(len(self) - 1 - i) for i in range(count)]
+
+
+class MeterStore:
+    """Append-only SQLite store of meter readings, served from in-memory series"""
+
+    def __init__(self, path: str = DEFAULT_METER_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._conn.commit()
+        self._series: Dict[str, MeterSeries] = {}
+        self._synced_at: Dict[str, float] = {}
+
+    def series(self, meter: str) -> MeterSeries:
+        with self._lock:
+            return self._sync(meter)
+
+    def _sync(self, meter: str, force: bool = False) -> MeterSeries:
+        """Load the rows this process has not seen yet (all of them the first time)"""
+        series = self._series.get(meter)
+        now = time.monotonic()
+        if series is not None and not force and now - self._synced_at[meter] < SYNC_SECONDS:
+            return series
+        if series is None:
+            series = self._series[meter] = MeterSeries(meter)
+        last_id = series.ids[-1] if series.ids else 0
+        rows = self._conn.execute(
+            "SELECT id, taken_at, reading, source, kind FROM meter_readings WHERE meter = ? AND id > ? ORDER BY id",
+            (meter, last_id),
+        ).fetchall()
+        for row_id, taken_at, reading, source, kind in rows:
+            try:
+                series._append(row_id, taken_at, reading, source, kind)
+            except MeterReadingError:
+                # Validated against the writer's view; if two processes raced, count no consumption rather than fail
+                series._append(row_id, taken_at, reading, source, REPLACEMENT)
+        self._synced_at[meter] = now
+        return series
+
+    def latest_reading(self, meter: str) -> Optional[float]:
+        return self.series(meter).latest_reading()
+
+    def consumption(self, meter: str, reading: float) -> Optional[float]:
+        """Consumption up to this reading: since the latest one, or, if it already is the latest, its
+        recorded delta (so a rerun after record() gives the same answer). None without an earlier
+        reading; raises MeterReadingError for an impossible one."""
+        series = self.series(meter)
+        latest = series.latest()
+        if latest is None:
+            return None
+        if reading == latest['reading']:
+            return None if len(series) == 1 or latest['replacement'] else latest['delta']
+        return reading_delta(latest['reading'], reading)
+
+    def record(self, meter: str, reading: float, source: str = 'manual', taken_at: Optional[float] = None) -> Optional[float]:
+        """Append a reading; returns the consumption since the previous one (None for the first).
+
+        The same reading as the latest one is not stored again, so recording on every rerun is harmless.
+        """
+        return self._insert([(meter, reading, READING)], source, taken_at)[0]
+
+    def record_many(self, readings: Dict[str, float], source: str = 'manual', taken_at: Optional[float] = None,
+                    replacement: bool = False) -> Dict[str, Optional[float]]:
+        """record() (or, with replacement, a new meter's first reading) for several meters at once.
+
+        Every reading is validated before any is written, and they are written in one transaction,
+        so a MeterReadingError on one leaves all the meters as they were.
+        """
+        kind = REPLACEMENT if replacement else READING
+        deltas = self._insert([(meter, reading, kind) for meter, reading in readings.items()], source, taken_at)
+        return dict(zip(readings, deltas))
+
+    def replace_meter(self, meter: str, new_reading: float = 0.0, final_reading: Optional[float] = None,
+                      source: str = 'manual', taken_at: Optional[float] = None) -> None:
+        """The meter was swapped: the old one's final reading (if known), then the new one's first reading"""
+        rows = [] if final_reading is None else [(meter, final_reading, READING)]
+        self._insert(rows + [(meter, new_reading, REPLACEMENT)], source, taken_at)
+
+    def record_period(self, meter: str, previous: float, current: float, source: str = 'manual') -> float:
+        """Record a bill period's readings; returns its consumption.
+
+        A previous reading that is not the latest recorded one (the first bill, or the user typed another)
+        starts a new segment, as after a meter replacement, so the stored delta is the one the bill used.
+        """
+        if self.latest_reading(meter) != float(previous):
+            self._insert([(meter, previous, REPLACEMENT)], 'manual', None)
+        return self.record(meter, current, source)
+
+    def _insert(self, rows: Sequence[Tuple[str, float, int]], source: str,
+                taken_at: Optional[float]) -> List[Optional[float]]:
+        """Validate every (meter, reading, kind) row, then write them in one transaction; the delta of each"""
+        if source not in SOURCES:
+            raise ValueError(f"unknown reading source {source!r}, expected one of {SOURCES}")
+        taken_at = time.time() if taken_at is None else taken_at
+        with self._lock:
+            latest: Dict[str, Optional[Tuple[float, float]]] = {}  # meter -> (reading, taken_at), pending rows included
+            pending, deltas = [], []
+            for meter, reading, kind in rows:
+                reading = float(reading)
+                if meter not in latest:
+                    series = self._sync(meter, force=True)
+                    latest[meter] = (series.readings[-1], series.taken_at[-1]) if series.readings else None
+                previous = latest[meter]
+                delta = None
+                if previous is not None:
+                    if taken_at < previous[1]:
+                        raise MeterReadingError(f"{meter}: readings must be recorded in time order")
+                    if kind == READING and reading == previous[0]:
+                        deltas.append(0.0)
+                        continue
+                    if kind == READING:
+                        delta = reading_delta(previous[0], reading)  # validate before writing
+                pending.append((meter, taken_at, reading, source, kind))
+                latest[meter] = (reading, taken_at)
+                deltas.append(delta)
+            if pending:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT INTO meter_readings (meter, taken_at, reading, source, kind) VALUES (?, ?, ?, ?, ?)",
+                        pending,
+                    )
+                # Loads the new rows, and any that another process wrote just before them, in id order
+                for meter in latest:
+                    self._sync(meter, force=True)
+        return deltas
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_meter_store() -> MeterStore:
+    """Process-wide meter store shared by every Streamlit session"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = MeterStore()
+        return _shared_store
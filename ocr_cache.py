@@ -0,0 +1,124 @@
+"""Content-addressed on-disk cache for OCR results.
+
+Streamlit re-executes the whole script on every widget change, so the same
+uploaded bytes get OCR'd again and again. Results are stored in a small SQLite
+file keyed by the SHA-256 of the file bytes plus the OCR settings, with
+size-bounded LRU eviction.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+DEFAULT_CACHE_PATH = os.environ.get("OCR_CACHE_PATH", os.path.join("data", "ocr_cache.sqlite3"))
+DEFAULT_MAX_BYTES = int(os.environ.get("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+
+def make_key(data: bytes, engine: str, lang: str, dpi: Optional[int] = None) -> str:
+    """Build the cache key from the file content and the OCR settings"""
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}:{engine}:{lang}:{dpi or 0}"
+
+
+class OCRCache:
+    """Persistent OCR text cache with LRU eviction and hit/miss counters"""
+
+    def __init__(self, path: str = DEFAULT_CACHE_PATH, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS ocr_results ("
+            " key TEXT PRIMARY KEY,"
+            " text TEXT NOT NULL,"
+            " size INTEGER NOT NULL,"
+            " last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ocr_results_lru ON ocr_results (last_access)")
+        self._conn.commit()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached text for key, or None on a miss"""
+        with self._lock:
+            row = self._conn.execute("SELECT text FROM ocr_results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE ocr_results SET last_access = ? WHERE key = ?", (time.time(), key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key: str, text: str) -> None:
+        """Store text under key and evict least recently used entries over the size limit"""
+        size = len(text.encode("utf-8"))
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO ocr_results (key, text, size, last_access) VALUES (?, ?, ?, ?)",
+                (key, text, size, time.time()),
+            )
+            self._evict()
+            self._conn.commit()
+
+    def _evict(self) -> None:
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM ocr_results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        victims = []
+        for key, size in self._conn.execute("SELECT key, size FROM ocr_results ORDER BY last_access"):
+            if total <= self.max_bytes:
+                break
+            victims.append((key,))
+            total -= size
+        self._conn.executemany("DELETE FROM ocr_results WHERE key = ?", victims)
+
+    def get_or_compute(self, data: bytes, engine: str, lang: str, dpi: Optional[int],
+                       compute: Callable[[], str]) -> str:
+        """Return cached OCR text for data, running compute() only on a miss"""
+        key = make_key(data, engine, lang, dpi)
+        text = self.get(key)
+        if text is None:
+            text = compute()
+            self.put(key, text)
+        return text
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this process plus the current size of the cache"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM ocr_results"
+            ).fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'entries': entries,
+            'bytes': size,
+        }
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM ocr_results")
+            self._conn.commit()
+
+
+_shared_cache = None
+_shared_lock = threading.Lock()
+
+
+def get_cache() -> OCRCache:
+    """Process-wide cache instance shared by every extractor"""
+    global _shared_cache
+    with _shared_lock:
+        if _shared_cache is None:
+            _shared_cache = OCRCache()
+        return _shared_cache
@@ -0,0 +1,277 @@
+"""Shared EasyOCR model server over a Unix socket.
+
+Each Streamlit process used to load its own EasyOCR reader (hundreds of MB)
+on the first user's request. This server loads the ``['he', 'en']`` reader
+once, warms it up on a synthetic image and answers every app process over a
+Unix socket. Requests from concurrent users are queued and drained by one
+inference thread, which runs what it collected through
+``batch_ocr.readtext_batch`` in one batch, so CPU inference is never
+oversubscribed and concurrent users share each detector/recognizer pass.
+
+Start it once next to the apps:
+    python ocr_server.py --socket /tmp/easyocr.sock
+
+Apps use ``OCRClient`` when the socket is there (``EASYOCR_SOCKET``) and fall
+back to an in-process reader otherwise.
+
+Wire format, both directions: 8-byte big-endian header length and payload
+length, a JSON header, then the raw payload (the image bytes on requests;
+several images back to back for ``readtext_batch``, sizes in the header).
+"""
+import argparse
+import io
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, List, Optional, Tuple
+
+from batch_ocr import readtext_batch
+
+DEFAULT_SOCKET_PATH = os.environ.get("EASYOCR_SOCKET", "/tmp/easyocr.sock")
+DEFAULT_LANGS = ['he', 'en']
+DEFAULT_MAX_BATCH = 8
+DEFAULT_BATCH_WAIT = 0.02  # seconds to wait for more requests before running a batch
+FRAME = struct.Struct('>II')
+
+
+def send_frame(sock: socket.socket, header: Dict, payload: bytes = b'') -> None:
+    data = json.dumps(header).encode('utf-8')
+    sock.sendall(FRAME.pack(len(data), len(payload)) + data + payload)
+
+
+def _recv_exact(sock: socket.socket, size: int) -> bytes:
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed mid-frame")
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock: socket.socket) -> Tuple[Dict, bytes]:
+    header_size, payload_size = FRAME.unpack(_recv_exact(sock, FRAME.size))
+    header = json.loads(_recv_exact(sock, header_size))
+    return header, _recv_exact(sock, payload_size)
+
+
+def _jsonable(results) -> List:
+    """readtext output (numpy numbers inside) as plain JSON lists"""
+    return [[[[float(x), float(y)] for x, y in bbox], text, float(conf)] for bbox, text, conf in results]
+
+
+def warmup_image() -> bytes:
+    """A small synthetic receipt-like image, enough to run every model stage once"""
+    from PIL import Image, ImageDraw
+    image = Image.new('RGB', (320, 80), 'white')
+    draw = ImageDraw.Draw(image)
+    draw.text((10, 10), "Total 1234.56", fill='black')
+    draw.text((10, 40), "kWh 08950", fill='black')
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+class OCRModelServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Owns the reader; connection threads enqueue, one inference thread batches"""
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, langs: List[str], max_batch: int = DEFAULT_MAX_BATCH,
+                 batch_wait: float = DEFAULT_BATCH_WAIT):
+        import easyocr
+        self.langs = langs
+        self.max_batch = max_batch
+        self.batch_wait = batch_wait
+        self.stats = {'requests': 0, 'batches': 0, 'errors': 0, 'busy_seconds': 0.0}
+        self._jobs = queue.Queue()
+
+        started = time.perf_counter()
+        self.reader = easyocr.Reader(langs, gpu=False)
+        self.reader.readtext(warmup_image())
+        self.stats['load_seconds'] = time.perf_counter() - started
+
+        _remove_stale_socket(socket_path)
+        super().__init__(socket_path, OCRRequestHandler)
+        threading.Thread(target=self._batch_loop, name='ocr-batcher', daemon=True).start()
+
+    def submit(self, images: List[bytes], options: Dict) -> Future:
+        """Queue images for OCR; the future resolves to one result list per image"""
+        future = Future()
+        self._jobs.put((images, options, future))
+        return future
+
+    def _batch_loop(self) -> None:
+        while True:
+            batch = [self._jobs.get()]
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._jobs.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run_batch(batch)
+
+    def _run_batch(self, batch: List) -> None:
+        started = time.perf_counter()
+        self.stats['batches'] += 1
+        self.stats['requests'] += len(batch)
+        # Requests with default options go through the model together
+        plain = [job for job in batch if not job[1]]
+        if plain:
+            try:
+                results = readtext_batch(self.reader, [image for images, _, _ in plain for image in images],
+                                         self.max_batch)
+                for images, _, future in plain:
+                    future.set_result([_jsonable(r) for r in results[:len(images)]])
+                    results = results[len(images):]
+            except Exception:
+                # One bad image must not fail the others: retry them one request at a time
+                for job in plain:
+                    self._run_job(*job)
+        for job in batch:
+            if job[1]:
+                self._run_job(*job)
+        self.stats['busy_seconds'] += time.perf_counter() - started
+
+    def _run_job(self, images: List[bytes], options: Dict, future: Future) -> None:
+        if future.done():
+            return
+        try:
+            future.set_result([_jsonable(self.reader.readtext(image, **options)) for image in images])
+        except Exception as e:
+            self.stats['errors'] += 1
+            future.set_exception(e)
+
+
+class OCRRequestHandler(socketserver.BaseRequestHandler):
+    def handle(self) -> None:
+        while True:
+            try:
+                header, payload = recv_frame(self.request)
+            except (ConnectionError, struct.error):
+                return
+            op = header.get('op')
+            if op in ('readtext', 'readtext_batch'):
+                sizes = header.get('sizes', [len(payload)])
+                images, offset = [], 0
+                for size in sizes:
+                    images.append(payload[offset:offset + size])
+                    offset += size
+                try:
+                    results = self.server.submit(images, header.get('options', {})).result()
+                    send_frame(self.request, {'ok': True, 'results': results})
+                except Exception as e:
+                    send_frame(self.request, {'ok': False, 'error': f"{type(e).__name__}: {e}"})
+            elif op == 'stats':
+                send_frame(self.request, {'ok': True, 'stats': self.server.stats, 'langs': self.server.langs})
+            else:
+                send_frame(self.request, {'ok': False, 'error': f"unknown op {op!r}"})
+
+
+def _remove_stale_socket(path: str) -> None:
+    """Remove a socket file left by a dead server; refuse to start next to a live one"""
+    if not os.path.exists(path):
+        return
+    probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        probe.connect(path)
+    except OSError:
+        os.remove(path)
+        return
+    finally:
+        probe.close()
+    raise RuntimeError(f"an OCR server is already listening on {path}")
+
+
+class OCRClient:
+    """Client for OCRModelServer; one connection per client, safe to share between threads"""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET_PATH, timeout: float = 120):
+        self.socket_path = socket_path
+        self.timeout = timeout
+        self._sock: Optional[socket.socket] = None
+        self._lock = threading.Lock()
+
+    def _request(self, header: Dict, payload: bytes = b'') -> Dict:
+        with self._lock:
+            for attempt in range(2):
+                reused = self._sock is not None
+                try:
+                    if self._sock is None:
+                        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                        self._sock.settimeout(self.timeout)
+                        self._sock.connect(self.socket_path)
+                    send_frame(self._sock, header, payload)
+                    reply, _ = recv_frame(self._sock)
+                    break
+                except BaseException as e:
+                    # A failed request (timeout, corrupt frame, stopped script) may leave its reply
+                    # unread on the socket, where the next request would take it for its own
+                    self.close()
+                    if not isinstance(e, OSError):
+                        raise
+                    # Only a kept connection the server closed (restarted since) is worth one reconnect;
+                    # a timeout or a missing socket file would just fail again
+                    if attempt or not reused or not isinstance(e, ConnectionError):
+                        raise ConnectionError(f"OCR server at {self.socket_path}: {e}") from e
+        if not reply.get('ok'):
+            raise RuntimeError(reply.get('error'))
+        return reply
+
+    def readtext(self, image: bytes, **options) -> List:
+        """Same as easyocr.Reader.readtext: [(bbox, text, confidence), ...]"""
+        results = self._request({'op': 'readtext', 'options': options}, image)['results']
+        return [tuple(r) for r in results[0]]
+
+    def readtext_batch(self, images: List[bytes], batch_size: Optional[int] = None) -> List[List]:
+        """readtext for several encoded images in one round trip; the server batches them"""
+        reply = self._request({'op': 'readtext_batch', 'sizes': [len(image) for image in images]}, b''.join(images))
+        return [[tuple(r) for r in results] for results in reply['results']]
+
+    def stats(self) -> Dict:
+        return self._request({'op': 'stats'})['stats']
+
+    def close(self) -> None:
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+def server_available(socket_path: str = DEFAULT_SOCKET_PATH) -> bool:
+    return os.path.exists(socket_path)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shared EasyOCR model server")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="Unix socket path")
+    parser.add_argument('--langs', default=','.join(DEFAULT_LANGS), help="comma separated EasyOCR languages")
+    parser.add_argument('--max-batch', type=int, default=DEFAULT_MAX_BATCH)
+    parser.add_argument('--batch-wait-ms', type=float, default=DEFAULT_BATCH_WAIT * 1000)
+    args = parser.parse_args(argv)
+
+    server = OCRModelServer(args.socket, args.langs.split(','), args.max_batch, args.batch_wait_ms / 1000)
+    print(f"EasyOCR {server.langs} loaded and warmed up in {server.stats['load_seconds']:.1f}s, "
+          f"listening on {args.socket}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+
+
+if __name__ == '__main__':
+    main()
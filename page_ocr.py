@@ -0,0 +1,52 @@
+"""Parallel page-level OCR for multi-page PDFs.
+
+Each worker process renders only the page it is about to OCR (PyMuPDF, see
+pdf_render.py), so at most `workers` rasterized pages are alive at once,
+instead of the whole document as returned by `convert_from_bytes(pdf_bytes)`.
+Results come back in page order regardless of which worker finished first.
+"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Iterable, List, Optional
+
+from backends import lazy
+from pdf_render import count_pages, iter_page_images
+
+pytesseract = lazy('pytesseract')  # imported with the first page OCR'd, in each worker
+
+# 1 keeps the old serial behaviour; set OCR_WORKERS to opt into the pool
+DEFAULT_WORKERS = int(os.environ.get("OCR_WORKERS", 1))
+
+_worker_pdf_bytes = None
+
+
+def _init_worker(pdf_bytes: bytes) -> None:
+    # The PDF is shipped once per worker instead of once per page
+    global _worker_pdf_bytes
+    _worker_pdf_bytes = pdf_bytes
+
+
+def _ocr_page(page_no: int, dpi: int, lang: str) -> str:
+    for _, image in iter_page_images(_worker_pdf_bytes, dpi, [page_no], gray=True):
+        return pytesseract.image_to_string(image, lang=lang)
+    return ""
+
+
+def ocr_pdf_pages(pdf_bytes: bytes, lang: str = "heb+eng", dpi: int = 200,
+                  workers: Optional[int] = None, pages: Optional[Iterable[int]] = None) -> List[str]:
+    """OCR the given 1-based pages (all pages by default), returning texts in page order"""
+    page_numbers = list(pages) if pages is not None else list(range(1, count_pages(pdf_bytes) + 1))
+    if not page_numbers:
+        return []
+    workers = min(workers or DEFAULT_WORKERS, len(page_numbers))
+
+    if workers <= 1:
+        # One open document, one (grayscale, tesseract binarizes anyway) page image alive at a time
+        return [pytesseract.image_to_string(image, lang=lang)
+                for _, image in iter_page_images(pdf_bytes, dpi, page_numbers, gray=True)]
+
+    # Workers get real bytes (an upload's memoryview does not pickle)
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(bytes(pdf_bytes),)) as pool:
+        # map() yields in submission order, which is page order
+        return list(pool.map(_ocr_page, page_numbers, repeat(dpi), repeat(lang)))
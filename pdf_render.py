@@ -0,0 +1,74 @@
+"""Page-at-a-time PDF rasterization with PyMuPDF.
+
+``convert_from_bytes(pdf_bytes)`` renders every page into a PIL image and
+keeps them all alive at once (~25MB per A4 page at 200 DPI), and the Ollama
+pipeline wrote each rendered page to a temp JPEG only to read it back for
+base64. Here each page is rendered with ``page.get_pixmap`` and encoded
+straight to in-memory JPEG bytes (or wrapped as a PIL image for tesseract).
+The generators render the next page only when asked for it and drop the
+pixmap before that, so peak memory is one page however long the PDF is.
+
+``pdf`` arguments are PDF bytes (or any buffer, e.g. an upload's memoryview, which
+is copied to bytes once for PyMuPDF) or a path.
+"""
+from typing import Iterable, Iterator, Optional, Tuple, Union
+
+from backends import lazy
+
+fitz = lazy('fitz')  # PyMuPDF, imported on first use
+Image = lazy('PIL')
+
+DEFAULT_DPI = 200
+JPEG_QUALITY = 85
+
+PdfSource = Union[bytes, memoryview, str]
+
+
+def open_pdf(pdf: PdfSource) -> 'fitz.Document':
+    if isinstance(pdf, str):
+        return fitz.open(pdf)
+    if not isinstance(pdf, bytes):
+        # Older PyMuPDF only opens a stream from bytes / bytearray, not from a memoryview
+        pdf = bytes(pdf)
+    return fitz.open(stream=pdf, filetype="pdf")
+
+
+def count_pages(pdf: PdfSource) -> int:
+    with open_pdf(pdf) as doc:
+        return doc.page_count
+
+
+def iter_pixmaps(pdf: PdfSource, dpi: int = DEFAULT_DPI, pages: Optional[Iterable[int]] = None,
+                 gray: bool = False) -> Iterator[Tuple[int, 'fitz.Pixmap']]:
+    """(1-based page number, pixmap) for the given pages (all by default), rendered one at a time"""
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    with open_pdf(pdf) as doc:
+        page_numbers = range(1, doc.page_count + 1) if pages is None else pages
+        for page_no in page_numbers:
+            pixmap = doc[page_no - 1].get_pixmap(dpi=dpi, colorspace=colorspace, alpha=False)
+            yield page_no, pixmap
+            del pixmap
+
+
+def iter_page_jpegs(pdf: PdfSource, dpi: int = DEFAULT_DPI, pages: Optional[Iterable[int]] = None,
+                    quality: int = JPEG_QUALITY) -> Iterator[Tuple[int, bytes]]:
+    """(page number, JPEG bytes) per page, encoded in memory"""
+    for page_no, pixmap in iter_pixmaps(pdf, dpi, pages):
+        yield page_no, pixmap.tobytes("jpeg", jpg_quality=quality)
+
+
+def iter_page_images(pdf: PdfSource, dpi: int = DEFAULT_DPI, pages: Optional[Iterable[int]] = None,
+                     gray: bool = False) -> Iterator[Tuple[int, "Image.Image"]]:
+    """(page number, PIL image) per page, for OCR engines that take PIL images"""
+    for page_no, pixmap in iter_pixmaps(pdf, dpi, pages, gray):
+        mode = "L" if gray else "RGB"
+        yield page_no, Image.frombytes(mode, (pixmap.width, pixmap.height), pixmap.samples)
+
+
+def page_jpeg(pdf: PdfSource, page_no: int = 1, dpi: int = DEFAULT_DPI,
+              quality: int = JPEG_QUALITY) -> Optional[bytes]:
+    """One page as JPEG bytes, or None if the PDF has no such page"""
+    with open_pdf(pdf) as doc:
+        if not 1 <= page_no <= doc.page_count:
+            return None
+        return doc[page_no - 1].get_pixmap(dpi=dpi, alpha=False).tobytes("jpeg", jpg_quality=quality)
@@ -0,0 +1,89 @@
+"""Text-layer-first PDF extraction.
+
+The native text layer is read with PyMuPDF for every page; only pages whose
+layer is empty or garbage (scanned pages, broken Hebrew font encodings) are
+rasterized and OCR'd. Each page reports which path it took.
+"""
+import re
+import time
+from typing import Dict, List, Optional, Tuple
+
+from backends import available
+from ocr_cache import get_cache, make_key
+from pdf_render import open_pdf
+
+HAVE_OCR = available('pytesseract')
+
+# Hebrew, ASCII printable and whitespace: what a healthy bill text layer consists of
+RE_EXPECTED_CHARS = re.compile(r'[\u0590-\u05FF\x20-\x7E\s₪]')
+MIN_TEXT_CHARS = 20
+MIN_EXPECTED_RATIO = 0.8
+
+SOURCE_TEXT_LAYER = 'text_layer'
+SOURCE_OCR = 'ocr'
+SOURCE_UNREADABLE = 'unreadable'
+
+
+def is_usable_text(text: str) -> bool:
+    """True if a page's text layer looks like real text rather than empty/garbage"""
+    stripped = text.strip()
+    if len(stripped) < MIN_TEXT_CHARS or '\ufffd' in stripped:
+        return False
+    expected = len(RE_EXPECTED_CHARS.findall(stripped))
+    return expected / len(stripped) >= MIN_EXPECTED_RATIO
+
+
+def extract_pages(pdf_bytes: bytes, lang: str = 'heb+eng', dpi: int = 200,
+                  ocr_workers: Optional[int] = None, timings: Optional[Dict[str, float]] = None) -> List[Dict]:
+    """Return [{'page', 'text', 'source', 'cached'}] for every page, OCR'ing only where needed.
+
+    If given, timings gets the seconds spent under 'text_layer' and 'ocr' added to it.
+    """
+    timings = timings if timings is not None else {}
+    started = time.perf_counter()
+    with open_pdf(pdf_bytes) as doc:
+        layer_texts = [page.get_text("text") for page in doc]
+    timings['text_layer'] = timings.get('text_layer', 0.0) + time.perf_counter() - started
+
+    pages = [
+        {'page': i + 1, 'text': text, 'source': SOURCE_TEXT_LAYER, 'cached': False}
+        for i, text in enumerate(layer_texts)
+    ]
+    need_ocr = [p for p in pages if not is_usable_text(p['text'])]
+    if not need_ocr:
+        return pages
+    if not HAVE_OCR:
+        for p in need_ocr:
+            p['source'] = SOURCE_UNREADABLE
+        return pages
+
+    started = time.perf_counter()
+    cache = get_cache()
+    missing = []
+    for p in need_ocr:
+        p['source'] = SOURCE_OCR
+        p['key'] = make_key(pdf_bytes, f"tesseract:page{p['page']}", lang, dpi)
+        cached = cache.get(p['key'])
+        if cached is None:
+            missing.append(p)
+        else:
+            p['text'], p['cached'] = cached, True
+
+    if missing:
+        from page_ocr import ocr_pdf_pages  # pytesseract, only when a page needs OCR
+        texts = ocr_pdf_pages(pdf_bytes, lang=lang, dpi=dpi, workers=ocr_workers,
+                              pages=[p['page'] for p in missing])
+        for p, text in zip(missing, texts):
+            p['text'] = text
+            cache.put(p['key'], text)
+    for p in need_ocr:
+        del p['key']
+    timings['ocr'] = timings.get('ocr', 0.0) + time.perf_counter() - started
+    return pages
+
+
+def extract_text(pdf_bytes: bytes, lang: str = 'heb+eng', dpi: int = 200,
+                 ocr_workers: Optional[int] = None) -> Tuple[str, List[Dict]]:
+    """Full document text plus per-page provenance"""
+    pages = extract_pages(pdf_bytes, lang=lang, dpi=dpi, ocr_workers=ocr_workers)
+    return "\n".join(p['text'] for p in pages), pages
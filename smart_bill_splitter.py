@@ -1,22 +1,33 @@
 # universal_bill_splitter.py
 import streamlit as st
 import pandas as pd
-import time
 import json
-import io
-from pdf2image import convert_from_bytes
-from google.api_core import exceptions
-from google.cloud import vision
-import google.generativeai as genai
+
+from backends import lazy
+from concurrent_pipeline import add_tax_result, process_all_form, provider_slot, with_script_ctx
+from gemini_scheduler import generative_model, get_scheduler
+from history_store import get_history_store
+from json_stream import stream_reply
+from llm_cache import StandInModel, get_llm_cache, make_key as make_llm_key, use_standin
+from meter_store import get_meter_store, meter_id, plausible_delta, reading_delta
+from pdf_render import page_jpeg
+from split_core import BillSummary
+from split_engine import split_priced
+from tiered_extract import get_escalation_stats, priced_bill, regex_or_llm, tax_items
+from uploads import get_upload_store
 
 # --- Configuration ---
+vision = lazy('vision')  # Google Vision / Gemini load with the first document, not with the page
 try:
     VISION_CREDENTIALS_FILE = st.secrets["VISION_CREDENTIALS_PATH"]
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
+    GEMINI_API_KEY = st.secrets["GEMINI_API_KEY"]
 except (KeyError, AttributeError):
     st.error("FATAL: Could not find API keys. Ensure .streamlit/secrets.toml is set up correctly.")
     st.stop()
 
+LLM_MODEL = 'gemini-1.5-flash'
+SOURCE_NAME = 'smart_bill_splitter'  # tags this app's rows in the shared history store
+
 # --- Page Configuration ---
 st.set_page_config(page_title="Universal Bill Splitter", layout="wide")
 st.title("🧾 Universal Bill Splitter")
@@ -24,7 +35,7 @@ st.write("Process your City Tax, Electricity, and Water bills from one place.")
 
 # --- Session State Initialization ---
 if 'processed_bills' not in st.session_state:
-    st.session_state.processed_bills = []
+    st.session_state.processed_bills = BillSummary()
     st.session_state.last_tax_result = None
     st.session_state.last_elec_result = None
     st.session_state.last_water_result = None
@@ -45,28 +56,25 @@ def reset_workflow(prefix):
 
 # --- REAL AI FUNCTIONS (OCR + LLM) ---
 def get_text_from_file(uploaded_file, credentials_path):
-    file_bytes = uploaded_file.getvalue()
+    upload = get_upload_store().add(uploaded_file)
     image_bytes_for_api = None
-    if uploaded_file.type == "application/pdf":
+    if upload.is_pdf:
         try:
             with st.spinner('Converting PDF to image...'):
-                pil_images = convert_from_bytes(file_bytes, first_page=1, last_page=1)
-                if pil_images:
-                    buffer = io.BytesIO()
-                    pil_images[0].save(buffer, format="JPEG")
-                    image_bytes_for_api = buffer.getvalue()
+                image_bytes_for_api = page_jpeg(upload.view, 1)
         except Exception as e:
-            st.error(f"Error converting PDF: {e}. Is Poppler installed correctly?")
+            st.error(f"Error converting PDF: {e}")
             return None
     else:
-        image_bytes_for_api = file_bytes
+        # The Vision request proto needs real bytes
+        image_bytes_for_api = upload.view.tobytes()
     if not image_bytes_for_api:
         st.error("Could not process the file into a usable image.")
         return None
     try:
         client = vision.ImageAnnotatorClient.from_service_account_file(credentials_path)
         image = vision.Image(content=image_bytes_for_api)
-        with st.spinner('Reading the document with Google Vision...'):
+        with st.spinner('Reading the document with Google Vision...'), provider_slot('vision'):
             response = client.text_detection(image=image)
         if response.error.message:
             st.error(f"Google Vision API Error: {response.error.message}"); return ""
@@ -74,17 +82,35 @@ def get_text_from_file(uploaded_file, credentials_path):
     except Exception as e:
         st.error(f"An error occurred with the Vision API: {e}"); return None
 
+def get_model(name):
+    """Gemini model, or the offline stand-in when LLM_STANDIN is set"""
+    return StandInModel(name) if use_standin() else generative_model(name, GEMINI_API_KEY)
+
+def parse_llm_json(reply_text):
+    return json.loads(reply_text.strip().replace("```json", "").replace("```", ""))
+
 def extract_data_with_llm(raw_text, prompt):
     if not raw_text: return None
-    try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
+    reply = {'text': "[No response from LLM]"}
+    def ask_gemini():
         full_prompt = f"{prompt}\n\nHere is the OCR text:\n---\n{raw_text}\n---"
+        live = st.empty()
+        fields = {}
+        def show(key, value):
+            fields[key] = value
+            live.caption(" · ".join(f"{k}: {v}" for k, v in fields.items()))
+        # Pooled client, rate limited and retried; identical requests in flight share one call.
+        # Streamed: fields show up as they arrive and the reply is cut after its JSON object
         with st.spinner('Understanding the document with Gemini...'):
-            response = model.generate_content(full_prompt)
-        json_text = response.text.strip().replace("```json", "").replace("```", "")
-        return json.loads(json_text)
+            reply['text'] = get_scheduler().call(make_llm_key(LLM_MODEL, prompt, raw_text), with_script_ctx(
+                lambda: stream_reply(get_model(LLM_MODEL), full_prompt, show)))
+        live.empty()
+        return reply['text']
+    try:
+        # Same OCR text + same prompt -> cached reply, no API call
+        return get_llm_cache().get_or_compute(LLM_MODEL, prompt, raw_text, ask_gemini, parse=parse_llm_json)
     except Exception as e:
-        st.error(f"An error occurred with the Gemini API: {e}"); st.error(f"LLM Response Text: {response.text}"); return None
+        st.error(f"An error occurred with the Gemini API: {e}"); st.error(f"LLM Response Text: {reply['text']}"); return None
 
 def process_meter_reading(uploaded_file):
     raw_text = get_text_from_file(uploaded_file, VISION_CREDENTIALS_FILE)
@@ -108,7 +134,8 @@ def process_electricity_bill(uploaded_file):
     Example format:
     {"fixed_cost": 31.68, "total_usage_cost": 245.79, "price_per_kwh": 0.5252, "vat": 47.17}
     """
-    return extract_data_with_llm(raw_text, prompt)
+    # The regex fields, if fixed + usage + VAT add up to the total; Gemini only otherwise (tiered_extract.py)
+    return regex_or_llm(raw_text, lambda: extract_data_with_llm(raw_text, prompt), priced_bill, 'electricity')
 
 def process_water_bill(uploaded_file):
     raw_text = get_text_from_file(uploaded_file, VISION_CREDENTIALS_FILE)
@@ -122,7 +149,7 @@ def process_water_bill(uploaded_file):
     Example format based on the bill:
     {"fixed_cost": 0.00, "total_usage_cost": 306.86, "price_per_m3": 9.30, "vat": 55.23}
     """
-    return extract_data_with_llm(raw_text, prompt)
+    return regex_or_llm(raw_text, lambda: extract_data_with_llm(raw_text, prompt), priced_bill, 'water')
 
 def process_tax_bill(uploaded_file):
     raw_text = get_text_from_file(uploaded_file, VISION_CREDENTIALS_FILE)
@@ -131,7 +158,11 @@ def process_tax_bill(uploaded_file):
     Return ONLY a valid JSON object. Example: 
     {"Arnona (Municipal Tax)": 1741.10, "Shira (City Security)": 78.20}
     """
-    return extract_data_with_llm(raw_text, prompt)
+    return regex_or_llm(raw_text, lambda: extract_data_with_llm(raw_text, prompt),
+                        tax_items, 'tax')
+
+PROCESS_ALL_PIPELINES = {'tax': process_tax_bill, 'elec_bill': process_electricity_bill, 'water_bill': process_water_bill,
+                         'elec_meter': process_meter_reading, 'water_meter': process_meter_reading}
 
 # --- Sidebar ---
 st.sidebar.title("Summary")
@@ -145,23 +176,27 @@ if st.session_state.processed_bills:
             if st.checkbox("del", key=f"del_{i}", help="Mark to remove", label_visibility="collapsed"): indices_to_remove.append(i)
     if indices_to_remove:
         if st.sidebar.button("Remove Selected", type="primary"):
-            st.session_state.processed_bills = [bill for i, bill in enumerate(st.session_state.processed_bills) if i not in indices_to_remove]
+            st.session_state.processed_bills.remove(indices_to_remove)
             st.rerun()
     st.sidebar.divider()
     st.sidebar.header("Totals by Category")
-    summary_df = pd.DataFrame(st.session_state.processed_bills)
-    summary_df['Category'] = summary_df['Bill Type'].apply(lambda x: x.split(' ')[0])
-    subtotals_df = summary_df.groupby('Category')[['Apartment 1 (₪)', 'Apartment 2 (₪)']].sum()
-    subtotals_df['Category Total (₪)'] = subtotals_df['Apartment 1 (₪)'] + subtotals_df['Apartment 2 (₪)']
-    if not subtotals_df.empty:
-        grand_total = subtotals_df.sum(); grand_total.name = "**GRAND TOTAL**"
-        subtotals_df.loc['**GRAND TOTAL**'] = grand_total
+    # Subtotals are kept up to date as bills are added / removed (split_core.BillSummary), not regrouped here
+    subtotals_df = pd.DataFrame.from_dict(st.session_state.processed_bills.subtotals(), orient='index')
     st.sidebar.dataframe(subtotals_df.style.format("{:.2f}"))
-    if st.sidebar.button("Clear All Totals"): st.session_state.processed_bills = []; st.rerun()
+    if st.sidebar.button("Clear All Totals"): st.session_state.processed_bills.clear(); st.rerun()
 else:
     st.sidebar.info("Your processed bills will be summarized here.")
+escalation = get_escalation_stats().stats()
+if escalation['documents']:
+    # Bills the regex tier answered (fixed + usage + VAT reconciled) vs. sent to Gemini, for this process
+    st.sidebar.caption(f"⚡ {get_escalation_stats().summary()}")
+    if escalation['reasons']: st.sidebar.caption("Sent to Gemini: " + ", ".join(f"{reason} ({count})" for reason, count in escalation['reasons'].items()))
 
 # --- Main Page Layout ---
+st.header("Process All Bills at Once")
+with st.container(border=True):
+    process_all_form(PROCESS_ALL_PIPELINES, SOURCE_NAME)
+st.divider()
 st.header("Split a City Tax (Arnona) Bill")
 with st.container(border=True):
     tax_file = st.file_uploader("Upload your City Tax bill", type=['pdf', 'png', 'jpg', 'jpeg'], key="tax_uploader")
@@ -169,16 +204,10 @@ with st.container(border=True):
         if tax_file:
             tax_data = process_tax_bill(tax_file)
             if tax_data:
-                df = pd.DataFrame.from_dict(tax_data, orient='index', columns=['Total Amount (₪)'])
-                df.loc['**Total Payment**'] = df.sum()
-                df['Apartment 1 (₪)'] = df['Total Amount (₪)'] / 2; df['Apartment 2 (₪)'] = df['Total Amount (₪)'] / 2
-                st.subheader("City Tax Bill Breakdown"); st.dataframe(df.style.format("{:.2f}"), use_container_width=True)
-                total_per_apt = df.loc['**Total Payment**', 'Apartment 1 (₪)']
-                result = {'Bill Type': f'City Tax ({tax_file.name})', 'Apartment 1 (₪)': total_per_apt, 'Apartment 2 (₪)': total_per_apt}
-                st.session_state.processed_bills.append(result); st.session_state.last_tax_result = result; st.rerun()
+                add_tax_result(tax_data, tax_file.name, SOURCE_NAME); st.rerun()
         else: st.error("Please upload the city tax bill first.")
     if st.session_state.last_tax_result:
-        if st.button("Add Last City Tax Again to Summary"): st.session_state.processed_bills.append(st.session_state.last_tax_result); st.rerun()
+        if st.button("Add Last City Tax Again to Summary"): st.session_state.processed_bills.add(st.session_state.last_tax_result); st.rerun()
 st.divider()
 st.header("Split an Electricity Bill")
 with st.container(border=True):
@@ -195,11 +224,11 @@ with st.container(border=True):
                 else:
                     bill_data = process_electricity_bill(bill_file)
                     meter_data = {}
-                    if manual_current_reading is not None: meter_data['current_reading_kwh'] = manual_current_reading
+                    if manual_current_reading is not None: meter_data['current_reading_kwh'], meter_data['source'] = manual_current_reading, 'manual'
                     else:
                         current_reading_from_ocr = process_meter_reading(meter_file)
                         if current_reading_from_ocr is None: bill_data = None
-                        else: meter_data['current_reading_kwh'] = current_reading_from_ocr
+                        else: meter_data['current_reading_kwh'], meter_data['source'] = current_reading_from_ocr, 'ocr'
                     if bill_data and meter_data:
                         st.session_state.elec_step = "processing"; st.session_state.elec_bill_data, st.session_state.elec_meter_reading = bill_data, meter_data
                         st.session_state.elec_bill_name = bill_file.name; st.rerun()
@@ -208,27 +237,28 @@ with st.container(border=True):
         st.json({"From Bill": st.session_state.elec_bill_data, "From Meter Photo": st.session_state.elec_meter_reading})
         input_method = st.radio("Provide **previous** reading by:", ("Typing it manually", "Uploading a photo"), horizontal=True, key="elec_radio")
         with st.form("elec_input_form"):
-            prev_reading_input = st.number_input("Previous meter reading (in kWh)?", min_value=0.0, step=0.1, format="%.2f") if input_method == "Typing it manually" else st.file_uploader("Upload photo of **previous** meter", key="elec_prev_meter_up")
+            prev_reading_input = st.number_input("Previous meter reading (in kWh)?", min_value=0.0, step=0.1, format="%.2f", value=get_meter_store().latest_reading(meter_id('apt1', 'electricity')) or 0.0) if input_method == "Typing it manually" else st.file_uploader("Upload photo of **previous** meter", key="elec_prev_meter_up")
             if st.form_submit_button("Calculate Bill Split"):
                 final_prev_reading = prev_reading_input if input_method == "Typing it manually" else (process_meter_reading(prev_reading_input) if prev_reading_input else None)
                 if final_prev_reading is None: st.error("Provide previous reading.")
-                elif final_prev_reading >= st.session_state.elec_meter_reading['current_reading_kwh']: st.error("Previous reading must be less than current.")
+                elif plausible_delta(final_prev_reading, st.session_state.elec_meter_reading['current_reading_kwh']) is None: st.error("Previous reading must be less than current (or just below a meter rollover), and the difference a plausible period's consumption.")
                 else: st.session_state.elec_previous_reading = final_prev_reading; st.session_state.elec_step = "results"; st.session_state.elec_result_saved = False; st.rerun()
     if st.session_state.elec_step == "results":
         st.subheader("Step 3: Final Electricity Bill Split")
         bill, meter, prev_reading = st.session_state.elec_bill_data, st.session_state.elec_meter_reading, st.session_state.elec_previous_reading
-        apt1_cost = (meter['current_reading_kwh'] - prev_reading) * bill['price_per_kwh']; apt2_cost, fixed_cost = bill['total_usage_cost'] - apt1_cost, bill['fixed_cost'] / 2
-        subtotal1, subtotal2 = fixed_cost + apt1_cost, fixed_cost + apt2_cost; total_sub = bill['fixed_cost'] + bill['total_usage_cost']
-        vat1, vat2 = (subtotal1 / total_sub) * bill['vat'], (subtotal2 / total_sub) * bill['vat']
-        total1, total2 = subtotal1 + vat1, subtotal2 + vat2
-        df = pd.DataFrame({"Cost Component": ["Fixed", "Usage", "VAT", "**Total**"], "Apt 1 (₪)": [fixed_cost, apt1_cost, vat1, total1], "Apt 2 (₪)": [fixed_cost, apt2_cost, vat2, total2], "Total (₪)": [bill['fixed_cost'], bill['total_usage_cost'], bill['vat'], total_sub + bill['vat']]}).set_index("Cost Component")
+        # Whole agorot; fixed, usage and VAT shares each add up exactly to the bill
+        split = split_priced(bill['fixed_cost'], bill['total_usage_cost'], [reading_delta(prev_reading, meter['current_reading_kwh'])], bill['price_per_kwh'], bill['vat'])
+        total_sub = bill['fixed_cost'] + bill['total_usage_cost']; total1, total2 = map(float, split['total'])
+        df = pd.DataFrame({"Cost Component": ["Fixed", "Usage", "VAT", "**Total**"], "Apt 1 (₪)": [split['fixed'][0], split['usage'][0], split['vat'][0], total1], "Apt 2 (₪)": [split['fixed'][1], split['usage'][1], split['vat'][1], total2], "Total (₪)": [bill['fixed_cost'], bill['total_usage_cost'], bill['vat'], total_sub + bill['vat']]}).set_index("Cost Component")
         st.dataframe(df.style.format("{:.2f}"), use_container_width=True)
         result = {'Bill Type': f'Electricity ({st.session_state.elec_bill_name})', 'Apartment 1 (₪)': total1, 'Apartment 2 (₪)': total2}
         if not st.session_state.elec_result_saved:
-            st.session_state.processed_bills.append(result); st.session_state.last_elec_result = result
+            st.session_state.processed_bills.add(result); st.session_state.last_elec_result = result
+            get_history_store().append_split('electricity', total1, total2, label=st.session_state.elec_bill_name, source=SOURCE_NAME)
+            get_meter_store().record_period(meter_id('apt1', 'electricity'), prev_reading, meter['current_reading_kwh'], meter.get('source', 'ocr'))
             st.session_state.elec_result_saved = True; st.rerun()
         col1, col2 = st.columns(2); col1.button("Process Another Electricity Bill", on_click=reset_workflow, args=('elec',), use_container_width=True, key="reset_elec")
-        if st.session_state.last_elec_result: col2.button("Add This Bill Again to Summary", on_click=lambda: (st.session_state.processed_bills.append(st.session_state.last_elec_result), st.rerun()), use_container_width=True, key="readd_elec")
+        if st.session_state.last_elec_result: col2.button("Add This Bill Again to Summary", on_click=lambda: (st.session_state.processed_bills.add(st.session_state.last_elec_result), st.rerun()), use_container_width=True, key="readd_elec")
 st.divider()
 st.header("Split a Water Bill")
 with st.container(border=True):
@@ -245,11 +275,11 @@ with st.container(border=True):
                 else:
                     bill_data = process_water_bill(bill_file)
                     meter_data = {}
-                    if manual_current_reading_water is not None: meter_data['current_reading_m3'] = manual_current_reading_water
+                    if manual_current_reading_water is not None: meter_data['current_reading_m3'], meter_data['source'] = manual_current_reading_water, 'manual'
                     else:
                         current_reading_from_ocr = process_meter_reading(meter_file_water)
                         if current_reading_from_ocr is None: bill_data = None
-                        else: meter_data['current_reading_m3'] = current_reading_from_ocr
+                        else: meter_data['current_reading_m3'], meter_data['source'] = current_reading_from_ocr, 'ocr'
                     if bill_data and meter_data:
                         st.session_state.water_step = "processing"; st.session_state.water_bill_data, st.session_state.water_meter_reading = bill_data, meter_data
                         st.session_state.water_bill_name = bill_file.name; st.rerun()
@@ -258,24 +288,25 @@ with st.container(border=True):
         st.json({"From Bill": st.session_state.water_bill_data, "From Meter Photo": st.session_state.water_meter_reading})
         input_method = st.radio("Provide **previous** reading by:", ("Typing it manually", "Uploading a photo"), horizontal=True, key="water_radio")
         with st.form("water_input_form"):
-            prev_reading_input = st.number_input("Previous meter reading (in m³)?", min_value=0.0, step=0.1, format="%.2f") if input_method == "Typing it manually" else st.file_uploader("Upload photo of **previous** meter", key="water_prev_meter_up")
+            prev_reading_input = st.number_input("Previous meter reading (in m³)?", min_value=0.0, step=0.1, format="%.2f", value=get_meter_store().latest_reading(meter_id('apt1', 'water')) or 0.0) if input_method == "Typing it manually" else st.file_uploader("Upload photo of **previous** meter", key="water_prev_meter_up")
             if st.form_submit_button("Calculate Water Bill Split"):
                 final_prev_reading = prev_reading_input if input_method == "Typing it manually" else (process_meter_reading(prev_reading_input) if prev_reading_input else None)
                 if final_prev_reading is None: st.error("Provide previous reading.")
-                elif final_prev_reading >= st.session_state.water_meter_reading['current_reading_m3']: st.error("Previous reading must be less than current.")
+                elif plausible_delta(final_prev_reading, st.session_state.water_meter_reading['current_reading_m3']) is None: st.error("Previous reading must be less than current (or just below a meter rollover), and the difference a plausible period's consumption.")
                 else: st.session_state.water_previous_reading = final_prev_reading; st.session_state.water_step = "results"; st.session_state.water_result_saved = False; st.rerun()
     if st.session_state.water_step == "results":
         st.subheader("Step 3: Final Water Bill Split")
         bill, meter, prev_reading = st.session_state.water_bill_data, st.session_state.water_meter_reading, st.session_state.water_previous_reading
-        apt1_cost = (meter['current_reading_m3'] - prev_reading) * bill['price_per_m3']; apt2_cost, fixed_cost = bill['total_usage_cost'] - apt1_cost, bill['fixed_cost'] / 2
-        subtotal1, subtotal2 = fixed_cost + apt1_cost, fixed_cost + apt2_cost; total_sub = bill['fixed_cost'] + bill['total_usage_cost']
-        vat1, vat2 = (subtotal1 / total_sub) * bill['vat'], (subtotal2 / total_sub) * bill['vat']
-        total1, total2 = subtotal1 + vat1, subtotal2 + vat2
-        df = pd.DataFrame({"Cost Component": ["Fixed", "Usage", "VAT", "**Total**"], "Apt 1 (₪)": [fixed_cost, apt1_cost, vat1, total1], "Apt 2 (₪)": [fixed_cost, apt2_cost, vat2, total2], "Total (₪)": [bill['fixed_cost'], bill['total_usage_cost'], bill['vat'], total_sub + bill['vat']]}).set_index("Cost Component")
+        # Whole agorot; fixed, usage and VAT shares each add up exactly to the bill
+        split = split_priced(bill['fixed_cost'], bill['total_usage_cost'], [reading_delta(prev_reading, meter['current_reading_m3'])], bill['price_per_m3'], bill['vat'])
+        total_sub = bill['fixed_cost'] + bill['total_usage_cost']; total1, total2 = map(float, split['total'])
+        df = pd.DataFrame({"Cost Component": ["Fixed", "Usage", "VAT", "**Total**"], "Apt 1 (₪)": [split['fixed'][0], split['usage'][0], split['vat'][0], total1], "Apt 2 (₪)": [split['fixed'][1], split['usage'][1], split['vat'][1], total2], "Total (₪)": [bill['fixed_cost'], bill['total_usage_cost'], bill['vat'], total_sub + bill['vat']]}).set_index("Cost Component")
         st.dataframe(df.style.format("{:.2f}"), use_container_width=True)
         result = {'Bill Type': f'Water ({st.session_state.water_bill_name})', 'Apartment 1 (₪)': total1, 'Apartment 2 (₪)': total2}
         if not st.session_state.water_result_saved:
-            st.session_state.processed_bills.append(result); st.session_state.last_water_result = result
+            st.session_state.processed_bills.add(result); st.session_state.last_water_result = result
+            get_history_store().append_split('water', total1, total2, label=st.session_state.water_bill_name, source=SOURCE_NAME)
+            get_meter_store().record_period(meter_id('apt1', 'water'), prev_reading, meter['current_reading_m3'], meter.get('source', 'ocr'))
             st.session_state.water_result_saved = True; st.rerun()
         col1, col2 = st.columns(2); col1.button("Process Another Water Bill", on_click=reset_workflow, args=('water',), use_container_width=True, key="reset_water")
-        if st.session_state.last_water_result: col2.button("Add This Bill Again to Summary", on_click=lambda: (st.session_state.processed_bills.append(st.session_state.last_water_result), st.rerun()), use_container_width=True, key="readd_water")
\ No newline at end of file
+        if st.session_state.last_water_result: col2.button("Add This Bill Again to Summary", on_click=lambda: (st.session_state.processed_bills.add(st.session_state.last_water_result), st.rerun()), use_container_width=True, key="readd_water")
\ No newline at end of file
@@ -0,0 +1,195 @@
+"""Pure split computation for the Streamlit apps, memoized on its inputs.
+
+bill.split.py recomputed the split, the breakdown and the CSV export on
+every interaction, and ``calculate_split`` reported bad input with
+``st.error`` from inside the calculation. ``compute_split(bill_data)`` makes
+no UI calls. It returns the per-apartment results, the summary table rows,
+the breakdown numbers, the CSV and any input warnings for the page to show.
+The result is memoized on the inputs and the policies' generation, so an
+edit to config.json is still picked up.
+
+``BillSummary`` is the apps' list of processed bills. It keeps per-category
+subtotals in agorot and updates them on add / remove, so the sidebar does
+not regroup the whole list with pandas on every rerun.
+"""
+import csv
+import io
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Dict, Iterable, List, Tuple
+
+from split_engine import from_cents, to_cents
+from split_policy import SplitPolicy, get_policies
+
+APARTMENTS = ('דירה 1', 'דירה 2')
+BILL_TOTAL = 'סה"כ לחשבון'
+TABLE_COLUMNS = ('דירה 1 (₪)', 'דירה 2 (₪)', 'סה"כ לחשבון (₪)')
+TABLE_ROWS = (('electricity', 'חשמל'), ('arnona', 'ארנונה'), ('water', 'מים'))
+GRAND_TOTAL_ROW = 'סה"כ לתשלום כולל'
+SPLIT_CACHE_SIZE = 256
+
+# Utility -> (input key prefix, unit of consumption, warning when apartment 1 used more than the bill)
+METERED = {
+    'electricity': ('elec', 'kwh', "שגיאה בחשמל: צריכת דירה 1 (קוט\"ש) גבוהה מסך הצריכה הכולל."),
+    'water': ('water', 'm3', "שגיאה במים: צריכת דירה 1 (מ\"ק) גבוהה מסך הצריכה הכולל."),
+}
+
+
+class SplitResult:
+    """Everything bill.split.py shows for one set of inputs; shared between reruns, do not mutate"""
+
+    def __init__(self, key: Tuple, results: Dict[str, Dict[str, float]], warnings: List[str],
+                 breakdown: Dict[str, Dict]):
+        self.key = key
+        self.results = results
+        self.warnings = warnings
+        self.breakdown = breakdown
+        self.rows = summary_rows(results)
+        self.csv = rows_to_csv(self.rows)
+
+
+def summary_rows(results: Dict[str, Dict[str, float]]) -> List[Tuple[str, List[str]]]:
+    """(label, [apt 1, apt 2, bill total]) per utility plus the grand total, formatted as in the table"""
+    rows = []
+    for name, label in TABLE_ROWS:
+        result = results.get(name, {})
+        rows.append((label, [f"{result.get(column, 0):.2f}" for column in APARTMENTS + (BILL_TOTAL,)]))
+    totals = [from_cents(to_cents([result.get(column, 0) for result in results.values()]).sum())
+              for column in APARTMENTS + (BILL_TOTAL,)]
+    rows.append((GRAND_TOTAL_ROW, [f"{total:.2f}" for total in totals]))
+    return rows
+
+
+def rows_to_csv(rows: List[Tuple[str, List[str]]]) -> bytes:
+    """The summary table as CSV (BOM included, so Sheets and Excel read the Hebrew)"""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    writer.writerow(('',) + TABLE_COLUMNS)
+    for label, values in rows:
+        writer.writerow([label] + values)
+    return out.getvalue().encode('utf-8-sig')
+
+
+def _split_metered(name: str, bill_data: Dict[str, float],
+                   warnings: List[str]) -> Tuple[Dict[str, float], Dict]:
+    """(summary table result, transparency breakdown), both from the one policy split"""
+    prefix, unit, warning = METERED[name]
+    total = bill_data.get(f'{prefix}_total', 0)
+    fixed = bill_data.get(f'{prefix}_fixed', 0)
+    total_units = bill_data.get(f'{prefix}_total_{unit}', 0)
+    apt1_units = bill_data.get(f'{prefix}_apt1_{unit}', 0)
+    if apt1_units > total_units:
+        warnings.append(warning)
+        apt1_units = total_units  # Cap it to avoid negative results
+    units = [apt1_units, total_units - apt1_units]
+    # Fixed by the config.json shares, consumption cost by the sub-meter
+    policy = get_policies().policy(name)
+    split = policy.split(total, fixed, units)
+    result = {APARTMENTS[0]: split['total'][0], APARTMENTS[1]: split['total'][1], BILL_TOTAL: total}
+    return result, _breakdown(policy, total, fixed, units, split)
+
+
+def _breakdown(policy: SplitPolicy, total: float, fixed: float, units: List[float], split: Dict) -> Dict:
+    """The numbers of the transparency section, taken from the split it explains (agorot-exact shares)"""
+    consumption_cost = total - fixed
+    total_units = sum(units)
+    return {
+        'total': total, 'fixed': fixed, 'consumption_cost': consumption_cost,
+        'fixed_weights': [float(weight) for weight in policy.weights],
+        # The policy splits the usage charge by the shares instead without readings, or when config.json says so
+        'by_meter': policy.usage_mode == 'meter' and any(units),
+        'unit_price': consumption_cost / total_units if total_units > 0 else 0,
+        'total_units': total_units, 'units': units,
+        'fixed_share': [float(value) for value in split['fixed']],
+        'usage_share': [float(value) for value in split['usage']],
+        'cost': [float(value) for value in split['total']],
+    }
+
+
+@lru_cache(maxsize=SPLIT_CACHE_SIZE)
+def _compute(items: Tuple[Tuple[str, float], ...], generation: int) -> SplitResult:
+    bill_data = dict(items)
+    results, warnings, breakdown = {}, [], {}
+    arnona_total = bill_data.get('arnona_total', 0)
+    if arnona_total > 0:
+        split = get_policies().policy('arnona').split(arnona_total)
+        results['arnona'] = {APARTMENTS[0]: split['total'][0], APARTMENTS[1]: split['total'][1],
+                             BILL_TOTAL: arnona_total}
+    for name, (prefix, _, _) in METERED.items():
+        if bill_data.get(f'{prefix}_total', 0) > 0:
+            results[name], breakdown[name] = _split_metered(name, bill_data, warnings)
+    return SplitResult((items, generation), results, warnings, breakdown)
+
+
+def compute_split(bill_data: Dict[str, float]) -> SplitResult:
+    """Split of bill.split.py's inputs; the same inputs (and config.json) return the same object"""
+    return _compute(tuple(sorted(bill_data.items())), get_policies().generation)
+
+
+def bill_category(bill: Dict) -> str:
+    """'Electricity (march.pdf)' -> 'Electricity'"""
+    return bill['Bill Type'].split(' ')[0]
+
+
+class BillSummary:
+    """The processed bills, with per-category subtotals (in agorot) maintained on add / remove"""
+
+    APT_COLUMNS = ('Apartment 1 (₪)', 'Apartment 2 (₪)')
+    TOTAL_COLUMN = 'Category Total (₪)'
+    GRAND_TOTAL = '**GRAND TOTAL**'
+
+    def __init__(self, bills: Iterable[Dict] = ()):
+        self.bills: List[Dict] = []
+        self._subtotals: "OrderedDict[str, List[int]]" = OrderedDict()
+        for bill in bills:
+            self.add(bill)
+
+    def add(self, bill: Dict) -> None:
+        self.bills.append(bill)
+        subtotal = self._subtotals.setdefault(bill_category(bill), [0, 0, 0])
+        self._count(subtotal, bill, 1)
+
+    def remove(self, indices: Iterable[int]) -> None:
+        """Drop the bills at these positions"""
+        indices = set(indices)
+        kept = []
+        for i, bill in enumerate(self.bills):
+            if i not in indices:
+                kept.append(bill)
+                continue
+            category = bill_category(bill)
+            self._count(self._subtotals[category], bill, -1)
+            if self._subtotals[category][2] == 0:
+                del self._subtotals[category]
+        self.bills = kept
+
+    def clear(self) -> None:
+        self.bills = []
+        self._subtotals.clear()
+
+    def _count(self, subtotal: List[int], bill: Dict, sign: int) -> None:
+        subtotal[0] += sign * int(to_cents(bill[self.APT_COLUMNS[0]]))
+        subtotal[1] += sign * int(to_cents(bill[self.APT_COLUMNS[1]]))
+        subtotal[2] += sign  # bills in the category
+
+    def subtotals(self) -> Dict[str, Dict[str, float]]:
+        """{category: {apartment columns and category total}} in shekels, sorted by category, plus the grand total"""
+        table = OrderedDict()
+        grand = [0, 0]
+        for category in sorted(self._subtotals):
+            apt1, apt2, _ = self._subtotals[category]
+            table[category] = self._row(apt1, apt2)
+            grand[0] += apt1
+            grand[1] += apt2
+        if table:
+            table[self.GRAND_TOTAL] = self._row(*grand)
+        return table
+
+    def _row(self, apt1: int, apt2: int) -> Dict[str, float]:
+        return {self.APT_COLUMNS[0]: apt1 / 100, self.APT_COLUMNS[1]: apt2 / 100, self.TOTAL_COLUMN: (apt1 + apt2) / 100}
+
+    def __iter__(self):
+        return iter(self.bills)
+
+    def __len__(self) -> int:
+        return len(self.bills)
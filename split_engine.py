@@ -0,0 +1,109 @@
+"""Vectorized split of M bills between N units.
+
+Every app used to hard-code two apartments with scalar float arithmetic. Here
+one call takes, per bill, the total, the fixed charges and VAT, plus each
+unit's sub-meter consumption and fixed-share weight, and returns the fixed,
+usage, VAT and total share of every unit of every bill as ``(M, N)`` arrays.
+
+Amounts are allocated in agorot (integer cents) with the largest remainder
+method, so the units' shares of every component add up exactly to the bill.
+"""
+from typing import Dict, Optional
+
+import numpy as np
+
+CENTS = 100
+CENT_FRACTION_DIGITS = 6
+
+
+def to_cents(amounts) -> np.ndarray:
+    """Shekels to int64 agorot, half away from zero, as Decimal(str(x)).quantize(ROUND_HALF_UP) would.
+
+    x * 100 is first rounded to CENT_FRACTION_DIGITS so float noise (1.005 * 100 =
+    100.49999999999999) can't turn a half agora into a rounding down.
+    """
+    scaled = np.round(np.asarray(amounts, dtype=np.float64) * CENTS, CENT_FRACTION_DIGITS)
+    return (np.sign(scaled) * np.floor(np.abs(scaled) + 0.5)).astype(np.int64)
+
+
+def from_cents(cents: np.ndarray) -> np.ndarray:
+    return np.asarray(cents, dtype=np.float64) / CENTS
+
+
+def allocate_cents(amounts: np.ndarray, weights: np.ndarray) -> np.ndarray:
+    """Split each amounts[i] (int cents) over weights[i, :] so every row sums exactly to it.
+
+    Floors the proportional shares, then gives the leftover cents to the units
+    with the largest fractional parts (ties to the lower unit index). Weights
+    may be negative (a credit line's share of VAT is a credit); rows whose
+    weights add up to zero are split equally.
+    """
+    amounts = np.asarray(amounts, dtype=np.int64)
+    weights = np.asarray(weights, dtype=np.float64)
+    if weights.ndim == 1:
+        weights = np.broadcast_to(weights, (amounts.shape[0], weights.shape[0]))
+    row_sums = weights.sum(axis=1, keepdims=True)
+    equal = np.full_like(weights, 1.0 / weights.shape[1])
+    nonzero = row_sums != 0
+    shares = np.where(nonzero, weights / np.where(nonzero, row_sums, 1.0), equal)
+
+    exact = amounts[:, None] * shares
+    floored = np.floor(exact)
+    cents = floored.astype(np.int64)
+    leftover = amounts - cents.sum(axis=1)
+    # Rank units by fractional part, largest first; the first `leftover` of them get one more cent
+    order = np.argsort(-(exact - floored), axis=1, kind='stable')
+    ranks = np.empty_like(order)
+    np.put_along_axis(ranks, order, np.arange(weights.shape[1])[None, :].repeat(len(amounts), axis=0), axis=1)
+    return cents + (ranks < leftover[:, None])
+
+
+def split_bills(totals, fixed, unit_usage, fixed_weights=None, vat=None) -> Dict[str, np.ndarray]:
+    """Split M bills between N units in one call.
+
+    totals: (M,) bill totals before VAT; fixed: (M,) fixed charges included in
+    the totals; unit_usage: (M, N) consumption per unit (kWh, m3; the usage
+    charge is split in proportion, equally for a bill with no consumption);
+    fixed_weights: (N,) or (M, N) shares of the fixed charges, equal by
+    default; vat: (M,) VAT on top of the totals, split in proportion to each
+    unit's signed pre-VAT share (a unit in credit gets VAT credited back).
+
+    Returns int64 agorot arrays of shape (M, N) under 'fixed', 'usage', 'vat'
+    and 'total'; every row of 'total' sums to totals + vat in agorot.
+    """
+    total_cents = to_cents(np.atleast_1d(totals))
+    fixed_cents = to_cents(np.atleast_1d(fixed))
+    usage = np.atleast_2d(np.asarray(unit_usage, dtype=np.float64))
+    units = usage.shape[1]
+    if fixed_weights is None:
+        fixed_weights = np.ones(units)
+    vat_cents = to_cents(np.zeros(len(total_cents)) if vat is None else np.atleast_1d(vat))
+
+    fixed_share = allocate_cents(fixed_cents, fixed_weights)
+    usage_share = allocate_cents(total_cents - fixed_cents, usage)
+    subtotal = fixed_share + usage_share
+    vat_share = allocate_cents(vat_cents, subtotal)
+    return {
+        'fixed': fixed_share,
+        'usage': usage_share,
+        'vat': vat_share,
+        'total': subtotal + vat_share,
+    }
+
+
+def split_bill(total: float, fixed: float, unit_usage, fixed_weights=None,
+               vat: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """split_bills for a single bill; (N,) arrays in shekels"""
+    result = split_bills([total], [fixed], [unit_usage], fixed_weights, None if vat is None else [vat])
+    return {key: from_cents(value[0]) for key, value in result.items()}
+
+
+def split_priced(fixed: float, usage_cost: float, metered_usage, price: float,
+                 vat: Optional[float] = None) -> Dict[str, np.ndarray]:
+    """The smart/universal apps' rule: the units with a sub-meter (metered_usage, N-1 of them) pay their
+    consumption at the bill's unit price and the last unit pays the rest of the usage charge; fixed
+    charges equally, VAT by pre-VAT share. (N,) arrays in shekels, like split_bill.
+    """
+    metered = np.atleast_1d(np.asarray(metered_usage, dtype=np.float64)) * price
+    weights = np.append(metered, usage_cost - metered.sum())
+    return split_bill(fixed + usage_cost, fixed, weights, None, vat)
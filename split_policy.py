@@ -0,0 +1,168 @@
+"""Split policies compiled from config.json.
+
+config.json says how each bill is shared: arnona as fixed shares, water and
+electricity as fixed shares for the fixed charges plus ``usage_split``
+("meter": by sub-meter consumption, "fixed": by the same shares). The file is
+validated and compiled once into ``SplitPolicy`` objects that hold their
+weights as NumPy arrays, so splitting a bill does no parsing or dict lookups.
+
+``get_policies()`` re-reads the file when its mtime changes (checked at most
+once per ``RELOAD_CHECK_SECONDS``), so a running Streamlit server picks up
+edits without a restart. A broken edit keeps the last good policies and
+exposes the error in ``PolicyRegistry.last_error``.
+"""
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+from split_engine import split_bill
+
+DEFAULT_CONFIG_PATH = os.environ.get(
+    "SPLIT_CONFIG_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+)
+RELOAD_CHECK_SECONDS = 1.0
+USAGE_MODES = ('meter', 'fixed')
+WEIGHT_TOLERANCE = 1e-6
+
+# Bill type names used in code -> policy names in config.json
+BILL_TYPE_ALIASES = {'tax': 'arnona'}
+
+
+class ConfigError(ValueError):
+    """config.json does not describe a valid split policy"""
+
+
+class SplitPolicy:
+    """One compiled policy: unit names, fixed-share weights and usage mode"""
+
+    def __init__(self, name: str, units: Tuple[str, ...], weights: np.ndarray, usage_mode: Optional[str]):
+        self.name = name
+        self.units = units
+        self.weights = weights
+        self.usage_mode = usage_mode
+        self._no_usage = np.zeros(len(units))
+
+    def split(self, total: float, fixed: float = 0.0, unit_usage: Optional[Sequence[float]] = None,
+              vat: Optional[float] = None) -> Dict[str, np.ndarray]:
+        """split_engine.split_bill under this policy ((N,) arrays in shekels, in self.units order)"""
+        if self.usage_mode is None:
+            # Whole bill by the fixed shares (arnona)
+            return split_bill(total, total, self._no_usage, self.weights, vat)
+        if self.usage_mode == 'fixed' or unit_usage is None or not any(unit_usage):
+            # No meter readings: the usage charge follows the fixed shares too
+            unit_usage = self.weights
+        return split_bill(total, fixed or 0.0, unit_usage, self.weights, vat)
+
+
+def _compile_weights(name: str, key: str, shares) -> Tuple[Tuple[str, ...], np.ndarray]:
+    if not isinstance(shares, dict) or not shares:
+        raise ConfigError(f"{name}.{key} must be a non-empty object of unit -> share")
+    units = tuple(shares)
+    try:
+        weights = np.array([float(shares[unit]) for unit in units])
+    except (TypeError, ValueError):
+        raise ConfigError(f"{name}.{key} shares must be numbers: {shares}")
+    if (weights < 0).any():
+        raise ConfigError(f"{name}.{key} shares must not be negative: {shares}")
+    if abs(weights.sum() - 1.0) > WEIGHT_TOLERANCE:
+        raise ConfigError(f"{name}.{key} shares must add up to 1, got {weights.sum():g}")
+    return units, weights
+
+
+def compile_policy(name: str, spec: Dict) -> SplitPolicy:
+    if not isinstance(spec, dict):
+        raise ConfigError(f"{name} must be an object")
+    if spec.get('type') == 'fixed':
+        units, weights = _compile_weights(name, 'split', spec.get('split'))
+        return SplitPolicy(name, units, weights, None)
+    usage_mode = spec.get('usage_split')
+    if usage_mode not in USAGE_MODES:
+        raise ConfigError(f"{name}.usage_split must be one of {USAGE_MODES}, got {usage_mode!r}")
+    units, weights = _compile_weights(name, 'fixed_split', spec.get('fixed_split'))
+    return SplitPolicy(name, units, weights, usage_mode)
+
+
+def compile_policies(config: Dict) -> Dict[str, SplitPolicy]:
+    """Validate a parsed config.json and compile every policy in it"""
+    if not isinstance(config, dict) or not config:
+        raise ConfigError("config must be a non-empty object of policies")
+    policies = {name: compile_policy(name, spec) for name, spec in config.items()}
+    unit_sets = {policy.units for policy in policies.values()}
+    if len(unit_sets) > 1:
+        raise ConfigError(f"all policies must name the same units in the same order: {sorted(unit_sets)}")
+    for alias, name in BILL_TYPE_ALIASES.items():
+        if name in policies:
+            policies.setdefault(alias, policies[name])
+    return policies
+
+
+def load_policies(path: str) -> Dict[str, SplitPolicy]:
+    with open(path, encoding='utf-8') as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ConfigError(f"{path}: {e}")
+    return compile_policies(config)
+
+
+class PolicyRegistry:
+    """Compiled policies for one config file, recompiled when the file changes"""
+
+    def __init__(self, path: str = DEFAULT_CONFIG_PATH):
+        self.path = path
+        self.last_error: Optional[str] = None
+        self.generation = 0  # bumped on every successful reload; part of memoization keys
+        self._lock = threading.Lock()
+        self._mtime = os.stat(path).st_mtime_ns
+        self._policies = load_policies(path)
+        self._next_check = time.monotonic() + RELOAD_CHECK_SECONDS
+
+    def _maybe_reload(self) -> None:
+        now = time.monotonic()
+        if now < self._next_check:
+            return
+        with self._lock:
+            self._next_check = now + RELOAD_CHECK_SECONDS
+            try:
+                mtime = os.stat(self.path).st_mtime_ns
+            except OSError as e:
+                self.last_error = str(e)
+                return
+            if mtime == self._mtime:
+                return
+            self._mtime = mtime
+            try:
+                self._policies = load_policies(self.path)
+                self.generation += 1
+                self.last_error = None
+            except (OSError, ConfigError) as e:
+                # Keep splitting with the last good policies
+                self.last_error = str(e)
+
+    def policy(self, bill_type: str) -> SplitPolicy:
+        self._maybe_reload()
+        try:
+            return self._policies[bill_type]
+        except KeyError:
+            raise ConfigError(f"no split policy for {bill_type!r} in {self.path}")
+
+    def policies(self) -> Dict[str, SplitPolicy]:
+        self._maybe_reload()
+        return self._policies
+
+
+_shared_registry = None
+_shared_lock = threading.Lock()
+
+
+def get_policies() -> PolicyRegistry:
+    """Process-wide registry for config.json (survives Streamlit reruns)"""
+    global _shared_registry
+    with _shared_lock:
+        if _shared_registry is None:
+            _shared_registry = PolicyRegistry()
+        return _shared_registry
@@ -0,0 +1,127 @@
+"""Streamed replies parse to the same object however they are chunked, and stop at its closing brace."""
+import json
+
+import pytest
+
+from json_stream import JSONObjectParser, stream_json, stream_reply, text_chunks
+
+REPLY = ('Here is the JSON:\n```json\n{"total_amount": 252.72, "label": "a \\"quoted\\" {brace}, [bracket]",'
+         ' "items": {"Arnona": 1741.1, "list": [1, 2, {"x": "}"}]}, "vat": null}\n```\nLet me know if you need more!')
+OBJECT = json.loads(REPLY[REPLY.index('{'):REPLY.rindex('}') + 1])
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize('size', [1, 2, 3, 7, 16, len(REPLY)])
+def test_any_chunking_gives_the_object(size):
+    parser = JSONObjectParser()
+    fields = []
+    for chunk in chunked(REPLY, size):
+        fields.extend(parser.feed(chunk))
+    assert parser.done
+    assert parser.value() == OBJECT
+    assert fields == list(OBJECT.items())
+
+
+def test_every_split_point_gives_the_object():
+    for cut in range(len(REPLY) + 1):
+        parser = JSONObjectParser()
+        parser.feed(REPLY[:cut])
+        parser.feed(REPLY[cut:])
+        assert parser.value() == OBJECT, cut
+
+
+def test_field_reported_when_its_value_completes():
+    parser = JSONObjectParser()
+    assert parser.feed('{"total_amount": 252.7') == []
+    assert parser.feed('2, "vat"') == [('total_amount', 252.72)]
+    assert parser.feed(': 36.72}') == [('vat', 36.72)]
+    assert parser.done and parser.result == {'total_amount': 252.72, 'vat': 36.72}
+
+
+def test_text_after_the_object_is_ignored():
+    parser = JSONObjectParser()
+    parser.feed('{"a": 1} and {"b": 2}')
+    assert parser.text == '{"a": 1}'
+    assert parser.feed('{"c": 3}') == []
+    assert parser.value() == {'a': 1}
+
+
+def test_unfinished_object_has_no_value():
+    parser = JSONObjectParser()
+    parser.feed('no object yet')
+    parser.feed('{"a": 1, "b": ')
+    assert not parser.done
+    assert parser.value() is None
+    assert parser.result == {'a': 1}
+
+
+def test_trailing_comma_member_is_skipped_by_the_field_parser():
+    parser = JSONObjectParser()
+    assert parser.feed('{"a": 1,}') == [('a', 1)]
+    with pytest.raises(json.JSONDecodeError):
+        parser.value()
+
+
+def test_stream_json_stops_reading_at_the_closing_brace():
+    consumed = []
+
+    def chunks():
+        for chunk in ['pre {"a": ', '1}', ' chatter', ' never read']:
+            consumed.append(chunk)
+            yield chunk
+    seen = []
+    value, reply = stream_json(chunks(), lambda key, value: seen.append((key, value)))
+    assert value == {'a': 1}
+    assert reply == '{"a": 1}'
+    assert seen == [('a', 1)]
+    assert consumed == ['pre {"a": ', '1}']
+
+
+def test_stream_json_without_an_object_returns_the_text():
+    assert stream_json(iter(['no ', 'json'])) == (None, 'no json')
+    assert stream_json(iter(['{"a": 1,}'])) == (None, '{"a": 1,}')
+
+
+class Chunk:
+    def __init__(self, text=None, content=None, fails=False):
+        self._text, self.content, self._fails = text, content, fails
+
+    @property
+    def text(self):
+        if self._fails:
+            raise ValueError("no text parts")
+        return self._text
+
+
+class GenerativeModel:
+    """google.generativeai's streaming interface"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def generate_content(self, prompt, stream=False):
+        assert stream
+        return iter(Chunk(text=text) for text in self.chunks)
+
+
+class ChatModel:
+    """LangChain's streaming interface"""
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def stream(self, prompt):
+        return iter(Chunk(content=text) for text in self.chunks)
+
+
+@pytest.mark.parametrize('model_class', [GenerativeModel, ChatModel])
+def test_stream_reply_cuts_after_the_object(model_class):
+    model = model_class(chunked(REPLY, 5))
+    reply = stream_reply(model, 'prompt')
+    assert json.loads(reply) == OBJECT
+
+
+def test_text_chunks_skips_chunks_without_text():
+    chunks = [Chunk(text='{"a": 1}'), Chunk(fails=True)]
+    assert list(text_chunks(chunks)) == ['{"a": 1}', '']
@@ -0,0 +1,106 @@
+"""Meter OCR candidates: digit groups joined only within one line of one OCR output, scored against history."""
+import pytest
+
+from meter_ranker import (DEFAULT_CONFIDENCE, IMPOSSIBLE, JOIN_PENALTY, PLAUSIBILITY_FLOOR, TSV_HEADER, _numbers,
+                          best_reading, expectation, plausibility, rank, tokens)
+from meter_store import MeterStore
+
+DAY = 86400.0
+HEADER = TSV_HEADER + '\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext'
+
+
+def tsv(*words, line=1):
+    """One tesseract image_to_data output: (text, conf) words, all on the given line"""
+    rows = [HEADER] + [f'5\t1\t1\t1\t{line}\t{i}\t0\t0\t10\t10\t{conf}\t{text}' for i, (text, conf) in enumerate(words, 1)]
+    return '\n'.join(rows)
+
+
+def values(numbers):
+    return [number for number, _ in numbers]
+
+
+def test_numbers_joins_adjacent_digit_groups():
+    numbers = _numbers([('12', 0.9), ('345', 0.7)])
+    assert numbers == [('12', 0.9), ('345', 0.7), ('12345', pytest.approx(0.7 * JOIN_PENALTY))]
+
+
+def test_numbers_joins_pairs_only_and_keeps_decimals():
+    assert values(_numbers([('1', 1.0), ('23', 1.0), ('45', 1.0)])) == ['1', '23', '123', '45', '2345']
+    assert values(_numbers([('12', 1.0), ('345.6', 1.0)])) == ['12', '345.6', '12345.6']
+    # A decimal does not start a join
+    assert values(_numbers([('12.5', 1.0), ('345', 1.0)])) == ['12.5', '345']
+
+
+def test_numbers_does_not_join_across_words():
+    assert values(_numbers([('12', 1.0), ('kWh', 1.0), ('345', 1.0)])) == ['12', '345']
+    assert values(_numbers([('No.12', 1.0), ('345', 1.0)])) == ['12', '345']
+    assert values(_numbers([('12,345', 1.0)])) == ['12345']
+
+
+def test_tokens_of_plain_text():
+    assert tokens('12 345\nkWh') == [[('12', DEFAULT_CONFIDENCE), ('345', DEFAULT_CONFIDENCE)], [('kWh', DEFAULT_CONFIDENCE)]]
+    assert tokens('') == []
+
+
+def test_tokens_of_tsv_use_word_confidence():
+    assert tokens(tsv(('12', 90), ('345', 80))) == [[('12', 0.9), ('345', 0.8)]]
+    # Empty words and tesseract's -1 for non-words
+    assert tokens(tsv(('', 95), ('678', -1))) == [[('678', 0.0)]]
+
+
+def test_concatenated_tsv_outputs_are_never_joined():
+    # meter_ocr's stages: the same (page, block, paragraph, line) in two outputs is two lines
+    text = tsv(('12', 90)) + '\n' + tsv(('345', 90))
+    assert tokens(text) == [[('12', 0.9)], [('345', 0.9)]]
+    assert 12345 not in [candidate.value for candidate in rank(text)]
+    assert 12345 in [candidate.value for candidate in rank(tsv(('12', 90), ('345', 90)))]
+
+
+def test_rank_prefers_meter_length_numbers():
+    ranked = rank('Serial 7 Reading 04512 Year 2019991')
+    assert ranked[0].value == 4512
+    assert ranked[0].digits == 5  # the leading zero is a dial digit
+    assert 2019991 not in [candidate.value for candidate in ranked]
+
+
+def series_of(tmp_path, readings):
+    store = MeterStore(str(tmp_path / 'meters.sqlite3'))
+    for day, reading in readings:
+        store.record('m', reading, taken_at=day * DAY)
+    return store.series('m')
+
+
+def test_expectation_extrapolates_recent_usage(tmp_path):
+    series = series_of(tmp_path, [(0, 1000), (30, 1300), (60, 1600)])
+    expected = expectation(series, at=90 * DAY)
+    assert expected['latest'] == 1600
+    assert expected['usage'] == pytest.approx(300)
+    assert expected['spread'] == pytest.approx(150)
+
+
+def test_expectation_without_a_rate(tmp_path):
+    assert expectation(series_of(tmp_path, [(0, 1000)]), at=DAY) == {'latest': 1000, 'usage': None, 'spread': None}
+    assert expectation(None) is None
+
+
+def test_plausibility():
+    expected = {'latest': 1600.0, 'usage': 300.0, 'spread': 150.0}
+    assert plausibility(1900, expected) == pytest.approx(1.0)
+    assert plausibility(1600 + 300 + 150, expected) == pytest.approx(0.6065, abs=1e-4)
+    assert plausibility(9000, expected) == PLAUSIBILITY_FLOOR  # possible, but far from the history
+    assert plausibility(1500, expected) == IMPOSSIBLE  # below the latest reading
+    assert plausibility(50000, expected) == IMPOSSIBLE  # a jump no period's consumption explains
+    assert plausibility(1500, None) == 1.0
+    assert plausibility(1700, {'latest': 1600.0, 'usage': None, 'spread': None}) == 1.0
+
+
+def test_history_outvotes_a_more_confident_misread():
+    expected = {'latest': 1600.0, 'usage': 300.0, 'spread': 150.0}
+    text = tsv(('1180', 95), ('1890', 70))
+    assert best_reading(text) == 1180
+    assert best_reading(text, expected) == 1890
+
+
+def test_best_reading_without_candidates():
+    assert best_reading('no digits here') is None
+    assert best_reading('') is None
@@ -0,0 +1,140 @@
+"""Meter readings: rollovers, misreads, replacements, atomic batches and other processes' appends."""
+import pytest
+
+import meter_store
+from meter_store import MeterReadingError, MeterStore, plausible_delta, reading_delta
+
+ELEC = 'apt1:electricity'
+WATER = 'apt1:water'
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'meters.sqlite3')
+
+
+@pytest.fixture
+def store(path):
+    return MeterStore(path)
+
+
+@pytest.mark.parametrize('previous, current, delta', [
+    (1200, 1450, 250),
+    (1200, 1200, 0),
+    (99950, 30, 80),  # 5-digit dial
+    (999950, 30, 80),  # 6-digit dial
+    (99999, 0, 1),
+    (95000, 4999, 9999),  # just within a tenth of the dial
+])
+def test_reading_delta(previous, current, delta):
+    assert reading_delta(previous, current) == delta
+
+
+@pytest.mark.parametrize('previous, current', [
+    (1200, 1100),  # backwards, no rollover
+    (50000, 100),  # a wrap of half the dial
+    (5000, 50000),  # 50000 read for 5000
+    (500000, 650000),  # more than a tenth of a 6-digit dial
+])
+def test_implausible_reading_is_a_misread(previous, current):
+    with pytest.raises(MeterReadingError):
+        reading_delta(previous, current)
+    assert plausible_delta(previous, current) is None
+
+
+def test_record_returns_consumption(store):
+    assert store.record(ELEC, 1000, taken_at=1.0) is None
+    assert store.record(ELEC, 1250, taken_at=2.0) == 250
+    assert store.record(ELEC, 1250, taken_at=3.0) == 0.0  # a rerun stores nothing
+    assert len(store.series(ELEC)) == 2
+    assert store.latest_reading(ELEC) == 1250
+    assert store.consumption(ELEC, 1250) == 250  # already the latest: its recorded delta
+    assert store.consumption(ELEC, 1300) == 50
+
+
+def test_record_across_rollover(store):
+    store.record(WATER, 99990, taken_at=1.0)
+    assert store.record(WATER, 15, taken_at=2.0) == 25
+    series = store.series(WATER)
+    assert series.consumption_between(0.0, 2.0) == 25
+
+
+def test_misread_is_not_stored(store):
+    store.record(ELEC, 5000, taken_at=1.0)
+    with pytest.raises(MeterReadingError):
+        store.record(ELEC, 50000, source='ocr', taken_at=2.0)
+    assert store.latest_reading(ELEC) == 5000
+    assert store.record(ELEC, 5400, taken_at=3.0) == 400
+
+
+def test_readings_in_time_order(store):
+    store.record(ELEC, 1000, taken_at=5.0)
+    with pytest.raises(MeterReadingError):
+        store.record(ELEC, 1100, taken_at=4.0)
+
+
+def test_unknown_source_rejected(store):
+    with pytest.raises(ValueError):
+        store.record(ELEC, 1000, source='guess')
+
+
+def test_replacement_starts_a_new_segment(store):
+    store.record(ELEC, 42000, taken_at=1.0)
+    store.replace_meter(ELEC, new_reading=0.0, final_reading=42300, taken_at=2.0)
+    assert store.consumption(ELEC, 0.0) is None  # no consumption spans the swap
+    assert store.record(ELEC, 180, taken_at=3.0) == 180
+    entries = store.series(ELEC).entries()
+    assert [(e['reading'], e['delta'], e['replacement']) for e in entries] == [
+        (180, 180, False), (0.0, 0.0, True), (42300, 300, False), (42000, 0.0, False)]
+
+
+def test_record_period_with_another_previous_reading(store):
+    store.record(WATER, 300, taken_at=1.0)
+    # The bill's previous reading is not the stored one: the stored delta is still the bill's
+    assert store.record_period(WATER, 320, 345) == 25
+    assert store.series(WATER).entries(1)[0]['delta'] == 25
+
+
+def test_record_many_is_atomic(store):
+    store.record_many({ELEC: 1000, WATER: 300}, taken_at=1.0)
+    with pytest.raises(MeterReadingError):
+        # The water reading is a misread: the electricity one must not be written either
+        store.record_many({ELEC: 1100, WATER: 200}, taken_at=2.0)
+    assert store.latest_reading(ELEC) == 1000
+    assert store.latest_reading(WATER) == 300
+    assert store.record_many({ELEC: 1100, WATER: 310}, taken_at=3.0) == {ELEC: 100, WATER: 10}
+
+
+def test_record_many_replacement(store):
+    store.record_many({ELEC: 1000, WATER: 300}, taken_at=1.0)
+    assert store.record_many({ELEC: 5, WATER: 2}, taken_at=2.0, replacement=True) == {ELEC: None, WATER: None}
+    assert store.consumption(ELEC, 25) == 20
+
+
+def test_other_process_rows_are_synced(path, monkeypatch):
+    monkeypatch.setattr(meter_store, 'SYNC_SECONDS', 3600.0)
+    first, second = MeterStore(path), MeterStore(path)
+    first.record(ELEC, 1000, taken_at=1.0)
+    assert second.latest_reading(ELEC) == 1000
+    first.record(ELEC, 1100, taken_at=2.0)
+    # Within SYNC_SECONDS the second store serves its cached series...
+    assert second.latest_reading(ELEC) == 1000
+    # ...but validates a write against the rows the first one added
+    with pytest.raises(MeterReadingError):
+        second.record(ELEC, 1050, taken_at=3.0)
+    assert second.record(ELEC, 1150, taken_at=3.0) == 50
+    assert [e['reading'] for e in second.series(ELEC).entries()] == [1150, 1100, 1000]
+    monkeypatch.setattr(meter_store, 'SYNC_SECONDS', 0.0)
+    assert first.latest_reading(ELEC) == 1150
+
+
+def test_racing_rows_count_no_consumption(path):
+    # Another process validated 310 against a view without 320 and wrote it: it cannot follow 320 here
+    store = MeterStore(path)
+    store.record(WATER, 300, taken_at=1.0)
+    store.record(WATER, 320, taken_at=2.0)
+    with store._conn:
+        store._conn.execute("INSERT INTO meter_readings (meter, taken_at, reading, source, kind) VALUES (?, ?, ?, ?, ?)",
+                            (WATER, 2.0, 310, 'manual', meter_store.READING))
+    latest = MeterStore(path).series(WATER).latest()
+    assert (latest['reading'], latest['delta'], latest['replacement']) == (310, 0.0, True)
@@ -0,0 +1,117 @@
+"""Properties of the agorot split engine: every share adds up exactly to what it splits.
+
+Random cases are seeded, so a failure names the seed that reproduces it.
+"""
+import numpy as np
+import pytest
+
+from split_engine import allocate_cents, split_bill, split_bills, split_priced, to_cents
+
+SEEDS = range(20)
+
+
+def random_amounts(rng, count, low=-500_000, high=500_000):
+    return rng.integers(low, high, size=count, dtype=np.int64)
+
+
+@pytest.mark.parametrize('amount, cents', [
+    (1.005, 101), (0.125, 13), (-0.125, -13), (2.675, 268), (0.015, 2), (-1.005, -101), (0.0, 0), (1234.56, 123456),
+])
+def test_to_cents_rounds_half_away_from_zero(amount, cents):
+    assert to_cents([amount])[0] == cents
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_allocate_cents_rows_sum_to_amounts(seed):
+    rng = np.random.default_rng(seed)
+    units = int(rng.integers(1, 12))
+    amounts = random_amounts(rng, 200)
+    weights = rng.uniform(0, 10, size=(200, units))
+    weights[rng.random(size=weights.shape) < 0.2] = 0.0  # some units without consumption
+    cents = allocate_cents(amounts, weights)
+    assert cents.dtype == np.int64
+    assert (cents.sum(axis=1) == amounts).all()
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_allocate_cents_within_one_agora_of_exact_share(seed):
+    rng = np.random.default_rng(seed)
+    amounts = random_amounts(rng, 200)
+    weights = rng.uniform(0.01, 10, size=(200, 4))
+    exact = amounts[:, None] * weights / weights.sum(axis=1, keepdims=True)
+    assert (np.abs(allocate_cents(amounts, weights) - exact) < 1).all()
+
+
+def test_allocate_cents_half_agora_goes_to_lower_unit():
+    assert allocate_cents([1], [1.0, 1.0]).tolist() == [[1, 0]]
+    assert allocate_cents([101], [1.0, 1.0]).tolist() == [[51, 50]]
+    assert allocate_cents([-1], [1.0, 1.0]).tolist() == [[0, -1]]
+
+
+def test_allocate_cents_zero_weights_split_equally():
+    assert allocate_cents([100, 101], [0.0, 0.0, 0.0]).tolist() == [[34, 33, 33], [34, 34, 33]]
+
+
+def test_allocate_cents_negative_weights_keep_their_sign():
+    cents = allocate_cents([1000], [3.0, -1.0])
+    assert cents.tolist() == [[1500, -500]]
+
+
+def test_allocate_cents_weights_summing_to_zero_split_equally():
+    assert allocate_cents([100], [1.0, -1.0]).tolist() == [[50, 50]]
+
+
+def random_bills(rng, count, units):
+    totals = np.round(rng.uniform(-200, 5000, size=count), 2)
+    fixed = np.round(rng.uniform(-50, 300, size=count), 2)
+    vat = np.round(totals * 0.17, 2)
+    usage = np.round(rng.uniform(0, 900, size=(count, units)), 1)
+    usage[rng.random(size=count) < 0.1] = 0.0  # bills without readings
+    weights = rng.choice([1.0, 2.0, 3.0], size=units)
+    return totals, fixed, usage, weights, vat
+
+
+@pytest.mark.parametrize('seed', SEEDS)
+def test_split_bills_reconciles_every_component(seed):
+    rng = np.random.default_rng(seed)
+    totals, fixed, usage, weights, vat = random_bills(rng, 300, int(rng.integers(2, 6)))
+    result = split_bills(totals, fixed, usage, weights, vat)
+    assert (result['fixed'].sum(axis=1) == to_cents(fixed)).all()
+    assert (result['usage'].sum(axis=1) == to_cents(totals) - to_cents(fixed)).all()
+    assert (result['vat'].sum(axis=1) == to_cents(vat)).all()
+    assert (result['total'].sum(axis=1) == to_cents(totals) + to_cents(vat)).all()
+    assert (result['total'] == result['fixed'] + result['usage'] + result['vat']).all()
+
+
+def test_split_bills_without_vat_totals_are_the_bills():
+    result = split_bills([100.01, 0.03], [10.0, 0.0], [[1.0, 2.0], [0.0, 0.0]])
+    assert (result['vat'] == 0).all()
+    assert result['total'].sum(axis=1).tolist() == [10001, 3]
+    assert result['usage'][1].tolist() == [2, 1]
+
+
+def test_split_bill_no_consumption_splits_usage_equally():
+    split = split_bill(100.0, 20.0, [0.0, 0.0])
+    assert split['usage'].tolist() == [40.0, 40.0]
+    assert split['total'].tolist() == [50.0, 50.0]
+
+
+def test_negative_subtotal_gets_vat_credited():
+    # Unit 1's share of a credit line outweighs its fixed share: its VAT share must be a credit too
+    result = split_bills([100.0], [-50.0], [[0.0, 1.0]], [1.0, 1.0], [17.0])
+    subtotal = result['fixed'] + result['usage']
+    assert subtotal[0].tolist() == [-2500, 12500]
+    assert result['vat'][0].tolist() == [-425, 2125]
+    assert result['total'][0].sum() == 11700
+
+
+def test_credit_bill_splits_into_credits():
+    split = split_bill(-100.0, 0.0, [1.0, 3.0], vat=-17.0)
+    assert split['total'].tolist() == [-29.25, -87.75]
+
+
+def test_split_priced_last_unit_pays_the_rest():
+    split = split_priced(fixed=30.0, usage_cost=100.0, metered_usage=[150.0], price=0.5, vat=22.1)
+    assert split['usage'].tolist() == [75.0, 25.0]
+    assert split['fixed'].tolist() == [15.0, 15.0]
+    assert round(float(split['total'].sum()), 2) == 152.1
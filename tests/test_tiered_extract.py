@@ -0,0 +1,150 @@
+"""The regex tier answers only bills that reconcile; everything else goes to the LLM."""
+import pytest
+
+import tiered_extract
+from tiered_extract import EscalationStats, reconcile, reconcile_tax, regex_or_llm, regex_fields, triage
+
+WATER_LINES = [
+    'חשבון מים',
+    'צריכה: 20 מ"ק',
+    'דמי שירות: 30.00',
+    'חיוב בגין צריכה: 186.00',
+    'סה"כ לפני מע"מ: 216.00',
+    'מע"מ 17%: 36.72',
+    'סה"כ לתשלום: 252.72',
+]
+WATER_BILL = '\n'.join(WATER_LINES)
+ELECTRICITY_BILL = '\n'.join([
+    'חברת החשמל',
+    'צריכה: 400 קוט"ש',
+    'תשלום קבוע: 12.50',
+    'תשלום בגין הספק: 20.00',
+    'חיוב בגין צריכה: 240.00',
+    'מע"מ: 46.33',
+    'סה"כ לתשלום: 318.83',
+])
+TAX_BILL = '\n'.join([
+    'עירייה - חשבון ארנונה',
+    'ארנונה למגורים: 1741.10',
+    'שמירה: 78.20',
+    'הנחה: -100.00',
+    'סה"כ לתשלום: 1719.30',
+])
+
+
+def without(text, label):
+    return '\n'.join(line for line in text.split('\n') if not line.startswith(label))
+
+
+@pytest.fixture
+def stats(monkeypatch):
+    stats = EscalationStats()
+    monkeypatch.setattr(tiered_extract, 'get_escalation_stats', lambda: stats)
+    return stats
+
+
+@pytest.mark.parametrize('text', [WATER_BILL, ELECTRICITY_BILL, TAX_BILL])
+def test_reconciling_bill_stays_on_regex_tier(text):
+    fields, reason = triage(text)
+    assert reason is None, reason
+
+
+def test_regex_fields_of_reconciling_bill():
+    fields = regex_fields(ELECTRICITY_BILL)
+    assert fields['bill_type'] == 'electricity'
+    assert fields['fixed_charges'] == pytest.approx(32.5)  # capacity charge split like the fixed ones
+    assert (fields['usage_cost'], fields['vat'], fields['consumption']) == (240.0, 46.33, 400.0)
+
+
+def test_missing_vat_escalates():
+    assert triage(without(WATER_BILL, 'מע"מ'))[1] == "missing vat"
+
+
+def test_mismatched_total_escalates():
+    text = WATER_BILL.replace('סה"כ לתשלום: 252.72', 'סה"כ לתשלום: 262.72')
+    assert triage(text)[1].startswith("does not add up: fixed + usage + VAT")
+
+
+def test_mismatched_before_vat_escalates():
+    text = WATER_BILL.replace('סה"כ לפני מע"מ: 216.00', 'סה"כ לפני מע"מ: 226.00')
+    assert triage(text)[1].startswith("does not add up: fixed + usage = ")
+
+
+def test_total_including_vat_read_as_vat_escalates():
+    # Without its own VAT line, the VAT pattern finds the "including VAT" total: that must not reconcile
+    text = without(WATER_BILL, 'מע"מ') + '\nסה"כ כולל מע"מ: 252.72'
+    fields, reason = triage(text)
+    assert fields['vat'] == 252.72
+    assert reason.startswith("does not add up")
+
+
+def test_rounding_within_tolerance_reconciles():
+    text = WATER_BILL.replace('סה"כ לתשלום: 252.72', 'סה"כ לתשלום: 252.75')
+    assert triage(text)[1] is None
+
+
+@pytest.mark.parametrize('text, reason', [
+    ('', "no text"),
+    ('   \n', "no text"),
+    ('מסמך כלשהו\nסה"כ לתשלום: 100.00', "unknown bill type"),
+    (without(WATER_BILL, 'סה"כ לתשלום'), "missing total"),
+    (without(WATER_BILL, 'צריכה'), "missing consumption"),
+    (without(WATER_BILL, 'חיוב בגין צריכה'), "missing usage_cost"),
+])
+def test_incomplete_bill_escalates(text, reason):
+    assert triage(text)[1] == reason
+
+
+def test_bill_type_given_overrides_keywords():
+    # A water bill that mentions electricity is still read as water when the user says so
+    text = WATER_BILL.replace('חשבון מים', 'חשבון מים (לא חשמל)')
+    assert triage(text)[1] == "missing consumption"
+    assert triage(text, 'water')[1] is None
+
+
+def test_reconcile_tax_line_items_less_discount():
+    fields = regex_fields(TAX_BILL)
+    assert fields['tax_items'] == {'Arnona (Municipal Tax)': 1741.10, 'Shira (City Security)': 78.20}
+    assert fields['discount'] == 100.0
+    assert reconcile_tax(fields) is None
+
+
+def test_reconcile_tax_before_discount():
+    fields = {'total_amount': 900.0, 'tax_items': {}, 'before_discount': 1000.0, 'discount': 100.0}
+    assert reconcile_tax(fields) is None
+    assert reconcile_tax({**fields, 'discount': None}).startswith("does not add up: before discount - discount")
+
+
+def test_reconcile_tax_escalates_mismatch_and_unchecked_total():
+    fields = regex_fields(TAX_BILL.replace('הנחה: -100.00', 'הנחה: -50.00'))
+    assert reconcile_tax(fields).startswith("does not add up: tax lines - discount")
+    unchecked = {'total_amount': 900.0, 'tax_items': {}, 'before_discount': None, 'discount': None}
+    assert reconcile_tax(unchecked) == "tax total not cross-checked"
+    assert reconcile({**unchecked, 'bill_type': 'tax'}) == "tax total not cross-checked"
+
+
+def test_regex_or_llm_skips_llm_for_reconciling_bill(stats):
+    def ask_llm():
+        raise AssertionError("the LLM was asked")
+    assert regex_or_llm(WATER_BILL, ask_llm, lambda fields: fields['total_amount']) == 252.72
+    assert stats.stats()['regex_only'] == 1
+
+
+def test_regex_or_llm_asks_llm_on_escalation(stats):
+    reply = {'vat': 36.72}
+    assert regex_or_llm(without(WATER_BILL, 'מע"מ'), lambda: reply, lambda fields: None) is reply
+    assert stats.stats()['reasons'] == {"missing vat": 1}
+
+
+def test_escalation_stats_counts_reasons_by_kind():
+    stats = EscalationStats()
+    for reason in (None, None, "missing vat", "does not add up: fixed + usage + VAT = 1.00, total 2.00",
+                   "does not add up: fixed + usage = 3.00, before VAT 4.00"):
+        stats.record(reason)
+    assert stats.stats() == {'documents': 5, 'regex_only': 2, 'escalated': 3, 'regex_fraction': 0.4,
+                             'reasons': {"does not add up": 2, "missing vat": 1}}
+    assert stats.summary() == "2/5 bills (40%) without an LLM call"
+
+
+def test_escalation_stats_empty():
+    assert EscalationStats().stats()['regex_fraction'] == 0.0
@@ -0,0 +1,219 @@
+"""Regex extraction first; the LLM only when the regex answer does not add up.
+
+The LLM apps (app.py, smart_bill_splitter.py, universal.bill.splitter.py)
+sent every bill to Gemini or Ollama, even bills whose text layer the regexes
+of bill_parser.py read perfectly. ``triage(text)`` runs those regexes plus
+the usage charge, VAT and before-VAT subtotal, and accepts the result only
+when it is complete and reconciles:
+
+- fixed + usage + VAT = total to pay, within ``tolerance(total)``;
+- fixed + usage = the before-VAT subtotal, when the bill prints one.
+
+A city tax bill has no usage or VAT, so its total is checked against its
+line items (arnona, security) or its before-discount amount, less the
+discount; a tax bill with neither is not trusted. Anything else (a
+missing field, a mismatch, an unknown bill type) is the reason to escalate
+to the LLM.
+
+``EscalationStats`` counts each document's outcome for this process
+(``get_escalation_stats()``), so the apps can show the share of bills that
+never needed an LLM call.
+"""
+import re
+import threading
+from collections import Counter
+from typing import Callable, Dict, Optional, Tuple
+
+from bill_parser import RE_CONSUMPTION, first_match, parse_bill_text, sum_matches
+
+ABS_TOLERANCE = 0.05  # shekels; each printed line is rounded to the agora
+REL_TOLERANCE = 0.001
+
+AMOUNT = r'(-?[0-9,]+\.?[0-9]*)'
+USAGE_COST_PATTERNS = [
+    rf'חיוב בגין צריכה[:\s]*{AMOUNT}',
+    rf'חיוב תקופתי מים[:\s]*{AMOUNT}',
+    rf'עלות צריכה[:\s]*{AMOUNT}',
+]
+VAT_PATTERNS = [
+    rf'(?<!ללא )(?<!לפני )מע"מ(?:\s*[0-9.]+\s*%)?[:\s]*{AMOUNT}',
+]
+BEFORE_VAT_PATTERNS = [
+    rf'סה"כ ללא מע"מ[:\s]*{AMOUNT}',
+    rf'סה"כ לפני מע"מ[:\s]*{AMOUNT}',
+]
+# Electricity charges outside bill_parser's fixed patterns that are split like them
+EXTRA_FIXED_PATTERNS = [
+    rf'תשלום בגין הספק[:\s]*{AMOUNT}',
+    rf'חיובים וזיכויים שונים[:\s]*{AMOUNT}',
+]
+
+RE_USAGE_COST = [re.compile(pattern) for pattern in USAGE_COST_PATTERNS]
+RE_VAT = [re.compile(pattern) for pattern in VAT_PATTERNS]
+RE_BEFORE_VAT = [re.compile(pattern) for pattern in BEFORE_VAT_PATTERNS]
+RE_EXTRA_FIXED = [re.compile(pattern) for pattern in EXTRA_FIXED_PATTERNS]
+
+# City tax line items, labelled as the LLM prompts label them
+TAX_LINE_PATTERNS = {
+    'Arnona (Municipal Tax)': rf'ארנונה(?: למגורים)?[:\s]*{AMOUNT}',
+    'Shira (City Security)': rf'שמירה[:\s]*{AMOUNT}',
+}
+BEFORE_DISCOUNT_PATTERNS = [
+    rf'סה"כ לפני הנחה[:\s]*{AMOUNT}',
+    rf'סכום לפני הנחה[:\s]*{AMOUNT}',
+]
+DISCOUNT_PATTERNS = [
+    rf'(?<!לפני )הנחה[:\s]*{AMOUNT}',
+]
+RE_TAX_LINES = {label: re.compile(pattern) for label, pattern in TAX_LINE_PATTERNS.items()}
+RE_BEFORE_DISCOUNT = [re.compile(pattern) for pattern in BEFORE_DISCOUNT_PATTERNS]
+RE_DISCOUNT = [re.compile(pattern) for pattern in DISCOUNT_PATTERNS]
+BEFORE_DISCOUNT_LABEL = 'Before discount'
+DISCOUNT_LABEL = 'Discount'
+
+PRICE_KEYS = {'electricity': 'price_per_kwh', 'water': 'price_per_m3'}
+
+
+def tolerance(total: float) -> float:
+    return max(ABS_TOLERANCE, REL_TOLERANCE * abs(total))
+
+
+def regex_fields(text: str, bill_type: Optional[str] = None) -> Dict:
+    """bill_parser's fields plus 'usage_cost', 'vat' and 'before_vat'; 'fixed_charges' includes capacity and various.
+
+    A tax bill also gets 'tax_items' ({label: amount} of the line items found), 'before_discount' and 'discount'.
+    """
+    fields = parse_bill_text(text)
+    if bill_type is not None and bill_type != fields['bill_type']:
+        # The user said which bill this is; keyword detection only guesses
+        fields['bill_type'] = bill_type
+        if bill_type in PRICE_KEYS:
+            fields['consumption'] = first_match([RE_CONSUMPTION[bill_type]], text)
+    fields['fixed_charges'] = (fields['fixed_charges'] or 0.0) + sum_matches(RE_EXTRA_FIXED, text)
+    fields['usage_cost'] = first_match(RE_USAGE_COST, text)
+    fields['vat'] = first_match(RE_VAT, text)
+    fields['before_vat'] = first_match(RE_BEFORE_VAT, text)
+    if fields['bill_type'] == 'tax':
+        items = {label: first_match([pattern], text) for label, pattern in RE_TAX_LINES.items()}
+        fields['tax_items'] = {label: value for label, value in items.items() if value is not None}
+        fields['before_discount'] = first_match(RE_BEFORE_DISCOUNT, text)
+        discount = first_match(RE_DISCOUNT, text)
+        # Printed as "-50.00" on some bills and "50.00" on others
+        fields['discount'] = None if discount is None else abs(discount)
+    return fields
+
+
+def reconcile(fields: Dict) -> Optional[str]:
+    """None if the fields are complete and add up, else why not"""
+    total = fields['total_amount']
+    if total is None:
+        return "missing total"
+    if fields['bill_type'] == 'tax':
+        return reconcile_tax(fields)
+    if fields['bill_type'] not in PRICE_KEYS:
+        return "unknown bill type"
+    for name in ('usage_cost', 'vat', 'consumption'):
+        if fields[name] is None:
+            return f"missing {name}"
+    if fields['consumption'] <= 0:
+        return "missing consumption"
+    fixed, usage, vat = fields['fixed_charges'], fields['usage_cost'], fields['vat']
+    if abs(fixed + usage + vat - total) > tolerance(total):
+        return f"does not add up: fixed + usage + VAT = {fixed + usage + vat:.2f}, total {total:.2f}"
+    before_vat = fields['before_vat']
+    if before_vat is not None and abs(fixed + usage - before_vat) > tolerance(before_vat):
+        return f"does not add up: fixed + usage = {fixed + usage:.2f}, before VAT {before_vat:.2f}"
+    return None
+
+
+def reconcile_tax(fields: Dict) -> Optional[str]:
+    """A tax bill's total must match its line items, or its before-discount amount, less the discount"""
+    total, discount = fields['total_amount'], fields['discount'] or 0.0
+    if fields['tax_items']:
+        lines = sum(fields['tax_items'].values()) - discount
+        if abs(lines - total) > tolerance(total):
+            return f"does not add up: tax lines - discount = {lines:.2f}, total {total:.2f}"
+        return None
+    if fields['before_discount'] is not None:
+        net = fields['before_discount'] - discount
+        if abs(net - total) > tolerance(total):
+            return f"does not add up: before discount - discount = {net:.2f}, total {total:.2f}"
+        return None
+    return "tax total not cross-checked"
+
+
+def triage(text: str, bill_type: Optional[str] = None) -> Tuple[Dict, Optional[str]]:
+    """(regex fields, reason to escalate to the LLM or None)"""
+    if not text or not text.strip():
+        return {}, "no text"
+    fields = regex_fields(text, bill_type)
+    return fields, reconcile(fields)
+
+
+def tax_items(fields: Dict) -> Dict[str, float]:
+    """Reconciled tax fields as the line-item breakdown the LLM returns; the items add up to the total"""
+    items = dict(fields['tax_items']) or {BEFORE_DISCOUNT_LABEL: fields['before_discount']}
+    if fields['discount']:
+        items[DISCOUNT_LABEL] = -fields['discount']
+    return items
+
+
+def priced_bill(fields: Dict[str, Optional[float]]) -> Dict[str, float]:
+    """Reconciled fields in the smart / universal splitters' shape ('fixed_cost', 'total_usage_cost', price, 'vat')"""
+    return {'fixed_cost': fields['fixed_charges'], 'total_usage_cost': fields['usage_cost'],
+            PRICE_KEYS[fields['bill_type']]: fields['usage_cost'] / fields['consumption'], 'vat': fields['vat']}
+
+
+class EscalationStats:
+    """How many documents the regex tier answered, and why the others went to an LLM"""
+
+    def __init__(self):
+        self.documents = 0
+        self.regex_only = 0
+        self.reasons: Counter = Counter()
+        self._lock = threading.Lock()
+
+    def record(self, reason: Optional[str]) -> None:
+        """One document; reason is None when no LLM call was needed"""
+        with self._lock:
+            self.documents += 1
+            if reason is None:
+                self.regex_only += 1
+            else:
+                self.reasons[reason.split(':')[0]] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'documents': self.documents,
+                'regex_only': self.regex_only,
+                'escalated': self.documents - self.regex_only,
+                'regex_fraction': self.regex_only / self.documents if self.documents else 0.0,
+                'reasons': dict(self.reasons.most_common()),
+            }
+
+    def summary(self) -> str:
+        """'3/4 bills (75%) without an LLM call' for a caption"""
+        stats = self.stats()
+        return f"{stats['regex_only']}/{stats['documents']} bills ({stats['regex_fraction']:.0%}) without an LLM call"
+
+
+def regex_or_llm(text: str, ask_llm: Callable[[], Optional[Dict]], to_result: Callable[[Dict], Dict],
+                 bill_type: Optional[str] = None) -> Optional[Dict]:
+    """to_result(regex fields) if they reconcile, else ask_llm(); the outcome is counted either way"""
+    fields, reason = triage(text, bill_type)
+    get_escalation_stats().record(reason)
+    return to_result(fields) if reason is None else ask_llm()
+
+
+_shared_stats = None
+_shared_lock = threading.Lock()
+
+
+def get_escalation_stats() -> EscalationStats:
+    """Process-wide counters shared by every Streamlit session"""
+    global _shared_stats
+    with _shared_lock:
+        if _shared_stats is None:
+            _shared_stats = EscalationStats()
+        return _shared_stats
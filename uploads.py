@@ -0,0 +1,185 @@
+"""In-memory uploads, deduplicated by content.
+
+The apps read uploads with ``getvalue()``/``read()`` (a full copy each time)
+and app.py even wrote every upload to a fresh temp dir on each rerun, only to
+read it back. ``UploadStore.add(uploaded_file)`` instead wraps Streamlit's
+own buffer as a read-only ``memoryview`` (``UploadedFile.getbuffer()``, no
+copy) that goes straight to PIL, hashlib and base64. PyMuPDF gets one bytes
+copy when a PDF is opened (see pdf_render.open_pdf): older versions reject a
+memoryview as a stream.
+
+Uploads are keyed by SHA-256 of their content, so the same file uploaded
+again, in another session or on every rerun, is stored once; reruns find it
+by Streamlit's ``file_id`` without hashing again. Files larger than
+``SPILL_BYTES`` are written once to ``SPILL_DIR`` and served from a read-only
+memory map, so big scans are paged by the OS instead of pinned in the heap.
+"""
+import hashlib
+import io
+import mimetypes
+import mmap
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from backends import lazy
+from pdf_render import open_pdf
+
+Image = lazy('PIL')
+
+SPILL_BYTES = int(os.environ.get("UPLOAD_SPILL_BYTES", 16 * 1024 * 1024))
+SPILL_DIR = os.environ.get("UPLOAD_SPILL_DIR", os.path.join(tempfile.gettempdir(), "bill_uploads"))
+MAX_UPLOADS = 64
+
+
+class _ViewReader(io.RawIOBase):
+    """Seekable file object over a memoryview, for libraries that want a file (PIL, pdfplumber)"""
+
+    def __init__(self, view: memoryview):
+        self._view = view
+        self._pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        chunk = self._view[self._pos:self._pos + len(buffer)]
+        buffer[:len(chunk)] = chunk
+        self._pos += len(chunk)
+        return len(chunk)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._pos, io.SEEK_END: len(self._view)}[whence]
+        self._pos = max(0, base + offset)
+        return self._pos
+
+    def tell(self) -> int:
+        return self._pos
+
+
+class Upload:
+    """One uploaded file: name, MIME type, content digest and a read-only view of the bytes"""
+
+    def __init__(self, name: str, mime_type: str, digest: str, view: memoryview, spilled: bool = False):
+        self.name = name
+        self.mime_type = mime_type
+        self.digest = digest
+        self.view = view
+        self.spilled = spilled
+
+    @property
+    def size(self) -> int:
+        return len(self.view)
+
+    @property
+    def is_pdf(self) -> bool:
+        return self.mime_type == "application/pdf" or self.name.lower().endswith(".pdf")
+
+    def reader(self) -> io.BufferedReader:
+        return io.BufferedReader(_ViewReader(self.view))
+
+    def image(self):
+        return Image.open(self.reader())
+
+    def pdf(self):
+        return open_pdf(self.view)
+
+
+class UploadStore:
+    """Content-addressed uploads shared by every session of the process"""
+
+    def __init__(self, spill_bytes: int = SPILL_BYTES, spill_dir: str = SPILL_DIR, max_uploads: int = MAX_UPLOADS):
+        self.spill_bytes = spill_bytes
+        self.spill_dir = spill_dir
+        self.max_uploads = max_uploads
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._data: "OrderedDict[str, Tuple[memoryview, Optional[mmap.mmap]]]" = OrderedDict()
+        self._file_ids: Dict[str, str] = {}
+
+    def add(self, uploaded_file) -> Upload:
+        """Upload for a Streamlit UploadedFile (or any file object with getvalue())"""
+        name = getattr(uploaded_file, "name", "upload")
+        mime_type = getattr(uploaded_file, "type", None) or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        file_id = getattr(uploaded_file, "file_id", None)
+        with self._lock:
+            digest = self._file_ids.get(file_id) if file_id else None
+            if digest in self._data:
+                self.hits += 1
+                self._data.move_to_end(digest)
+                view, mapping = self._data[digest]
+                return Upload(name, mime_type, digest, view, mapping is not None)
+        if hasattr(uploaded_file, "getbuffer"):
+            view = uploaded_file.getbuffer()
+        else:
+            view = memoryview(uploaded_file.getvalue())
+        upload = self.add_bytes(name, view, mime_type)
+        if file_id:
+            with self._lock:
+                self._file_ids[file_id] = upload.digest
+        return upload
+
+    def add_bytes(self, name: str, data, mime_type: Optional[str] = None) -> Upload:
+        """Upload for raw bytes or any buffer; the buffer is kept, not copied"""
+        mime_type = mime_type or mimetypes.guess_type(name)[0] or "application/octet-stream"
+        view = memoryview(data).toreadonly()
+        digest = hashlib.sha256(view).hexdigest()
+        with self._lock:
+            if digest in self._data:
+                self.hits += 1
+                self._data.move_to_end(digest)
+                view, mapping = self._data[digest]
+                return Upload(name, mime_type, digest, view, mapping is not None)
+            self.misses += 1
+            mapping = None
+            if len(view) > self.spill_bytes:
+                mapping = self._spill(digest, view)
+                view = memoryview(mapping)
+            self._data[digest] = (view, mapping)
+            self._evict()
+        return Upload(name, mime_type, digest, view, mapping is not None)
+
+    def _spill(self, digest: str, view: memoryview) -> mmap.mmap:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, digest)
+        if not os.path.exists(path):
+            # Written under a temp name so a concurrent reader never maps a half-written file
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(view)
+            os.replace(tmp_path, path)
+        with open(path, "rb") as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def _evict(self) -> None:
+        while len(self._data) > self.max_uploads:
+            digest, (view, mapping) = self._data.popitem(last=False)
+            self._file_ids = {k: v for k, v in self._file_ids.items() if v != digest}
+            if mapping is not None:
+                # Views handed out earlier keep the mapping alive; the file can go
+                try:
+                    os.remove(os.path.join(self.spill_dir, digest))
+                except OSError:
+                    pass
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+_shared_store = None
+_shared_lock = threading.Lock()
+
+
+def get_upload_store() -> UploadStore:
+    """Process-wide upload store (survives Streamlit reruns)"""
+    global _shared_store
+    with _shared_lock:
+        if _shared_store is None:
+            _shared_store = UploadStore()
+        return _shared_store